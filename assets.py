@@ -0,0 +1,100 @@
+import threading
+
+import pygame
+
+# Sounds and fonts, loaded the first time they're used rather than when
+# the game starts, so that importing the game modules doesn't open the
+# audio device or read any files.
+#
+# preload() loads all the sounds in a background thread while the menu is
+# up, so the first key press usually finds its sound ready. A sound that
+# isn't loaded yet when it's played is loaded there and then. The mixer
+# itself is started on the main thread first, since starting SDL
+# subsystems isn't thread-safe (the window may be opening at the same
+# time): the thread only reads the files.
+
+lock = threading.Lock() # Held while loading, so nothing loads twice
+
+sounds = [] # Every Sound made, for preload()
+fonts = {} # (path, size) -> pygame Font
+mixer_failed = False # Whether the mixer couldn't be started (no audio)
+
+# ------ Sounds ------ #
+def init_mixer():
+    """
+    Starts the mixer if it isn't running yet (only tried once).
+    Returns False if there's no audio device to play sounds on.
+    """
+    global mixer_failed
+
+    if pygame.mixer.get_init():
+        return True
+    if mixer_failed:
+        return False
+
+    try:
+        pygame.mixer.init(buffer=32)
+    except pygame.error:
+        mixer_failed = True
+        return False
+
+    return True
+
+class Sound:
+    """
+    Stands in for a pygame Sound that's loaded when it's first played.
+    If there's no audio device, playing it does nothing.
+    """
+    def __init__(self, path, volume=1.0):
+        self.path = path
+        self.volume = volume
+
+        self.sound = None
+        self.loaded = False
+
+        sounds.append(self)
+
+    def load(self):
+        """Loads the sound if needed. Returns the pygame Sound (or None)."""
+        if self.loaded:
+            return self.sound
+
+        with lock:
+            if not self.loaded:
+                if init_mixer():
+                    self.sound = pygame.mixer.Sound(self.path)
+                    self.sound.set_volume(self.volume)
+
+                self.loaded = True
+
+        return self.sound
+
+    def play(self):
+        sound = self.load()
+        if sound is not None:
+            sound.play()
+
+def preload():
+    """
+    Starts the mixer, then loads every sound in a background thread.
+    Call from the main thread. Returns the thread.
+    """
+    init_mixer()
+    thread = threading.Thread(target=load_sounds, daemon=True)
+    thread.start()
+    return thread
+
+def load_sounds():
+    for sound in sounds:
+        sound.load()
+
+# ------ Fonts ------ #
+def font(path, size):
+    """Returns the font from the file at path in the given size (cached)."""
+    key = (path, size)
+    if key not in fonts:
+        if not pygame.font.get_init():
+            pygame.font.init()
+        fonts[key] = pygame.font.Font(path, size)
+
+    return fonts[key]
@@ -0,0 +1,420 @@
+import numpy as np
+
+import engine
+import rules
+from engine import (LEFT, RIGHT, DOWN, CW, CCW,
+                    SHIFT, ROTATE, MOVE, DROP, LOCK, SPAWN, CLEAR, LEVEL_UP,
+                    GAME_OVER)
+
+# Many games stepped in lockstep, with all their state in NumPy arrays.
+# The rules are the same as engine.Game, down to the randomiser, so game i
+# of a BatchGame plays out exactly like an engine.Game with the same seed
+# and inputs.
+
+# ------ Lookup tables as arrays ------ #
+
+N_TYPES = len(rules.tetriminos)
+
+# SHAPE_X[type_ID, rot] / SHAPE_Y[type_ID, rot]: mino offsets from centre
+SHAPE_X = np.array([[[dx for dx, dy in shape] for shape in shapes]
+                    for shapes in engine.SHAPES], dtype=np.int32)
+SHAPE_Y = np.array([[[dy for dx, dy in shape] for shape in shapes]
+                    for shapes in engine.SHAPES], dtype=np.int32)
+
+# KICK_X/KICK_Y[type_ID, from_rot, dir, test] where dir 0 is cw, 1 is ccw.
+# KICK_N[type_ID] is the number of tests (the rest is padding)
+MAX_KICKS = max(len(kicks[0][1]) for kicks in engine.KICKS)
+KICK_X = np.zeros((N_TYPES, 4, 2, MAX_KICKS), dtype=np.int32)
+KICK_Y = np.zeros((N_TYPES, 4, 2, MAX_KICKS), dtype=np.int32)
+KICK_N = np.zeros(N_TYPES, dtype=np.int32)
+for type_ID, kicks in enumerate(engine.KICKS):
+    KICK_N[type_ID] = len(kicks[0][1])
+    for from_rot in range(4):
+        for dir, to_rot in enumerate(((from_rot + 1) % 4, (from_rot - 1) % 4)):
+            for test, (x, y) in enumerate(kicks[from_rot][to_rot]):
+                KICK_X[type_ID, from_rot, dir, test] = x
+                KICK_Y[type_ID, from_rot, dir, test] = y
+
+FRAMES_PER_CELL = np.array(rules.frames_per_cell, dtype=np.int32)
+LOCK_DELAY = np.array(rules.lock_delay, dtype=np.int32)
+CLEAR_POINTS = np.array(rules.clear_points, dtype=np.int64)
+
+# ------ Vectorised randomiser ------ #
+
+def xorshift(state):
+    """Advances an array of engine.Randomiser states (uint32)."""
+    state = state ^ (state << np.uint32(13))
+    state ^= state >> np.uint32(17)
+    state ^= state << np.uint32(5)
+    return state
+
+def seed_states(seeds):
+    """Array version of engine.Randomiser.__init__."""
+    seeds = np.asarray(seeds, dtype=np.uint64) & 0xFFFFFFFF
+    states = (seeds * 0x9E3779B1 + 0x7F4A7C15) & 0xFFFFFFFF
+    states[states == 0] = 1
+    return states.astype(np.uint32)
+
+# ------ Class for many games at once ------ #
+class BatchGame:
+    """
+    N games of Tetrix, all advanced one frame by each call to step().
+
+    Every piece of state is an array with one entry per game, e.g.
+    points[i] is the score of game i. The board of game i is cells[i],
+    laid out like engine.Board.cells.
+
+    Games that are over stay over (and stop changing) until reset.
+    """
+    hidden = engine.Board.hidden
+
+    def __init__(self, n, start_level=0, cols=rules.COLS, rows=rules.ROWS,
+                 seeds=None):
+        self.n = n
+        self.cols = cols
+        self.rows = rows
+        self.height = rows + self.hidden
+        self.spawn_x = rules.spawn_pos[0] + (cols - rules.COLS) // 2
+        self.spawn_y = rules.spawn_pos[1]
+
+        self.games = np.arange(n)
+
+        self.cells = np.full((n, self.height, cols), -1, dtype=np.int8)
+        self.row_fill = np.zeros((n, self.height), dtype=np.int32)
+
+        self.type_ID = np.zeros(n, dtype=np.int32)
+        self.rot_index = np.zeros(n, dtype=np.int32)
+        self.x = np.zeros(n, dtype=np.int32)
+        self.y = np.zeros(n, dtype=np.int32)
+        self.lock_timer = np.zeros(n, dtype=np.int32)
+        self.next_type = np.zeros(n, dtype=np.int32)
+
+        self.spawn_freeze_timer = np.zeros(n, dtype=np.int32)
+        self.frame_counter = np.zeros(n, dtype=np.int32)
+        self.DAS_counter = np.zeros(n, dtype=np.int32)
+        self.soft_drop = np.zeros(n, dtype=bool)
+        self.soft_drop_fpc = np.zeros(n, dtype=np.int32)
+
+        self.start_level = np.zeros(n, dtype=np.int32)
+        self.level = np.zeros(n, dtype=np.int32)
+        self.lines = np.zeros(n, dtype=np.int64)
+        self.points = np.zeros(n, dtype=np.int64)
+        self.game_over = np.zeros(n, dtype=bool)
+
+        self.seed = np.zeros(n, dtype=np.uint32)
+        self.rng_state = np.zeros(n, dtype=np.uint32)
+
+        self.reset(seeds=seeds, start_level=start_level)
+
+    def reset(self, games=None, seeds=None, start_level=0):
+        """
+        Starts new games in the given slots (all of them by default).
+        seeds and start_level can be single values or one per game.
+        """
+        if games is None:
+            games = self.games
+        games = np.asarray(games)
+        if games.dtype == bool:
+            games = games.nonzero()[0]
+
+        if seeds is None:
+            seeds = np.random.randint(0, 2**32, len(games), dtype=np.uint64)
+        seeds = np.broadcast_to(np.asarray(seeds, dtype=np.uint64),
+                                games.shape)
+
+        self.cells[games] = -1
+        self.row_fill[games] = 0
+
+        self.spawn_freeze_timer[games] = rules.max_spawn_freeze
+        self.frame_counter[games] = 1
+        self.DAS_counter[games] = 0
+        self.soft_drop[games] = False
+
+        self.start_level[games] = start_level
+        self.level[games] = start_level
+        self.lines[games] = 0
+        self.points[games] = 0
+        self.game_over[games] = False
+
+        self.soft_drop_fpc[games] = np.where(
+                FRAMES_PER_CELL[self.level[games]] > 3, 2, 1)
+
+        self.seed[games] = seeds & 0xFFFFFFFF
+        self.rng_state[games] = seed_states(seeds)
+
+        first = self.randint(games, N_TYPES)
+        self.spawn(games, first)
+        self.next_type[games] = self.next_piece(games, first)
+
+    # --- Randomiser --- #
+
+    def randint(self, games, n):
+        """Advances the generators of some games. Returns numbers 0 to n-1."""
+        self.rng_state[games] = xorshift(self.rng_state[games])
+        return (self.rng_state[games] % n).astype(np.int32)
+
+    def next_piece(self, games, prev):
+        """Array version of engine.Randomiser.next_piece."""
+        roll = self.randint(games, N_TYPES + 1) # 0-7
+
+        # If roll is 7 or same as previous, reroll 0-6
+        reroll = (roll == N_TYPES) | (roll == prev)
+        roll[reroll] = self.randint(games[reroll], N_TYPES)
+
+        return roll
+
+    # --- Piece logic --- #
+
+    def fits(self, games, x, y, rot):
+        """
+        Checks if the pieces of some games would fit centred at (x, y) in
+        rotation state rot. Arguments are arrays with one entry per game.
+        """
+        type_ID = self.type_ID[games]
+        xs = x[:, None] + SHAPE_X[type_ID, rot]
+        ys = y[:, None] + SHAPE_Y[type_ID, rot]
+
+        inside = ((xs >= 0) & (xs < self.cols) &
+                  (ys >= -self.hidden) & (ys < self.rows))
+
+        cells = self.cells[
+                games[:, None],
+                np.clip(ys + self.hidden, 0, self.height - 1),
+                np.clip(xs, 0, self.cols - 1)]
+
+        return (inside & (cells < 0)).all(axis=1)
+
+    def shift(self, games, dx):
+        """Shifts pieces sideways where possible. Returns which moved."""
+        x = self.x[games] + dx
+        moved = self.fits(games, x, self.y[games], self.rot_index[games])
+        self.x[games[moved]] = x[moved]
+        return moved
+
+    def rotate(self, games, dir):
+        """
+        Rotates pieces clockwise (dir 0) or anti-clockwise (dir 1), with
+        SRS wall kicks. Returns which rotated.
+        """
+        type_ID = self.type_ID[games]
+        from_rot = self.rot_index[games]
+        to_rot = (from_rot + (1 if dir == 0 else -1)) % 4
+
+        rotated = np.zeros(len(games), dtype=bool)
+        for test in range(MAX_KICKS):
+            todo = ~rotated & (test < KICK_N[type_ID])
+            if not todo.any():
+                break
+
+            x = self.x[games] + KICK_X[type_ID, from_rot, dir, test]
+            y = self.y[games] + KICK_Y[type_ID, from_rot, dir, test]
+            ok = todo & self.fits(games, x, y, to_rot)
+
+            # Wall kick was successful :)
+            self.x[games[ok]] = x[ok]
+            self.y[games[ok]] = y[ok]
+            self.rot_index[games[ok]] = to_rot[ok]
+            rotated |= ok
+
+        return rotated
+
+    def landed(self, games):
+        return ~self.fits(games, self.x[games], self.y[games] + 1,
+                          self.rot_index[games])
+
+    def spawn(self, games, type_ID):
+        self.type_ID[games] = type_ID
+        self.rot_index[games] = 0
+        self.x[games] = self.spawn_x
+        self.y[games] = self.spawn_y
+        self.lock_timer[games] = 32
+
+    # --- The actual gameplay stuff --- #
+
+    def step(self, pressed=0, held=0):
+        """
+        Advances every game by one frame.
+
+        pressed, held: input bits like engine.Game.step, either one value
+        for all games or an array with one value per game.
+
+        Returns an array with the event bits of each game.
+        """
+        n = self.n
+        pressed = np.broadcast_to(np.asarray(pressed, dtype=np.int32), (n,))
+        held = np.broadcast_to(np.asarray(held, dtype=np.int32), (n,))
+        events = np.zeros(n, dtype=np.int32)
+
+        live = ~self.game_over
+        fpc = FRAMES_PER_CELL[self.level]
+
+        # --- Shifting, rotating and soft drop on keypress --- #
+
+        keys = live & (pressed != 0) & (self.lock_timer > 0)
+
+        down = keys & (pressed & DOWN != 0)
+        self.soft_drop[down] = True
+        self.spawn_freeze_timer[down] = 0
+
+        for bit, dx in ((LEFT, -1), (RIGHT, 1)):
+            games = (keys & (pressed & bit != 0)).nonzero()[0]
+            events[games] |= SHIFT
+            events[games[self.shift(games, dx)]] |= MOVE
+            self.DAS_counter[games] = 0
+            self.spawn_freeze_timer[games] = np.minimum(
+                    fpc[games], self.spawn_freeze_timer[games])
+
+        for bit, dir in ((CW, 0), (CCW, 1)):
+            games = (keys & (pressed & bit != 0)).nonzero()[0]
+            events[games] |= ROTATE
+            events[games[self.rotate(games, dir)]] |= MOVE
+            self.spawn_freeze_timer[games] = np.minimum(
+                    fpc[games], self.spawn_freeze_timer[games])
+
+        # Releasing DOWN stops soft drop
+        self.soft_drop &= ~live | (held & DOWN != 0)
+
+        # --- Auto-shift --- #
+
+        left_held = held & LEFT != 0
+        right_held = held & RIGHT != 0
+
+        auto = live & (left_held != right_held) & (self.lock_timer > 0)
+        self.DAS_counter[auto] += 1
+        self.spawn_freeze_timer[auto] = 0
+
+        games = (auto & (self.DAS_counter == rules.DAS)).nonzero()[0]
+        dx = np.where(left_held[games], -1, 1)
+        events[games[self.shift(games, dx)]] |= SHIFT | MOVE
+        self.DAS_counter[games] = rules.DAS - rules.ARR
+
+        # --- Falling and landing --- #
+
+        # If soft dropping, make lock delay 2 frames
+        cap = live & self.soft_drop & (self.lock_timer > 2)
+        self.lock_timer[cap] = 2
+
+        # If tetrimino has landed, start locking timer
+        landed = np.zeros(n, dtype=bool)
+        landed[live] = self.landed(self.games[live])
+        self.lock_timer[landed] -= 1
+
+        can_fall = (live & (self.lock_timer > 0) &
+                    (self.spawn_freeze_timer <= 0))
+        gravity = (can_fall & ~self.soft_drop &
+                   (self.frame_counter % fpc == 0))
+        dropping = (can_fall & self.soft_drop &
+                    (self.frame_counter % self.soft_drop_fpc == 0))
+
+        games = ((gravity | dropping) & ~landed).nonzero()[0]
+        self.y[games] += 1
+        self.lock_timer[games] = LOCK_DELAY[self.level[games]]
+        events[games] |= MOVE
+
+        # Pushdown points (1 point for each frame during soft drop)
+        self.points[dropping] += 1
+        events[dropping] |= DROP
+
+        events[live & (self.lock_timer == 0)] |= LOCK
+
+        # --- After tetrimino has locked and flashed --- #
+
+        placing = live & (self.lock_timer <= -4)
+        if placing.any():
+            events |= self.place_pieces(placing.nonzero()[0])
+
+        # --- Time stuff --- #
+
+        ticking = live & ~self.game_over
+        frozen = ticking & (self.spawn_freeze_timer > 0)
+        self.spawn_freeze_timer[frozen] -= 1
+        self.frame_counter[frozen] = 0
+        self.frame_counter[ticking & ~frozen] += 1
+
+        return events
+
+    def place_pieces(self, games):
+        """
+        Array version of engine.Game.place_piece, for the given games.
+        Returns event bits for all games.
+        """
+        events = np.zeros(self.n, dtype=np.int32)
+
+        type_ID = self.type_ID[games]
+        rot = self.rot_index[games]
+        xs = self.x[games, None] + SHAPE_X[type_ID, rot]
+        ys = self.y[games, None] + SHAPE_Y[type_ID, rot]
+
+        # If the tetrimino locks above the playing field; Game over :o
+        above = ys.max(axis=1) < 0
+        self.game_over[games[above]] = True
+        events[games[above]] |= GAME_OVER
+
+        games = games[~above]
+        type_ID, xs, ys = type_ID[~above], xs[~above], ys[~above]
+        events[games] |= SPAWN
+
+        rows = ys + self.hidden
+        self.cells[games[:, None], rows, xs] = type_ID[:, None]
+        np.add.at(self.row_fill, (np.repeat(games, 4), rows.ravel()), 1)
+        self.soft_drop[games] = False
+
+        # --- Line clearing --- #
+
+        full = self.row_fill[games, self.hidden:] == self.cols
+        n_cleared = full.sum(axis=1)
+
+        clearing = n_cleared > 0
+        cleared = games[clearing]
+        if len(cleared):
+            events[cleared] |= CLEAR
+            self.clear_rows(cleared, full[clearing], n_cleared[clearing])
+
+            # Update points, lines and level
+            n_cleared = n_cleared[clearing]
+            self.lines[cleared] += n_cleared
+            self.points[cleared] += (CLEAR_POINTS[n_cleared]
+                                     * (self.level[cleared] + 1))
+
+            level = self.level[cleared]
+            level_up = ((self.lines[cleared] // 10 > level) &
+                        (level < rules.max_level))
+            up = cleared[level_up]
+            self.level[up] += 1
+            events[up] |= LEVEL_UP
+            fast = up[FRAMES_PER_CELL[self.level[up]] <= 3]
+            self.soft_drop_fpc[fast] = 1
+
+        # --- Spawn new tetrimino and next piece --- #
+
+        self.spawn(games, self.next_type[games])
+        self.next_type[games] = self.next_piece(games, self.type_ID[games])
+        self.spawn_freeze_timer[games] = rules.max_spawn_freeze
+
+        # If the new piece spawns overlapping any locked minos; Game over :o
+        blocked = ~self.fits(games, self.x[games], self.y[games],
+                             self.rot_index[games])
+        self.game_over[games[blocked]] = True
+        events[games[blocked]] |= GAME_OVER
+
+        return events
+
+    def clear_rows(self, games, full, n_cleared):
+        """
+        Removes the full rows of some games and moves everything above
+        them down, for all those games in one go.
+        """
+        keep = np.ones((len(games), self.height), dtype=bool)
+        keep[:, self.hidden:] = ~full
+
+        # Stable sort puts the removed rows on top, kept rows in order
+        order = np.argsort(keep, axis=1, kind="stable")
+        cells = np.take_along_axis(self.cells[games], order[:, :, None], 1)
+        row_fill = np.take_along_axis(self.row_fill[games], order, 1)
+
+        emptied = np.arange(self.height) < n_cleared[:, None]
+        cells[emptied] = -1
+        row_fill[emptied] = 0
+
+        self.cells[games] = cells
+        self.row_fill[games] = row_fill
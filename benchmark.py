@@ -0,0 +1,360 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+# Benchmarks for the hot paths of the game, so changes to them can be
+# measured instead of guessed at.
+#
+# Micro benchmarks time single operations (ns per call). Macro benchmarks
+# play a whole game from a fixed seed, headlessly, rendered (SDL's dummy
+# video driver, uncapped frame rate) and rendered offscreen by
+# observe.Observer, and report frames per second.
+# Startup benchmarks time new Python processes that import the game or
+# get as far as drawing the menu, in milliseconds.
+#
+# Usage:
+#   python benchmark.py                     print results as JSON
+#   python benchmark.py -o new.json         ...or write them to a file
+#   python benchmark.py --compare old.json  compare with earlier results
+#   python benchmark.py -k rotate           only run benchmarks matching
+
+# No window or sound card needed. Must be set before pygame is imported
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+# Fonts and sounds are loaded with paths relative to the game directory
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import engine
+import netplay
+import search
+import spectate
+import tournament
+from replay import Replay, play
+from state import Snapshot
+
+SEED = 2024
+START_LEVEL = 5
+MAX_FRAMES = 6000
+
+# ------ Scripted player ------ #
+def scripted_replay(seed=SEED, start_level=START_LEVEL, max_frames=MAX_FRAMES):
+    """
+    Plays a game with tournament's greedy bot and returns its Replay, so
+    every benchmark run plays exactly the same game. For each piece the
+    bot picks the best placement it can reach without tucking, then
+    holds soft drop until the piece locks.
+    """
+    rng = random.Random(seed)
+    game = engine.Game(start_level, seed=seed)
+    replay = Replay.for_game(game)
+
+    moves = tournament.greedy(game, rng)
+    while len(replay) < max_frames and not game.game_over:
+        if moves:
+            pressed, held = moves.pop(0), 0
+        else:
+            pressed, held = engine.DOWN, engine.DOWN
+
+        replay.record(pressed, held)
+        if game.step(pressed, held) & engine.SPAWN:
+            moves = tournament.greedy(game, rng)
+
+    return replay
+
+def game_at(replay, frames):
+    """Returns the replay's game as it was after the given frame."""
+    game = replay.new_game()
+    for i, (pressed, held) in enumerate(replay.frames()):
+        if i == frames:
+            break
+        game.step(pressed, held)
+
+    return game
+
+# ------ Timing ------ #
+def time_calls(func, number, repeat=5):
+    """Returns the fastest time per call of func, in nanoseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter_ns() - start) / number)
+
+    return best
+
+def time_startup(code, repeat=5):
+    """
+    Runs code in a new Python process a few times.
+    Returns the fastest time (ms) the process took, start to exit.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True,
+                       stdout=subprocess.DEVNULL)
+        best = min(best, (time.perf_counter() - start) * 1000)
+
+    return best
+
+def time_frames(func, repeat=3):
+    """
+    Calls func (which plays some frames and returns how many) a few times.
+    Returns the best frames per second.
+    """
+    best = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        frames = func()
+        best = max(best, frames / (time.perf_counter() - start))
+
+    return best
+
+# ------ Benchmarks ------ #
+def micro_benchmarks(replay):
+    """Yields (name, unit, function returning the result)."""
+
+    # Setting up the display prints things; keep stdout clean for the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        import pygame
+        import constants as c
+        import main
+        from tetrimino import Mino, Tetrimino
+        main.init()
+
+    game = game_at(replay, len(replay) // 2) # A board with a stack on it
+    board = game.board
+
+    tetrimino = Tetrimino(game.piece.type_ID, game.spawn_pos)
+    tetrimino.follow(game.piece)
+
+    yield "tetrimino.colliding", "ns/op", lambda: time_calls(
+            lambda: tetrimino.colliding(board), 20000)
+
+    yield "tetrimino.landed", "ns/op", lambda: time_calls(
+            lambda: tetrimino.landed(board), 20000)
+
+    def rotate():
+        tetrimino.rotate("cw", board)
+        tetrimino.rotate("ccw", board)
+    yield "tetrimino.rotate", "ns/op", lambda: time_calls(rotate, 5000) / 2
+
+    def shift():
+        tetrimino.shift("left", board)
+        tetrimino.shift("right", board)
+    yield "tetrimino.shift", "ns/op", lambda: time_calls(shift, 5000) / 2
+
+    # Locking an I piece into a well that makes a tetris, and clearing the
+    # rows, as the engine does on every lock. Restoring the board in
+    # between is timed on its own and taken off
+    tetris = engine.Game(START_LEVEL, seed=SEED)
+    rows = range(tetris.board.rows - 4, tetris.board.rows)
+    tetris.board.lock([(x, y) for y in rows
+                       for x in range(1, tetris.board.cols)], 1)
+    well = Snapshot.take(tetris)
+    i_piece = [(0, y) for y in rows]
+
+    def lock_clear():
+        well.restore(tetris)
+        tetris.board.clear_rows(tetris.board.lock(i_piece, 0))
+    yield "board.lock_clear", "ns/op", lambda: (
+            time_calls(lock_clear, 5000)
+            - time_calls(lambda: well.restore(tetris), 5000))
+
+    yield "search.placements", "ns/op", lambda: time_calls(
+            lambda: search.placements(board, game.piece), 200)
+
+    yield "game.checksum", "ns/op", lambda: time_calls(game.checksum, 20000)
+
+    snapshot = Snapshot.take(game)
+    yield "snapshot.take", "ns/op", lambda: time_calls(
+            lambda: Snapshot.take(game), 20000)
+
+    scratch = replay.new_game()
+    yield "snapshot.restore", "ns/op", lambda: time_calls(
+            lambda: snapshot.restore(scratch), 20000)
+
+    # A versus rollback as far as it goes: both games back MAX_ROLLBACK
+    # frames and simulated up to now again
+    frames = list(replay.frames())[len(replay) // 2:]
+    session = netplay.RollbackSession(
+            [game_at(replay, len(replay) // 2) for _ in range(2)], 0,
+            netplay.UdpTransport(("127.0.0.1", 0)))
+    for pressed, held in frames[:netplay.MAX_ROLLBACK]:
+        session.advance(pressed, held)
+    yield "netplay.rollback", "ns/op", lambda: time_calls(
+            lambda: session.rollback(0), 2000)
+
+    # What streaming to spectators adds to each frame of a game: the
+    # encoder checking the events, writing any ops, and a flush
+    class NullSink:
+        wants_keyframe = False
+
+        def write(self, data):
+            pass
+
+    all_frames = list(replay.frames())
+    def play_game(encode):
+        game = replay.new_game()
+        encoder = spectate.Encoder(game, NullSink())
+        for pressed, held in all_frames:
+            events = game.step(pressed, held)
+            if encode:
+                encoder.frame(events)
+                encoder.flush()
+    yield "spectate.encode", "ns/frame", lambda: (
+            time_calls(lambda: play_game(True), 1)
+            - time_calls(lambda: play_game(False), 1)) / len(all_frames)
+
+    mino = Mino(c.colours[0], 4, 10)
+    yield "mino.update", "ns/op", lambda: time_calls(mino.update, 20000)
+
+    score = main.Text("0", main.number_font, c.WHITE, "right", 1)
+    surface = pygame.Surface(main.screen.get_size())
+    counter = iter(range(10 ** 9))
+    yield "text.display", "ns/op", lambda: time_calls(
+            lambda: score.display(surface, main.bg, str(next(counter))), 2000)
+
+    # Same value again: nothing should get drawn
+    yield "text.display_unchanged", "ns/op", lambda: time_calls(
+            lambda: score.display(surface, main.bg, score.text), 20000)
+
+def startup_benchmarks():
+    """Yields (name, unit, function returning the result)."""
+
+    # Each is timed in a new Python process, from start to finish
+    yield "startup.import_logic", "ms", lambda: time_startup(
+            "import engine, replay, search, batch")
+
+    yield "startup.import_game", "ms", lambda: time_startup(
+            "import main")
+
+    # Up to the first frame of the menu (which quits on the QUIT event)
+    yield "startup.menu", "ms", lambda: time_startup(
+            "import pygame, main\n"
+            "main.init()\n"
+            "pygame.event.post(pygame.event.Event(pygame.QUIT))\n"
+            "main.menu(0)")
+
+def macro_benchmarks(replay):
+    """Yields (name, unit, function returning the result)."""
+
+    def headless():
+        play(replay)
+        return len(replay)
+
+    yield "game.headless", "fps", lambda: time_frames(headless)
+
+    def rendered():
+        import main
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Fast-forward: one tick per frame, as fast as it can draw
+            main.start_game(replay.start_level, watch=replay, speed=0)
+        return len(replay)
+
+    yield "game.rendered", "fps", lambda: time_frames(rendered, repeat=1)
+
+    def observed(mode, size=None):
+        import observe
+        observer = observe.Observer(mode, size)
+
+        def run():
+            game = replay.new_game()
+            for pressed, held in replay.frames():
+                game.step(pressed, held)
+                observer.render(game)
+            return len(replay)
+
+        return run
+
+    # Playing the game and rendering every frame offscreen
+    yield "observe.screen", "fps", lambda: time_frames(
+            observed("screen"), repeat=1)
+    yield "observe.field_84", "fps", lambda: time_frames(
+            observed("field", (84, 84)), repeat=1)
+    yield "observe.cells", "fps", lambda: time_frames(
+            observed("cells"), repeat=1)
+
+# ------ Results ------ #
+def metadata():
+    try:
+        commit = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {"commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": SEED,
+            "start_level": START_LEVEL,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+def compare(results, old_results):
+    """Prints a table of new results against old ones."""
+    old = {r["name"]: r for r in old_results["results"]}
+
+    print(f"{'benchmark':24} {'old':>12} {'new':>12}  change")
+    for result in results["results"]:
+        name, value, unit = result["name"], result["value"], result["unit"]
+        if name not in old:
+            print(f"{name:24} {'-':>12} {value:12.1f}  {unit}")
+            continue
+
+        old_value = old[name]["value"]
+        # Lower is better for times, higher is better for rates
+        if unit == "fps":
+            speedup = value / old_value
+        else:
+            speedup = old_value / value
+
+        print(f"{name:24} {old_value:12.1f} {value:12.1f}  "
+              f"{speedup:.2f}x {'faster' if speedup >= 1 else 'slower'}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Tetrix benchmarks")
+    parser.add_argument("-o", "--output", help="write JSON results here")
+    parser.add_argument("--compare", metavar="OLD_JSON",
+                        help="compare results with an earlier run")
+    parser.add_argument("-k", dest="pattern", default="",
+                        help="only run benchmarks whose name contains this")
+    args = parser.parse_args()
+
+    replay = scripted_replay()
+
+    results = {"meta": metadata(), "results": []}
+    for name, unit, run in [*micro_benchmarks(replay),
+                            *startup_benchmarks(),
+                            *macro_benchmarks(replay)]:
+        if args.pattern not in name:
+            continue
+
+        value = run()
+        results["results"].append({"name": name, "unit": unit,
+                                   "value": round(value, 1)})
+        print(f"{name:24} {value:12.1f} {unit}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+    elif not args.output:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
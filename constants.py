@@ -1,8 +1,10 @@
 import pygame
-from numpy import array, linspace
 
-pygame.init()
-display_info = pygame.display.Info()
+import assets
+from rules import *
+
+# Nothing here starts SDL or loads anything, so importing this is quick.
+# The window is made by main.init(), and sounds load when first played.
 
 # ------ Display stuff and playing field dimensions ------ #
 
@@ -10,14 +12,14 @@ fullscreen = False
     ### Might add fullscreen/windowed toggling during runtime in the future.
     ### For now it'll just be a constant.
 if fullscreen:
+    pygame.display.init()
+    display_info = pygame.display.Info()
     width = display_info.current_w
     height = display_info.current_h
 else:
     width = 750
     height = width
 
-COLS = 10
-ROWS = 20
 field_width = min(width, height) / 2.5
 field_height = ROWS/COLS * field_width
 field_pos = ( # (x, y) for top-left corner of playing field
@@ -30,7 +32,22 @@ field_rect = pygame.Rect(field_pos[0],
                          field_height + 3 * cell_size)
 
 scale = field_width / 300 # Variable used to scale visual elements
-print(width, "x", height)
+
+# ------ Replays ------ #
+
+replay_dir = None # Folder to save a replay of every game in (None: don't)
+
+# ------ Practice ------ #
+
+# Seconds of play to keep, so REWIND_KEYS can take the game back a piece
+# at a time (None: no rewinding)
+rewind_seconds = None
+
+# ------ Profiling ------ #
+
+# File to save per-frame timings to when the game exits, as .json or .csv
+# (None: don't time anything)
+profile_path = None
 
 # ------ Controls ------ #
 
@@ -44,16 +61,16 @@ CCW_KEYS = [pygame.K_j, pygame.K_z]
 
 CONFIRM_KEYS = [pygame.K_SPACE, pygame.K_RETURN]
 PAUSE_KEYS = [pygame.K_SPACE, pygame.K_RETURN, pygame.K_TAB]
+REWIND_KEYS = [pygame.K_BACKSPACE] # Only when rewind_seconds is set
 
 # ------ Sounds ------ #
-rot_sound = pygame.mixer.Sound("sounds/rot_sound.wav")
-shift_sound = pygame.mixer.Sound("sounds/shift_sound.wav")
-shift_sound.set_volume(0.8)
-lock_sound = pygame.mixer.Sound("sounds/lock_sound.wav")
-clear_sound = pygame.mixer.Sound("sounds/clear_sound.wav")
-tetris_sound = pygame.mixer.Sound("sounds/tetris_sound.wav")
-level_up_sound = pygame.mixer.Sound("sounds/level_up_sound.wav")
-game_over_sound = pygame.mixer.Sound("sounds/game_over_sound.wav")
+rot_sound = assets.Sound("sounds/rot_sound.wav")
+shift_sound = assets.Sound("sounds/shift_sound.wav", volume=0.8)
+lock_sound = assets.Sound("sounds/lock_sound.wav")
+clear_sound = assets.Sound("sounds/clear_sound.wav")
+tetris_sound = assets.Sound("sounds/tetris_sound.wav")
+level_up_sound = assets.Sound("sounds/level_up_sound.wav")
+game_over_sound = assets.Sound("sounds/game_over_sound.wav")
 
 # ------ Colours ------ #
 
@@ -88,62 +105,3 @@ def lighten(colour_list, increase=25):
 
     # Return RGB tuple for lightened colour
     return (colour.r, colour.g, colour.b)
-
-# ------ Level progression and scoring ------ #
-
-# Falling speeds for different levels. Index represents level.
-frames_per_cell = [52, 48, 44, 40, 36, 32, 27, 21, 16, 10,
-                   9, 8, 7, 6, 5, 5, 4, 4, 3, 3,
-                   2, 2, 2, 2, 2, 2, 2, 2, 2, 2,
-                   1]
-
-max_level = 30
-
-# List of lock delays for different levels. Index represents level.
-lock_delay = [int(t) for t in linspace(31, 15, 31)]
-
-clear_points = [0, 40, 100, 300, 1200]
-    # 1 line: 40 points, 2 lines: 300 points etc.
-
-# ------ Spawning, shifting and SRS stuff ------ #
-
-spawn_pos = array((4, -1))
-
-# Define the seven tetriminos. (0, 0) is anchor point for (true) rotation
-tetriminos = (
-        ((-1, 0), (0, -1), (0, 0), (1, 0)), # 	ID 0: T
-        ((-1, -1), (-1, 0), (0, 0), (1, 0)), # 	ID 1: J
-        ((-1, -1), (0, -1), (0, 0), (1, 0)), # 	ID 2: Z
-        ((-1, 0), (0, 0), (0, -1), (1, -1)), # 	ID 3: S
-        ((-1, 0), (0, 0), (1, 0), (1, -1)), # 	ID 4: L
-        ((0, -1), (1, -1), (0, 0), (1, 0)), # 	ID 5: O
-        ((-1, 0), (0, 0), (1, 0), (2, 0)) # 	ID 6: I
-        )
-
-DAS = 8 # Delayed Auto-Shift (frames)
-ARR = 3 # Auto Repeat Rate (in frames/cell)
-
-# --- SRS offset data --- #
-
-# https://harddrop.com/wiki/SRS
-
-offsets_TJZSL = array((
-        (( 0, 0), ( 0, 0), ( 0, 0), ( 0, 0), ( 0, 0)), # 	Rot 0 (spawn)
-        (( 0, 0), (+1, 0), (+1,+1), ( 0,-2), (+1,-2)), # 	Rot R
-        (( 0, 0), ( 0, 0), ( 0, 0), ( 0, 0), ( 0, 0)), # 	Rot 2
-        (( 0, 0), (-1, 0), (-1,+1), ( 0,-2), (-1,-2)) # 	Rot L
-))
-
-offsets_I = array((
-        (( 0, 0), (-1, 0), (+2, 0), (-1, 0), (+2, 0)), # 	Rot 0 (spawn)
-        ((-1, 0), ( 0, 0), ( 0, 0), ( 0,-1), ( 0,+2)), # 	Rot R
-        ((-1,-1), (+1,-1), (-2,-1), (+1, 0), (-2, 0)), # 	Rot 2
-        (( 0,-1), ( 0,-1), ( 0,-1), ( 0,+1), ( 0,-2)) #		Rot L
-))
-
-offsets_O = array((
-        (( 0, 0),), # 	Rot 0 (spawn)
-        (( 0,+1),), # 	Rot R
-        ((-1,+1),), # 	Rot 2
-        ((-1, 0),) #	Rot L
-))
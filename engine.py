@@ -0,0 +1,659 @@
+import random
+import struct
+from zlib import crc32
+from numpy import (arange, array, bitwise_xor, concatenate, full, int8,
+                   int32, int64, ones, uint64, where, zeros)
+
+import rules
+
+# Headless game logic. Everything the game does, minus the drawing, sound
+# and timing, which are left to whoever drives the engine (see main.py).
+
+# ------ Input bits ------ #
+
+LEFT = 1
+RIGHT = 2
+DOWN = 4
+CW = 8
+CCW = 16
+
+# ------ Event bits (returned by Game.step) ------ #
+
+SHIFT = 1 # Shift key pressed, or auto-shift moved the piece
+ROTATE = 2 # Rotate key pressed
+MOVE = 4 # Active piece changed position or rotation
+DROP = 8 # Soft drop awarded a point
+LOCK = 16 # Lock timer ran out (this is when the piece flashes)
+SPAWN = 32 # Piece was added to the board and the next piece spawned
+CLEAR = 64 # Rows were cleared, see Game.cleared_rows
+LEVEL_UP = 128
+GAME_OVER = 256
+
+# ------ Class for picking pieces ------ #
+class Randomiser:
+    """
+    Randomiser with bias against same two pieces in a row
+    (This is the same randomiser used in NES Tetris)
+
+    Each game gets its own 32-bit xorshift generator, so a game can be
+    reproduced from its seed, and the whole generator state is one int.
+    """
+    def __init__(self, seed=None):
+        if seed is None:
+            seed = random.getrandbits(32)
+
+        self.seed = seed & 0xFFFFFFFF
+        # Mix the seed a bit so small seeds don't give similar sequences.
+        # Xorshift gets stuck on 0, so that's not allowed as a state
+        self.state = (self.seed * 0x9E3779B1 + 0x7F4A7C15) & 0xFFFFFFFF or 1
+
+    def next(self):
+        """Advances the generator. Returns a 32-bit number."""
+        x = self.state
+        x ^= (x << 13) & 0xFFFFFFFF
+        x ^= x >> 17
+        x ^= (x << 5) & 0xFFFFFFFF
+        self.state = x
+        return x
+
+    def randint(self, n):
+        """Returns a number from 0 to n - 1."""
+        return self.next() % n
+
+    def first_piece(self):
+        return self.randint(len(rules.tetriminos))
+
+    def next_piece(self, prev):
+        roll = self.randint(len(rules.tetriminos) + 1) # 0-7
+
+        if roll == len(rules.tetriminos) or roll == prev:
+            # If roll is 7 or same as previous, reroll 0-6
+            roll = self.randint(len(rules.tetriminos))
+
+        return roll # A value 0-6
+
+# ------ Rotation and wall kick tables (built once at import) ------ #
+
+def build_shapes(type_ID):
+    """
+    Returns the mino offsets from the centre for each of the four rotation
+    states of a tetrimino (rotating clockwise about the centre each time).
+    """
+    shape = tuple(tuple(m) for m in rules.tetriminos[type_ID])
+    shapes = [shape]
+    for _ in range(3):
+        shape = tuple((-y, x) for x, y in shape)
+        shapes.append(shape)
+
+    return tuple(shapes)
+
+def build_kicks(type_ID):
+    """
+    Returns the SRS kick tests for a tetrimino, as
+    kicks[from_rot][to_rot] = ((x, y), ...) in the order they're tried.
+    Only rotations by a quarter turn have any tests.
+    """
+    if type_ID == 5:
+        offsets = rules.offsets_O
+    elif type_ID == 6:
+        offsets = rules.offsets_I
+    else:
+        offsets = rules.offsets_TJZSL
+
+    kicks = []
+    for from_rot in range(4):
+        kicks.append([])
+        for to_rot in range(4):
+            if (to_rot - from_rot) % 2 == 0:
+                kicks[from_rot].append(())
+                continue
+
+            kick_tests = offsets[from_rot] - offsets[to_rot]
+            kicks[from_rot].append(
+                    tuple((int(x), int(y)) for x, y in kick_tests))
+
+        kicks[from_rot] = tuple(kicks[from_rot])
+
+    return tuple(kicks)
+
+# SHAPES[type_ID][rot] and KICKS[type_ID][from_rot][to_rot]
+SHAPES = tuple(build_shapes(i) for i in range(len(rules.tetriminos)))
+KICKS = tuple(build_kicks(i) for i in range(len(rules.tetriminos)))
+
+# ------ Zobrist keys, for checksums (built once per board size) ------ #
+
+# A board's hash is the XOR of one random key per locked mino, chosen by
+# its row, column and type. Locking a piece XORs in four keys, so the hash
+# is kept up to date as the board changes rather than worked out again.
+#
+# The key for row i is the key for the column and type rotated left by
+# ROW_ROTATION * i bits. Since rotating and XOR commute, each row's hash
+# can also be kept unrotated (Board.row_hashes), and when rows are cleared
+# the board hash is put back together from those, one per row.
+#
+# Keys come from splitmix64 with a fixed seed, so every machine (and
+# every Python version) has the same ones, and checksums can be compared
+# between netplay peers or stored in replays.
+
+HASH_MASK = (1 << 64) - 1
+ROW_ROTATION = 7 # Odd, so the first 64 rows all get different rotations
+
+def rotate_left(key, n):
+    n %= 64
+    return (key << n | key >> (64 - n)) & HASH_MASK
+
+def splitmix64(n, seed=0x7E7A1C5):
+    """Returns a list of n 64-bit random numbers from the seed."""
+    numbers = []
+    x = seed
+    for _ in range(n):
+        x = (x + 0x9E3779B97F4A7C15) & HASH_MASK
+        z = x
+        z = ((z ^ z >> 30) * 0xBF58476D1CE4E5B9) & HASH_MASK
+        z = ((z ^ z >> 27) * 0x94D049BB133111EB) & HASH_MASK
+        numbers.append(z ^ z >> 31)
+
+    return numbers
+
+# Everything but the board, for Game.checksum(): the piece, next piece,
+# RNG state, timers, score and flags
+CHECKSUM_FIELDS = struct.Struct("<BhhBhBIhIhBIIBB?")
+
+zobrist_tables = {} # (cols, total rows) -> (column keys, cell keys)
+zobrist_arrays = {} # cols -> column keys as a (cols, types) array
+
+def zobrist_keys(cols, n_rows):
+    """
+    Returns (column_keys, cell_keys) for a board size:
+    column_keys[x][type_ID] goes into a row hash, and
+    cell_keys[i][x][type_ID] (the same, rotated for row i) into the
+    board hash. column_keys is also kept as an array, for load_cells().
+    """
+    if (cols, n_rows) not in zobrist_tables:
+        n_types = len(rules.tetriminos)
+        numbers = splitmix64(cols * n_types)
+        column_keys = tuple(tuple(numbers[x * n_types:(x + 1) * n_types])
+                            for x in range(cols))
+        cell_keys = tuple(
+                tuple(tuple(rotate_left(key, ROW_ROTATION * i)
+                            for key in keys)
+                      for keys in column_keys)
+                for i in range(n_rows))
+        zobrist_tables[(cols, n_rows)] = (column_keys, cell_keys)
+        zobrist_arrays[cols] = array(column_keys, dtype=uint64)
+
+    return zobrist_tables[(cols, n_rows)]
+
+# ------ Class for the locked minos ------ #
+class Board:
+    """
+    Playfield occupancy.
+
+    bits is a bitboard of the whole playfield packed into one integer,
+    and is what all collision checks use. Each row takes up `stride`
+    bits: one per column, followed by `wall` bits that are always set.
+    Those wall bits also act as the wall on the left of the next row, so
+    shifting a piece's mask out of bounds sideways always hits them.
+    There's a solid ceiling row on top and solid floor rows at the
+    bottom, so a collision or landing check is a single AND.
+
+    cells[y + hidden, x] holds the type ID of the mino locked at (x, y),
+    or -1 if the cell is empty. It's only used for drawing. row_fill
+    counts the minos in each row, and is kept up to date as pieces lock
+    so complete rows are known right away. hash is a Zobrist hash of the
+    locked minos, kept up to date the same way (see zobrist_keys).
+
+    Rows above the playfield (negative y) are kept as well, since pieces
+    are allowed to lock partially above the top.
+    """
+    hidden = 8 # Rows kept above the playfield
+    wall = 4 # Wall bits between rows. Kicks can't reach further out
+    floor = 4 # Solid rows below the playfield
+    reach = 2 # Furthest a mino can be from the centre of its piece
+
+    def __init__(self, cols=rules.COLS, rows=rules.ROWS):
+        self.cols = cols
+        self.rows = rows
+        self.stride = cols + self.wall
+        self.cells = full((rows + self.hidden, cols), -1, dtype=int8)
+        self.row_fill = zeros(rows + self.hidden, dtype=int32) # Minos per row
+        self.bits = self.empty_bits()
+
+        self.column_keys, self.cell_keys = zobrist_keys(
+                cols, rows + self.hidden)
+        self.row_hashes = [0] * (rows + self.hidden) # Unrotated, per row
+        self.hash = 0
+
+        # Piece masks, with bit 0 at (-reach, -reach) from the centre.
+        # A piece centred at (x, y) covers shape_masks[type_ID][rot] << s,
+        # where s = y * stride + x + origin.
+        self.origin = self.index(-self.reach, -self.reach)
+        self.shape_masks = tuple(
+                tuple(self.mask(shape) >> self.origin
+                      for shape in shapes)
+                for shapes in SHAPES)
+
+    def empty_bits(self):
+        """Returns the bitboard for an empty playfield (walls only)."""
+        walls = ((1 << self.wall) - 1) << self.cols
+        solid = (1 << self.stride) - 1
+
+        bits = solid # Ceiling
+        for i in range(self.hidden + self.rows):
+            bits |= walls << ((i + 1) * self.stride)
+        for i in range(self.floor):
+            bits |= solid << ((self.hidden + self.rows + 1 + i) * self.stride)
+
+        return bits
+
+    def index(self, x, y):
+        """Bit index of cell (x, y) in self.bits."""
+        return (y + self.hidden + 1) * self.stride + x
+
+    def mask(self, minos):
+        """Returns a bitboard with only the given minos set."""
+        mask = 0
+        for x, y in minos:
+            mask |= 1 << self.index(x, y)
+
+        return mask
+
+    def lock(self, minos, type_ID):
+        """Adds minos to the board. Returns the rows they completed."""
+        self.bits |= self.mask(minos)
+
+        completed = []
+        for x, y in minos:
+            i = y + self.hidden
+            self.cells[i, x] = type_ID
+            self.row_fill[i] += 1
+            self.row_hashes[i] ^= self.column_keys[x][type_ID]
+            self.hash ^= self.cell_keys[i][x][type_ID]
+            if self.row_fill[i] == self.cols and y >= 0:
+                completed.append(y)
+
+        return sorted(completed)
+
+    def clear_rows(self, rows_to_clear):
+        """Removes rows and moves everything above them down."""
+
+        # --- Cells and fill counts (row-major, so one copy each) --- #
+
+        keep = ones(len(self.cells), dtype=bool)
+        keep[[row_n + self.hidden for row_n in rows_to_clear]] = False
+        n = len(rows_to_clear)
+
+        self.cells = concatenate(
+                (full((n, self.cols), -1, dtype=int8), self.cells[keep]))
+        self.row_fill = concatenate(
+                (zeros(n, dtype=self.row_fill.dtype), self.row_fill[keep]))
+
+        # --- Hash (the rows above moved, so their keys are rotated) --- #
+
+        self.row_hashes = [0] * n + [row_hash for row_hash, kept in
+                                     zip(self.row_hashes, keep) if kept]
+        self.combine_row_hashes()
+
+        # --- Bitboard --- #
+
+        ceiling = (1 << self.stride) - 1
+        top_row = ((1 << self.wall) - 1) << self.index(self.cols, -self.hidden)
+
+        # Going from the top, cut out each row and move everything above
+        # it (except the ceiling) down one row.
+        for row_n in sorted(rows_to_clear):
+            above = self.bits & ((1 << self.index(0, row_n)) - 1) & ~ceiling
+            below = self.bits >> self.index(0, row_n + 1)
+            below <<= self.index(0, row_n + 1)
+            self.bits = ceiling | top_row | (above << self.stride) | below
+
+    def load_cells(self, cells):
+        """
+        Replaces the locked minos with cells (laid out like self.cells),
+        working out the bitboard and row fill counts from them.
+        """
+        self.cells = cells
+
+        filled = cells >= 0
+        self.row_fill = filled.sum(axis=1, dtype=int32)
+
+        # Each row's minos as bits (bit x = column x), placed like index()
+        rows_bits = filled.dot(1 << arange(self.cols, dtype=int64)).tolist()
+
+        self.bits = self.empty_bits()
+        for i, row_bits in enumerate(rows_bits):
+            if row_bits:
+                self.bits |= row_bits << ((i + 1) * self.stride)
+
+        # Each row's hash is the XOR of its minos' column keys
+        keys = zobrist_arrays[self.cols][arange(self.cols), cells]
+        self.row_hashes = bitwise_xor.reduce(
+                where(filled, keys, 0), axis=1).tolist()
+        self.combine_row_hashes()
+
+    def combine_row_hashes(self):
+        """Works out self.hash from self.row_hashes."""
+        self.hash = 0
+        for i, row_hash in enumerate(self.row_hashes):
+            if row_hash:
+                self.hash ^= rotate_left(row_hash, ROW_ROTATION * i)
+
+# ------ Class for tetrimino logic ------ #
+class Piece:
+    """
+    A tetrimino, stored as its type, rotation state and centre (x, y).
+    Minos are looked up in SHAPES and wall kicks in KICKS, and collision
+    checks go through the board's bitboard, so moving a piece around
+    doesn't allocate anything.
+    """
+    def __init__(self, type_ID, centre_pos):
+        self.type_ID = type_ID
+        self.x, self.y = centre_pos
+
+        self.lock_timer = 32
+
+        self.rot_index = 0 # Rotation state (0-3 for the four rotation states)
+
+    @property
+    def centre_pos(self):
+        return (self.x, self.y)
+
+    @property
+    def minos(self):
+        """
+        List with grid coordinate pairs for each mino.
+        E.g. [(3, -1), (4, -2), (4, -1), (5, -1)] (T-piece at spawn)
+        """
+        return [(self.x + dx, self.y + dy)
+                for dx, dy in SHAPES[self.type_ID][self.rot_index]]
+
+    def fits(self, board, x, y, rot):
+        """
+        Checks if the piece would fit on the board if it was centred at
+        (x, y) in rotation state rot.
+        """
+        shift = y * board.stride + x + board.origin
+        if shift < 0:
+            return False # Above the ceiling
+
+        mask = board.shape_masks[self.type_ID][rot] << shift
+        return not board.bits & mask
+
+    def rotate(self, dir, board):
+        """
+        Method to rotate tetrimino clockwise ("cw") or anti-clockwise ("ccw").
+        Does SRS wall-kicks. Returns True if the rotation succeeded.
+        """
+        if dir == "cw": # Clockwise
+            rot = (self.rot_index + 1) % 4
+
+        elif dir == "ccw": # Counterclockwise
+            rot = (self.rot_index - 1) % 4
+
+        else:
+            raise Exception("dir argument must be string 'cw' or 'ccw'")
+
+        # --- Wall kicks  --- #
+
+        for kick_x, kick_y in KICKS[self.type_ID][self.rot_index][rot]:
+            if self.fits(board, self.x + kick_x, self.y + kick_y, rot):
+                # Wall kick was successful :)
+                self.x += kick_x
+                self.y += kick_y
+                self.rot_index = rot
+                return True
+
+        # No wall kick was succesful
+        return False
+
+    def shift(self, dir, board):
+        """
+        Method to shift tetrimino left or right. Handles collision.
+        """
+        if dir == "left":
+            dx = -1
+
+        elif dir == "right":
+            dx = 1
+
+        else:
+            raise Exception("dir argument must be string 'left' or 'right'")
+
+        if not self.fits(board, self.x + dx, self.y, self.rot_index):
+            return False
+
+        self.x += dx
+        return True
+
+    def fall(self, board, level):
+        """
+        Method to make tetrimino fall down one row. Handles landing.
+        """
+        if self.landed(board):
+            return False
+
+        self.y += 1
+        self.lock_timer = rules.lock_delay[level]
+        return True
+
+    def colliding(self, board):
+        """
+        Checks if any minos are overlapping locked minos or are out of bounds.
+        """
+        return not self.fits(board, self.x, self.y, self.rot_index)
+
+    def landed(self, board):
+        """
+        Checks if tetrimino has landed (on floor or on locked minos).
+        """
+        return not self.fits(board, self.x, self.y + 1, self.rot_index)
+
+# ------ The actual gameplay stuff ------ #
+class Game:
+    """
+    One game of Tetrix, stepped one frame at a time with step().
+    Runs as fast as it is called; no display, sound or clock involved.
+
+    Two games with the same seed, start level and board size that are
+    given the same inputs play out exactly the same.
+    """
+    def __init__(self, start_level=0, cols=rules.COLS, rows=rules.ROWS,
+                 seed=None):
+        self.board = Board(cols, rows)
+        self.rng = Randomiser(seed)
+        self.seed = self.rng.seed
+
+        # Keep the spawn position centred on wider or narrower boards
+        self.spawn_pos = (rules.spawn_pos[0] + (cols - rules.COLS) // 2,
+                          rules.spawn_pos[1])
+
+        self.spawn_freeze_timer = rules.max_spawn_freeze
+        self.frame_counter = 1 # Counter to control tetrimino falling
+        self.DAS_counter = 0 # For control of horisontal auto-shift delays
+
+        self.start_level = start_level
+        self.level = start_level # Controls falling speed and point bonuses
+        self.lines = 0
+        self.points = 0
+
+        self.soft_drop = False # If True, piece falls and locks faster
+
+        # Soft drop falling speed in frames per cell ("fpc")
+        if rules.frames_per_cell[self.level] > 3:
+            self.soft_drop_fpc = 2
+        else:
+            self.soft_drop_fpc = 1
+
+        self.cleared_rows = [] # Rows cleared by the most recent lock
+        self.game_over = False
+
+        self.piece = Piece(self.rng.first_piece(), self.spawn_pos)
+        self.next_type = self.rng.next_piece(self.piece.type_ID)
+
+    def step(self, pressed=0, held=0):
+        """
+        Advances the game by one frame.
+
+        pressed: input bits for keys pressed since the previous frame
+        held: input bits for keys currently held down
+
+        Returns the event bits for everything that happened this frame.
+        """
+        if self.game_over:
+            return 0
+
+        events = 0
+        board = self.board
+        piece = self.piece
+        fpc = rules.frames_per_cell[self.level]
+
+        # --- Shifting, rotating and soft drop on keypress --- #
+
+        if pressed and piece.lock_timer > 0:
+            if pressed & DOWN:
+                self.soft_drop = True
+                self.spawn_freeze_timer = 0
+
+            for bit, dir in ((LEFT, "left"), (RIGHT, "right")):
+                if pressed & bit:
+                    events |= SHIFT
+                    if piece.shift(dir, board):
+                        events |= MOVE
+                    self.DAS_counter = 0
+                    self.spawn_freeze_timer = min(fpc,
+                                                  self.spawn_freeze_timer)
+
+            for bit, dir in ((CW, "cw"), (CCW, "ccw")):
+                if pressed & bit:
+                    events |= ROTATE
+                    if piece.rotate(dir, board):
+                        events |= MOVE
+                    self.spawn_freeze_timer = min(fpc,
+                                                  self.spawn_freeze_timer)
+
+        # Releasing DOWN stops soft drop
+        if not held & DOWN:
+            self.soft_drop = False
+
+        # --- Auto-shift --- #
+
+        left_held = bool(held & LEFT)
+        right_held = bool(held & RIGHT)
+
+        if left_held != right_held and piece.lock_timer > 0:
+            self.DAS_counter += 1
+            self.spawn_freeze_timer = 0
+            if self.DAS_counter == rules.DAS:
+                if piece.shift("left" if left_held else "right", board):
+                    events |= SHIFT | MOVE
+                self.DAS_counter = rules.DAS - rules.ARR
+
+        # --- Falling and landing --- #
+
+        # If soft dropping, make lock delay 2 frames
+        if self.soft_drop and piece.lock_timer > 2:
+            piece.lock_timer = 2
+
+        # If tetrimino has landed, start locking timer
+        if piece.landed(board):
+            piece.lock_timer -= 1
+
+        if not (piece.lock_timer > 0 and self.spawn_freeze_timer <= 0):
+            # Don't make tetrimino fall if it has locked or is in spawn freeze
+            pass
+
+        elif not self.soft_drop and self.frame_counter % fpc == 0:
+            if piece.fall(board, self.level):
+                events |= MOVE
+
+        elif self.soft_drop and self.frame_counter % self.soft_drop_fpc == 0:
+            if piece.fall(board, self.level):
+                events |= MOVE
+
+            # Pushdown points (1 point for each frame during soft drop)
+            self.points += 1
+            events |= DROP
+
+        if piece.lock_timer == 0:
+            events |= LOCK
+
+        # --- After tetrimino has locked and flashed --- #
+        if piece.lock_timer <= -4:
+            events |= self.place_piece()
+            if self.game_over:
+                return events
+
+        # --- Time stuff --- #
+
+        if self.spawn_freeze_timer > 0:
+            self.spawn_freeze_timer -= 1
+            self.frame_counter = 0
+        else:
+            self.frame_counter += 1
+
+        return events
+
+    def checksum(self):
+        """
+        Returns a 64-bit hash of the whole game state: the board's Zobrist
+        hash, with the piece, next piece, RNG, timers and score folded in.
+        Two games that are in the same state have the same checksum, on
+        any machine, so comparing them every frame finds where two copies
+        of a game (netplay peers, a replay and its recording) went apart.
+        """
+        piece = self.piece
+        fields = CHECKSUM_FIELDS.pack(
+                piece.type_ID, piece.x, piece.y, piece.rot_index,
+                piece.lock_timer, self.next_type, self.rng.state,
+                self.spawn_freeze_timer, self.frame_counter,
+                self.DAS_counter, self.level, self.lines, self.points,
+                self.soft_drop, self.soft_drop_fpc, self.game_over)
+
+        # Odd multiplier, so different CRCs stay different in 64 bits
+        return self.board.hash ^ crc32(fields) * 0x9E3779B97F4A7C15 & HASH_MASK
+
+    def place_piece(self):
+        """
+        Locks the active piece into the board, clears any complete rows,
+        and spawns the next piece. Returns event bits.
+        """
+        piece = self.piece
+
+        # If the tetrimino locks above the playing field; Game over :o
+        if max(y for x, y in piece.minos) < 0:
+            self.game_over = True
+            return GAME_OVER
+
+        events = SPAWN
+        self.cleared_rows = self.board.lock(piece.minos, piece.type_ID)
+        self.soft_drop = False
+
+        # --- Line clearing --- #
+
+        if self.cleared_rows:
+            events |= CLEAR
+            self.board.clear_rows(self.cleared_rows)
+
+            # Update points, lines and level
+            self.lines += len(self.cleared_rows)
+            self.points += (rules.clear_points[len(self.cleared_rows)]
+                            * (self.level + 1))
+            if self.lines // 10 > self.level < rules.max_level:
+                self.level += 1
+                events |= LEVEL_UP
+                if rules.frames_per_cell[self.level] <= 3:
+                    self.soft_drop_fpc = 1
+
+        # --- Spawn new tetrimino and next piece --- #
+
+        self.piece = Piece(self.next_type, self.spawn_pos)
+        self.next_type = self.rng.next_piece(self.piece.type_ID)
+
+        self.spawn_freeze_timer = rules.max_spawn_freeze
+
+        # If the new piece spawns overlapping any locked minos; Game over :o
+        if self.piece.colliding(self.board):
+            self.game_over = True
+            events |= GAME_OVER
+
+        return events
@@ -0,0 +1,291 @@
+import argparse
+import functools
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+
+# Raw video can go to stdout, so pygame mustn't print anything there
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+
+import main
+import observe
+from replay import Replay
+
+# Exports replays as image sequences or raw video, for clips.
+#
+# The replay is played again headlessly and each frame is drawn
+# offscreen by an observe.Observer (the game's own drawing code) in this
+# process, while other processes encode the frames drawn before it, so
+# drawing and encoding overlap and encoding is spread over every core.
+#
+# Frames are handed over in a ring of buffers in shared memory: a frame
+# is drawn into a free buffer, its number is sent to an encoder, and
+# the buffer is free again once that frame is written, so frames are
+# never pickled or copied between processes. When every buffer is in
+# use, drawing waits for the encoders to catch up.
+#
+# Image sequences (PNG, BMP, TGA) are encoded by a pool of processes.
+# Raw video (packed RGB24 frames, one after the other) only needs
+# writing out, so it's done by a thread instead. It can be piped
+# straight into e.g. ffmpeg to make a video:
+#
+#   python export.py game.txr --format raw -o - |
+#       ffmpeg -f rawvideo -pix_fmt rgb24 -s 750x750 -r 60 -i - clip.mp4
+#
+# Animations (line clears, game over) aren't in exported frames, since
+# the Observer draws the game's state as it is.
+
+FORMATS = ("png", "bmp", "tga", "raw")
+FRAMES_PER_WORKER = 3 # Buffers in the ring for each encoder
+
+# ------ Class for passing frames to encoders ------ #
+class FrameRing:
+    """
+    n frame buffers of the given shape (uint8), free to be drawn into or
+    waiting to be written. With shared=True they're in shared memory,
+    and other processes can attach() to them by self.name.
+    """
+    def __init__(self, shape, n, shared=False, name=None):
+        self.shape = shape
+        self.n = n
+        size = int(np.prod(shape))
+
+        if shared or name is not None:
+            self.memory = shared_memory.SharedMemory(
+                    name, create=name is None, size=size * n)
+            buf = self.memory.buf
+            self.name = self.memory.name
+        else:
+            self.memory = None
+            buf = bytearray(size * n)
+            self.name = None
+
+        self.frames = [np.ndarray(shape, np.uint8, buf, i * size)
+                       for i in range(n)]
+
+        self.free = queue.Queue() # Numbers of the buffers not in use
+        for i in range(n):
+            self.free.put(i)
+
+    @classmethod
+    def attach(cls, name, shape, n):
+        """Returns the FrameRing with the given name, made elsewhere."""
+        return cls(shape, n, name=name)
+
+    def acquire(self):
+        """Waits for a free buffer, and returns its number."""
+        return self.free.get()
+
+    def release(self, i):
+        self.free.put(i)
+
+    def close(self, unlink=False):
+        """Lets go of the shared memory (and frees it, if unlink)."""
+        self.frames = [] # Views of the memory must go before it can close
+        if self.memory is not None:
+            self.memory.close()
+            if unlink:
+                self.memory.unlink()
+
+# ------ Encoder processes ------ #
+ring = None # The FrameRing, in encoder processes
+
+def attach_ring(name, shape, n):
+    global ring
+    ring = FrameRing.attach(name, shape, n)
+
+def encode_frame(i, path):
+    """Saves ring buffer i as an image (in an encoder process)."""
+    pygame.image.save(observe.array_surface(ring.frames[i]), path)
+
+# ------ Classes for writing frames out ------ #
+class ImageWriter:
+    """
+    Saves frames as numbered images in a directory, encoded by a pool of
+    processes. write() returns straight away; close() waits for every
+    frame to be saved.
+    """
+    def __init__(self, directory, format, ring, workers):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.format = format
+        self.ring = ring
+        self.error = None # First exception raised by an encoder
+
+        # Spawned rather than forked, since this process has SDL set up
+        self.pool = ProcessPoolExecutor(
+                workers, mp_context=get_context("spawn"),
+                initializer=attach_ring,
+                initargs=(ring.name, ring.shape, ring.n))
+
+    def write(self, i, index):
+        """Saves ring buffer i as frame number index."""
+        if self.error is not None:
+            raise self.error
+
+        path = os.path.join(self.directory, f"{index:06d}.{self.format}")
+        future = self.pool.submit(encode_frame, i, path)
+        future.add_done_callback(functools.partial(self.done, i))
+
+    def done(self, i, future):
+        if future.exception() is not None and self.error is None:
+            self.error = future.exception()
+        self.ring.release(i) # Even on errors, so drawing doesn't stall
+
+    def close(self):
+        self.pool.shutdown()
+        if self.error is not None:
+            raise self.error
+
+class RawWriter:
+    """
+    Writes frames one after the other to a binary file, from a thread of
+    its own. write() returns straight away; close() waits for every frame
+    to be written.
+    """
+    def __init__(self, file, ring):
+        self.file = file
+        self.ring = ring
+        self.error = None # Exception raised writing, e.g. a broken pipe
+
+        self.queue = queue.Queue() # Ring buffer numbers, in frame order
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, i, index):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(i)
+
+    def run(self):
+        while (i := self.queue.get()) is not None:
+            if self.error is None:
+                try:
+                    self.file.write(self.ring.frames[i].data)
+                except OSError as e:
+                    self.error = e
+            self.ring.release(i)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is None:
+            self.file.flush()
+        if self.error is not None:
+            raise self.error
+
+# ------ Exporting ------ #
+def export(replay, observer, ring, writer, start=0, end=None):
+    """
+    Plays a replay headlessly, drawing each frame from start up to (not
+    including) end and passing it to the writer. Frames before start are
+    only simulated. Returns the number of frames written.
+    """
+    if end is None or end > len(replay):
+        end = len(replay)
+
+    game = replay.new_game()
+    step = game.step
+
+    written = 0
+    for frame, (pressed, held) in enumerate(replay.frames()):
+        if frame >= end:
+            break
+
+        step(pressed, held)
+        if frame < start:
+            continue
+
+        i = ring.acquire()
+        np.copyto(ring.frames[i], observer.render(game))
+        writer.write(i, written)
+        written += 1
+
+    return written
+
+def parse_size(text):
+    """Reads "WxH" as a (w, h) tuple."""
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+if __name__ == "__main__":
+    # Usage: python export.py REPLAY_FILE -o DIRECTORY [--format png]
+    #    or: python export.py REPLAY_FILE --format raw -o FILE (- for stdout)
+    parser = argparse.ArgumentParser(description="Export Tetrix replays")
+    parser.add_argument("replay")
+    parser.add_argument("-o", "--output", required=True,
+                        help="directory for images, or file for raw video "
+                             "(- for stdout)")
+    parser.add_argument("--format", choices=FORMATS, default="png")
+    parser.add_argument("--start", type=float, default=0,
+                        help="seconds into the replay to start at")
+    parser.add_argument("--end", type=float,
+                        help="seconds into the replay to stop at")
+    parser.add_argument("--mode", choices=("screen", "field"),
+                        default="screen", help="whole window or playfield")
+    parser.add_argument("--size", type=parse_size, metavar="WxH",
+                        help="scale frames to this size")
+    parser.add_argument("--smooth", action="store_true",
+                        help="smooth scaled frames (slower)")
+    parser.add_argument("--workers", type=int,
+                        default=max(1, (os.cpu_count() or 1) - 1),
+                        help="encoder processes (default: one per core "
+                             "but one)")
+    args = parser.parse_args()
+
+    replay = Replay.load(args.replay)
+    if args.output != "-":
+        args.output = os.path.abspath(args.output)
+
+    # Fonts are loaded with paths relative to the game directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    observer = observe.Observer(args.mode, args.size, args.smooth)
+    shape = observer.frame.shape
+    start = int(args.start * main.SIM_RATE)
+    end = None if args.end is None else int(args.end * main.SIM_RATE)
+
+    if args.format == "raw":
+        ring = FrameRing(shape, 2 * FRAMES_PER_WORKER)
+        if args.output == "-":
+            file = sys.stdout.buffer
+        else:
+            file = open(args.output, "wb")
+        writer = RawWriter(file, ring)
+    else:
+        ring = FrameRing(shape, FRAMES_PER_WORKER * args.workers + 1,
+                         shared=True)
+        writer = ImageWriter(args.output, args.format, ring, args.workers)
+
+    began = time.perf_counter()
+    try:
+        try:
+            frames = export(replay, observer, ring, writer, start, end)
+        finally:
+            writer.close() # Waits for the frames already passed on
+    except BrokenPipeError:
+        # Whatever was reading the video stopped (ffmpeg quit, say). Point
+        # stdout somewhere harmless so flushing it at exit doesn't fail too
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit("export.py: output closed before the end of the replay")
+    finally:
+        ring.close(unlink=True)
+        if args.format == "raw" and args.output != "-":
+            file.close()
+    seconds = time.perf_counter() - began
+
+    h, w, _ = shape
+    fps = frames / seconds if seconds else 0
+    print(f"{frames} frames ({w}x{h}) in {seconds:.1f} s: {fps:.0f} fps, "
+          f"{fps / main.SIM_RATE:.1f}x real time", file=sys.stderr)
+    if args.format == "raw" and args.output != "-":
+        print(f"ffmpeg -f rawvideo -pix_fmt rgb24 -s {w}x{h} "
+              f"-r {main.SIM_RATE} -i {args.output} clip.mp4",
+              file=sys.stderr)
@@ -1,12 +1,11 @@
+import argparse
+import os
 import sys
-import random
-from numpy import array
+import time
 from math import ceil
 
 try:
     import pygame
-    pygame.mixer.pre_init(buffer=32)
-    pygame.init()
 
 except:
     print("\n! ERROR !\nFant ikke pygame-modulen.\n"
@@ -17,54 +16,137 @@ except:
 
     sys.exit()
 
+import assets
 import constants as c
+import engine
+import netplay
+import profiling
+import spectate
 from tetrimino import *
+from renderer import BoardRenderer, MiniFieldRenderer
+from replay import Replay
+from rewind import Rewinder
+
+# ------ Class for caching rendered text ------ #
+class GlyphAtlas:
+    """
+    Rendered text in one font (and size) and colour, so nothing has to be
+    rendered more than once. Digits are kept one glyph at a time, and
+    numbers are drawn by blitting their glyphs side by side. Anything else,
+    like the "SCORE" label, is rendered whole the first time it's needed.
+
+    Give a bg colour if the text always goes on a solid colour, since
+    opaque surfaces blit several times faster than ones with per-pixel
+    alpha. Otherwise the text is rendered with a transparent background.
+    """
+    atlases = {} # (font, colour, bg colour) -> GlyphAtlas
+    glyph_chars = "0123456789"
+
+    @classmethod
+    def get(cls, font, colour, bg_colour=None):
+        """Returns the atlas for font and colours, making it if needed."""
+        key = (font, tuple(colour), bg_colour and tuple(bg_colour))
+        if key not in cls.atlases:
+            cls.atlases[key] = cls(font, colour, bg_colour)
+
+        return cls.atlases[key]
+
+    def __init__(self, font, colour, bg_colour):
+        self.font = font
+        self.colour = colour
+        self.bg_colour = bg_colour
+        self.height = font.get_height()
+
+        self.glyphs = {char: self.render(char) for char in self.glyph_chars}
+        self.glyph_widths = {char: glyph.get_width()
+                             for char, glyph in self.glyphs.items()}
+
+        self.labels = {} # Text -> surface
+
+    def render(self, text):
+        if self.bg_colour is None:
+            return self.font.render(text, True, self.colour).convert_alpha()
+
+        return self.font.render(
+                text, True, self.colour, self.bg_colour).convert()
+
+    def is_number(self, text):
+        """Whether text can be made from glyphs alone."""
+        return text != "" and not text.strip(self.glyph_chars)
+
+    def label(self, text):
+        """Returns text rendered as one surface (cached)."""
+        surface = self.labels.get(text)
+        if surface is None:
+            surface = self.labels[text] = self.render(text)
+
+        return surface
+
+    def size(self, text):
+        """Returns the (w, h) that text takes up when drawn."""
+        if self.is_number(text):
+            return (sum(map(self.glyph_widths.__getitem__, text)),
+                    self.height)
+
+        return self.label(text).get_size()
+
+    def draw(self, dest_surf, text, pos):
+        """Blits text to a surface with its top left corner at pos."""
+        if not self.is_number(text):
+            dest_surf.blit(self.label(text), pos)
+            return
+
+        x, y = pos
+        glyphs = self.glyphs
+        widths = self.glyph_widths
+
+        blits = []
+        for char in text:
+            blits.append((glyphs[char], (x, y)))
+            x += widths[char]
+
+        dest_surf.blits(blits, doreturn=False)
 
 # ------ Class for level icons on level selection screen ------ #
 class NumIcon(pygame.sprite.Sprite):
     bg_col = c.BLUE_GREY
     bg_col_selected = c.WHITE
     w = int(c.cell_size * 2)
-    font = pygame.font.Font("fonts/Montserrat-Bold.ttf", int(40 * c.scale))
+    font_path = "fonts/Montserrat-Bold.ttf"
+    font_size = int(40 * c.scale)
 
     def __init__(self, num, x, y, selected):
         super().__init__()
         self.num = str(num)
         self.selected = selected
+        font = assets.font(self.font_path, self.font_size)
 
         self.rect = (x, y, self.w, self.w)
-        self.image = pygame.Surface((self.w, self.w - 1))
 
-        if selected:
-            self.image.fill(self.bg_col_selected)
-        else:
-            self.image.fill(self.bg_col)
-
-        self.text = self.font.render(self.num, True, c.WHITE)
+        # Draw the icon both ways once, update() just picks one of them
+        self.images = {}
+        for is_selected, bg_colour, text_colour in (
+                (False, self.bg_col, c.WHITE), # Blue bg and white text
+                (True, self.bg_col_selected, self.bg_col)): # The opposite
+            image = pygame.Surface((self.w, self.w - 1))
+            image.fill(bg_colour)
 
-        # Centre text within self.rect
-        text_w = self.text.get_width()
-        text_h = self.text.get_height()
-        self.text_pos = ((self.w - text_w)/2, (self.w - text_h)/2)
+            # Centre text within self.rect
+            atlas = GlyphAtlas.get(font, text_colour, bg_colour)
+            text_w, text_h = atlas.size(self.num)
+            atlas.draw(image, self.num,
+                       ((self.w - text_w)/2, (self.w - text_h)/2))
 
-    def update(self):
+            self.images[is_selected] = image
 
-        if self.selected:
-            # Make bg white and text blue
-            self.image.fill(c.WHITE)
-            self.text = self.font.render(
-                    self.num, True, self.bg_col)
-            self.image.blit(self.text, self.text_pos)
+        self.image = self.images[selected]
 
-        else:
-            # Make bg blue and text white
-            self.image.fill(c.BLUE_GREY)
-            self.text = self.font.render(
-                    self.num, True, c.WHITE)
-            self.image.blit(self.text, self.text_pos)
+    def update(self):
+        self.image = self.images[self.selected]
 
 # ------ Class for displaying text ------ #
 class Text:
+    bg_colour = c.BLUE_GREY # All text is drawn where the background is plain
 
     def get_pos(cls, column, row, w):
         """
@@ -90,30 +172,36 @@ class Text:
         self.text = text
         self.font = font
         self.colour = colour
+        self.atlas = GlyphAtlas.get(font, colour, self.bg_colour)
 
         self.column = column # "left", "right" or "centre"
         self.row = row
 
-        self.render = self.font.render(self.text, True, self.colour)
+        self.size = self.atlas.size(self.text)
+        self.shown = False # Whether the text is on the surface right now
 
     def display(self, dest_surf, bg, new_text=None):
-        """Method to blit text to a surface. Returns dirty rect."""
+        """
+        Method to blit text to a surface. Returns dirty rect, or None if
+        new_text is already what's shown (then nothing is drawn).
+        """
 
-        w = self.render.get_width()
+        w, h = self.size
 
         if new_text is not None:
-            new_render = self.font.render(new_text, True, self.colour)
+            if new_text == self.text and self.shown:
+                return None
+
+            new_size = self.atlas.size(new_text)
 
             # Make sure text rect is wide enough to overwrite preexisting text
-            w = max(w, new_render.get_width())
+            w = max(w, new_size[0])
 
-            self.render = new_render
+            self.size = new_size
             self.text = new_text
 
         pos = self.get_pos(self.column, self.row, w)
 
-        h = self.render.get_height()
-
         text_rect = (*pos, w, h)
 
         # Draw bg over text (bg can be a pygame surface or a solid colour)
@@ -132,15 +220,15 @@ class Text:
                     + "bg must be either a pygame surface or an RGB colour")
 
         # Draw text
-        dest_surf.blit(self.render, pos)
+        self.atlas.draw(dest_surf, self.text, pos)
+        self.shown = True
 
         return text_rect
 
     def clear(self, dest_surf, bg_surf):
         """Method to clear text from surface. Returns dirty rect."""
 
-        w = self.render.get_width()
-        h = self.render.get_height()
+        w, h = self.size
         pos = self.get_pos(self.column, self.row, w)
 
         rect = (*pos, w, h)
@@ -149,18 +237,157 @@ class Text:
         dest_surf.set_clip(rect)
         dest_surf.blit(bg_surf, rect)
         dest_surf.set_clip()
+        self.shown = False
 
         return rect
 
+# ------ Classes for animations ------ #
+
+# Animations are stepped by the game loop, one frame per game tick, so
+# nothing else has to stop while they play.
+
+class LineClearAnimation:
+    """
+    Wipes the cleared rows away from the middle outwards.
+    Makes the field border flash if you get a tetris.
+    """
+    def __init__(self, rows, bg):
+        self.rows = rows
+        self.bg = bg
+
+        self.x = c.field_pos[0] + c.field_width // 2 - 1
+        self.w = 2
+        self.step_size = c.field_width / 42
+        self.i = 0 # Frame number
+
+        self.done = False
+
+    @staticmethod
+    def length():
+        """Returns how many frames the animation lasts."""
+        x = c.field_pos[0] + c.field_width // 2 - 1
+        n = 0
+        while x >= c.field_pos[0]:
+            x -= c.field_width / 42
+            n += 1
+
+        return n
+
+    def step(self, surface):
+        """Draws the next frame. Returns dirty rects."""
+        dirty_rects = []
+
+        for row_n in self.rows:
+            h = Mino.get_size(0, row_n)[1]
+            y = int(c.cell_size * row_n + c.field_pos[1])
+            rectangle = pygame.Rect(self.x, y, self.w, h)
+
+            # Draw bg over part of the filled row
+            surface.set_clip(rectangle)
+            surface.blit(self.bg, (0, 0))
+
+            dirty_rects.append(rectangle)
+
+        surface.set_clip()
+
+        # Make field border flash if you get a tetris
+        if len(self.rows) != 4:
+            pass
+
+        elif self.i % 4 == 0:
+            dirty_rects += draw_field_border(surface, c.CYAN, w=2)
+
+        elif self.i % 4 == 2:
+            dirty_rects += draw_field_border(surface, c.BLUE_GREY, w=2)
+            draw_field_border(surface, c.GREY)
+
+        self.w += 2 * self.step_size
+        self.x -= self.step_size
+        self.i += 1
+
+        self.done = self.x < c.field_pos[0]
+        return dirty_rects
+
+class GameOverAnimation:
+    """
+    Wipes the field from the bottom up and reveals the GAME OVER text,
+    with a small delay before and after.
+    """
+    delay = 30 # Frames
+
+    def __init__(self, text):
+        self.text = text
+
+        self.step_size = c.field_rect.height / 75
+        self.h = int(self.step_size)
+        self.y = c.field_rect[1] + c.field_rect.height - self.h
+
+        self.wait_before = self.delay
+        self.wait_after = self.delay
+
+        self.done = False
+
+    def step(self, surface):
+        """Draws the next frame. Returns dirty rects."""
+        if self.wait_before:
+            self.wait_before -= 1
+            return []
+
+        if self.y > c.field_rect[1]:
+            rect = pygame.draw.rect(
+                    surface,
+                    c.BLUE_GREY,
+                    (c.field_pos[0], self.y, c.field_width, self.h))
+            self.text.display(surface, c.BLUE_GREY)
+
+            self.y -= self.step_size
+            self.h += self.step_size
+            return [rect]
 
-# --- Initialise screen --- #
-if c.fullscreen:
-    flags = pygame.DOUBLEBUF | pygame.FULLSCREEN
-else:
-    flags = pygame.DOUBLEBUF
+        self.wait_after -= 1
+        self.done = self.wait_after <= 0
+        return []
 
-screen = pygame.display.set_mode((c.width, c.height), flags)
-pygame.display.set_caption("Tetrix")
+# --- Screen, background and fonts --- #
+
+# These are made by init(), so importing this module doesn't open a window
+screen = None
+bg = None # Background with the field border and grid
+title_font = None
+info_font = None
+number_font = None
+
+def init():
+    """Opens the window and makes the background and fonts (once)."""
+    global screen, bg
+
+    if screen is not None:
+        return
+
+    pygame.display.init()
+
+    if c.fullscreen:
+        flags = pygame.DOUBLEBUF | pygame.FULLSCREEN
+    else:
+        flags = pygame.DOUBLEBUF
+
+    screen = pygame.display.set_mode((c.width, c.height), flags)
+    pygame.display.set_caption("Tetrix")
+    print(c.width, "x", c.height)
+
+    bg = make_bg(screen.get_size())
+    load_fonts()
+
+def load_fonts():
+    """Loads the fonts (doesn't need the window, unlike init())."""
+    global title_font, info_font, number_font
+
+    title_font = assets.font(
+            "fonts/Montserrat-Black.ttf", int(60 * c.scale))
+    info_font = assets.font(
+            "fonts/Montserrat-BoldItalic.ttf", int(30 * c.scale))
+    number_font = assets.font(
+            "fonts/Montserrat-Medium.ttf", int(30 * c.scale))
 
 # --- Make background --- #
 def draw_field_border(surface, colour, w=1):
@@ -180,47 +407,34 @@ def draw_field_border(surface, colour, w=1):
 
     return dirty_rects
 
-bg = pygame.Surface(screen.get_size())
-bg = bg.convert()
-bg.fill(c.BLUE_GREY)
-draw_field_border(bg, c.GREY)
-
-# Draw grid
-line_w = 1
-for col in range(c.COLS):
-    x = c.field_pos[0] + col * c.cell_size
-    y1, y2 = c.field_pos[1], c.field_pos[1] + c.field_height - 1
-    pygame.draw.line(bg, c.LIGHT_BLUE_GREY, (x, y1), (x, y2), line_w)
+def make_bg(size):
+    bg = pygame.Surface(size)
+    bg = bg.convert()
+    bg.fill(c.BLUE_GREY)
+    draw_field_border(bg, c.GREY)
 
-for row in range(c.ROWS):
-    x1, x2 = c.field_pos[0], c.field_pos[0] + c.field_width - 1
-    y = c.field_pos[1] + row * c.cell_size
-    pygame.draw.line(bg, c.LIGHT_BLUE_GREY, (x1, y), (x2, y), line_w)
-
-# --- Global timing stuff --- #
-FPS = 60
-clock = pygame.time.Clock()
+    # Draw grid
+    line_w = 1
+    for col in range(c.COLS):
+        x = c.field_pos[0] + col * c.cell_size
+        y1, y2 = c.field_pos[1], c.field_pos[1] + c.field_height - 1
+        pygame.draw.line(bg, c.LIGHT_BLUE_GREY, (x, y1), (x, y2), line_w)
 
-# --- Fonts --- #
-title_font = pygame.font.Font(
-        "fonts/Montserrat-Black.ttf", int(60 * c.scale))
-info_font = pygame.font.Font(
-        "fonts/Montserrat-BoldItalic.ttf", int(30 * c.scale))
-number_font = pygame.font.Font(
-        "fonts/Montserrat-Medium.ttf", int(30 * c.scale))
+    for row in range(c.ROWS):
+        x1, x2 = c.field_pos[0], c.field_pos[0] + c.field_width - 1
+        y = c.field_pos[1] + row * c.cell_size
+        pygame.draw.line(bg, c.LIGHT_BLUE_GREY, (x1, y), (x2, y), line_w)
 
-def randomiser(prev):
-    """
-    Randomiser with bias against same two pieces in a row
-    (This is the same randomiser used in NES Tetris)
-    """
-    roll = random.randint(0, len(c.tetriminos)) # 0-7
+    return bg
 
-    if roll == len(c.tetriminos) or roll == prev:
-        # If roll is 7 or same as previous, reroll 0-6
-        roll = random.randint(0, len(c.tetriminos) - 1)
+# --- Global timing stuff --- #
+FPS = 60 # Max frames drawn per second (0: uncapped)
+SIM_RATE = 60 # Game ticks per second. Gravity, DAS etc. count these
+MAX_TICKS_PER_FRAME = 16 # If drawing falls further behind, the game slows
+MENU_IDLE_TIMEOUT = 1000 # Longest the menu sleeps waiting for input (ms)
 
-    return roll # A value 0-6
+clock = pygame.time.Clock()
+profiler = profiling.create(c.profile_path)
 
 def point_in_rect(point, rect):
     """Check if point is within rect."""
@@ -271,7 +485,7 @@ def menu(selected_lvl):
     lvl_select_group.add(level_icons)
 
     # --- Title text --- #
-    title_text = title_font.render("TETRIX", True, c.WHITE)
+    title_text = GlyphAtlas.get(title_font, c.WHITE).label("TETRIX")
     title_pos = ((c.width - title_text.get_width())//2,
                  c.field_pos[1] + c.cell_size*3 - title_text.get_height()//2)
 
@@ -289,26 +503,35 @@ def menu(selected_lvl):
     pygame.draw.line(screen, c.LIGHT_BLUE_GREY, (x0, y0), (x1, y0), 1)
     pygame.draw.line(screen, c.LIGHT_BLUE_GREY, (x0, y1), (x1, y1), 1)
 
+    pygame.draw.rect(screen, c.BLUE_GREY, lvl_grid_rect)
+    lvl_select_group.draw(screen)
+
     pygame.display.flip()
 
-    def update_display():
-        pygame.draw.rect(screen, c.BLUE_GREY, lvl_grid_rect)
-        lvl_select_group.update()
-        lvl_select_group.draw(screen)
-        pygame.display.flip()
+    def update_display(old_lvl, new_lvl):
+        """Moves the selection, redrawing only the two icons it affects."""
+        dirty_rects = []
+        for icn, selected in ((level_icons[old_lvl], False),
+                              (level_icons[new_lvl], True)):
+            icn.selected = selected
+            icn.update()
+            dirty_rects.append(screen.blit(icn.image, icn.rect))
+
+        pygame.display.update(dirty_rects)
 
     # --- Menu loop --- #
 
+    # Nothing on the menu moves by itself, so instead of drawing frames it
+    # sleeps until there's input (or MENU_IDLE_TIMEOUT passes)
     on_menu_screen = True
     while on_menu_screen:
 
-        # Reset which icon is selected every frame
-        for icn in level_icons:
-            icn.selected = False
+        events = [pygame.event.wait(MENU_IDLE_TIMEOUT)]
+        events += pygame.event.get()
 
         mouse_pos = pygame.mouse.get_pos()
         keys = pygame.key.get_pressed()
-        events = pygame.event.get()
+        prev_lvl = selected_lvl
 
         for event in events:
             # Allow user to quit
@@ -363,9 +586,8 @@ def menu(selected_lvl):
                 c.shift_sound.play()
                 selected_lvl = (selected_lvl + lvl_grid_cols) % lvl_range
 
-        level_icons[selected_lvl].selected = True
-
-        update_display()
+        if selected_lvl != prev_lvl:
+            update_display(prev_lvl, selected_lvl)
 
         if not on_menu_screen:
             for _ in range(10): clock.tick(FPS) # Small delay
@@ -380,86 +602,133 @@ def menu(selected_lvl):
             elif key_mods & pygame.KMOD_CTRL:
                 selected_lvl = c.max_level
 
-            start_game(selected_lvl)
-
-        clock.tick(FPS)
+            return selected_lvl
 
 # ------ The actual gameplay stuff ------ #
-def start_game(start_level):
+def input_bits(keys):
+    """Converts a list of pygame keys into engine input bits."""
 
-    pygame.key.set_repeat() # Disable key repeat, that will be handled manually
+    bits = 0
+    for key_list, bit in ((c.LEFT_KEYS, engine.LEFT),
+                          (c.RIGHT_KEYS, engine.RIGHT),
+                          (c.DOWN_KEYS, engine.DOWN),
+                          (c.CW_KEYS, engine.CW),
+                          (c.CCW_KEYS, engine.CCW)):
+        if any(key in key_list for key in keys):
+            bits |= bit
 
-    # --- Game variables --- #
+    return bits
 
-    max_spawn_freeze = 31 # Max freeze frames after piece has spawned.
-                          # Freeze frames are cancelled by any keypress
+def save_replay(replay):
+    """Saves a replay to c.replay_dir (unless replays are turned off)."""
 
-    spawn_freeze_timer = max_spawn_freeze
-    frame_counter = 1 # Counter to control tetrimino falling
-    text_flash_counter = 0 # Counter to control timing for flashing text
-    DAS_counter = 0 # For control of horisontal auto-shift delays
+    if c.replay_dir is None:
+        return
+
+    os.makedirs(c.replay_dir, exist_ok=True)
+    file_name = time.strftime("%Y%m%d-%H%M%S") + f"-{replay.seed}.txr"
+    replay.save(os.path.join(c.replay_dir, file_name))
+
+def start_game(start_level, watch=None, speed=1, session=None,
+               spectating=None, broadcast=None):
+    """
+    Plays a game, returning when the player quits to the menu.
+    If watch is a Replay, that game is shown instead of taking inputs
+    from the keyboard, and this returns when the replay ends.
+    If session is a netplay.RollbackSession, this plays its local game
+    (versus), with the opponent's field shown small on the left.
+    If spectating is a spectate.Decoder, the game it's decoding is shown
+    as the stream comes in, and this returns when the game ends.
+    If broadcast is a sink from spectate, the game (played or watched)
+    is streamed to it for spectators.
+
+    The game is stepped at SIM_RATE * speed ticks per second however fast
+    frames are drawn, several ticks per frame if drawing is slow.
+    speed=0 fast-forwards: one tick per frame, with no waiting.
+    Animations are stepped along with the game, one frame per tick.
+    """
+
+    pygame.key.set_repeat() # Disable key repeat, that will be handled manually
 
-    level = start_level # Controls falling speed and point bonuses
-    lines = 0
-    points = 0
+    # --- Game variables --- #
 
-    soft_drop = False # If True, piece falls and locks faster than normal
+    # All game rules live in the engine, this function just draws it
+    if session is not None:
+        game = session.game # Stepped by the session, with the opponent's
+        replay = None
+    elif spectating is not None:
+        game = spectating.game # Changed to match the stream
+        replay = None
+    elif watch is None:
+        game = engine.Game(start_level)
+        replay = Replay.for_game(game) # Every frame's inputs get recorded
+    else:
+        game = watch.new_game()
+        replay = None
+        replay_frames = watch.frames()
+
+    # Practice mode: keep some history, so the game can be rewound
+    if replay is not None and c.rewind_seconds is not None:
+        rewinder = Rewinder(game, c.rewind_seconds, SIM_RATE)
+        step = rewinder.step
+    elif session is not None:
+        rewinder = None
+        step = session.advance
+    else:
+        rewinder = None
+        step = game.step
 
-    # Soft drop falling speed in frames per cell ("fpc")
-    if c.frames_per_cell[level] > 3:
-        soft_drop_fpc = 2
+    if broadcast is not None and session is None:
+        encoder = spectate.Encoder(game, broadcast)
     else:
-        soft_drop_fpc = 1
+        encoder = None
+
+    text_flash_counter = 0 # Counter to control timing for flashing text
 
     # --- Text initialisation --- #
 
     lines_text = Text("LINES", info_font, c.WHITE, "left", 0)
-    lines_num_text = Text(str(lines), number_font, c.WHITE, "left", 1)
+    lines_num_text = Text(str(game.lines), number_font, c.WHITE, "left", 1)
 
     level_text = Text("LEVEL", info_font, c.WHITE, "left", 4)
-    level_num_text = Text(str(level), number_font, c.WHITE, "left", 5)
+    level_num_text = Text(str(game.level), number_font, c.WHITE, "left", 5)
 
     paused_text = Text("PAUSED", info_font, c.WHITE, "centre", 4)
     game_over_text = Text("GAME OVER", info_font, c.RED, "centre", 4)
 
     score_text = Text("SCORE", info_font, c.WHITE, "right", 0)
-    points_num_text = Text(str(points), number_font, c.WHITE, "right", 1)
+    points_num_text = Text(str(game.points), number_font, c.WHITE, "right", 1)
 
     next_text = Text("NEXT", info_font, c.WHITE, "right", 4)
 
-    # --- Tetrimino, next piece and dead mino sprite group --- #
-
-    tetrimino = Tetrimino(random.randint(0, 6), c.spawn_pos)
-    next_piece = Tetrimino(randomiser(tetrimino.type_ID), array((12.5, 10)))
+    if session is not None:
+        vs_text = Text("VS", info_font, c.WHITE, "left", 7)
+        opponent_view = MiniFieldRenderer(vs_text.get_pos("left", 8, 0),
+                                          int(c.cell_size / 3))
 
-    dead_group = pygame.sprite.LayeredDirty() # Sprite group for dead minos
-    dead_group.set_clip(c.field_rect)
+    # --- Tetrimino, next piece and locked minos --- #
 
-    def complete_rows(dead_minos):
-        """Returns a list of which rows of the playfield are filled in."""
+    tetrimino = Tetrimino(game.piece.type_ID, game.spawn_pos)
+    next_piece = Tetrimino(game.next_type, (12.5, 10))
 
-        complete_rows = []
-
-        for row_n in range(c.ROWS):
-            dead_minos_in_row = [
-                    d for d in dead_minos
-                    if d.grid_y == row_n
-                    ]
-
-            if len(dead_minos_in_row) >= c.COLS:
-                complete_rows.append(row_n)
-
-        return complete_rows
+    board_view = BoardRenderer(bg) # Cached surface with the locked minos
+    board_view.sync(game.board)
 
     def update_display(dirty_rects):
         """
         Draw current tetrimino and next piece, and update any dirty rects.
         """
 
-        dirty_rects += tetrimino.draw(screen)
+        # The tetrimino isn't drawn over the line clear animation
+        if animation is None or game_over:
+            dirty_rects += tetrimino.draw(screen)
         dirty_rects += next_piece.draw(screen)
+        if session is not None:
+            dirty_rects += opponent_view.draw(screen, session.opponent_game)
+        profiler.lap("sprites")
 
         pygame.display.update(dirty_rects)
+        profiler.lap("display")
 
     # --- Draw all game screen stuff --- #
 
@@ -473,15 +742,29 @@ def start_game(start_level):
     points_num_text.display(screen, bg)
     next_text.display(screen, bg)
 
+    if session is not None:
+        vs_text.display(screen, bg)
+        pygame.draw.rect(screen, c.GREY, opponent_view.rect.inflate(2, 2), 1)
+        opponent_view.draw(screen, session.opponent_game)
+
     pygame.display.flip()
 
     # --- Game loop --- #
 
     dirty_rects = []
+    pressed_keys = [] # Keys pressed since the last tick
+    rewinds = 0 # Times REWIND_KEYS were pressed since the last rewind
+    resync = False # Whether everything needs redrawing from the game
     paused = False
     in_game = True
     game_over = 0
+    animation = None # Line clear or game over animation that's playing
+
+    lag = 0 # Ticks' worth of time that hasn't been simulated yet
+    last_time = time.perf_counter()
+
     while in_game:
+        profiler.start_frame()
 
         events = pygame.event.get()
         for event in events:
@@ -497,11 +780,18 @@ def start_game(start_level):
                 break
 
             # If game is over, press CONFIRM or mouse click to quit to menu
+            # (or rewind, in practice mode)
             if game_over:
                 if (event.type == pygame.KEYDOWN and
-                    event.key in c.CONFIRM_KEYS) or (
-                    event.type == pygame.MOUSEBUTTONUP and
-                    event.button == 1):
+                    event.key in c.REWIND_KEYS and rewinder is not None):
+                    rewinds += 1
+                    continue
+
+                if game_over == 2 and (
+                        (event.type == pygame.KEYDOWN and
+                         event.key in c.CONFIRM_KEYS) or
+                        (event.type == pygame.MOUSEBUTTONUP and
+                         event.button == 1)):
 
                     c.rot_sound.play()
                     in_game = False
@@ -515,22 +805,17 @@ def start_game(start_level):
             elif event.type == pygame.MOUSEMOTION:
                 pygame.mouse.set_visible(True)
 
-            # Pausing
-            if (event.type == pygame.KEYDOWN and
-                event.key in c.PAUSE_KEYS):
+            # Pausing (not in versus or when spectating, the other side
+            # wouldn't wait)
+            if (event.type == pygame.KEYDOWN and event.key in c.PAUSE_KEYS
+                and session is None and spectating is None):
                 # Toggle paused = True/False
                 paused = (False == paused)
+                pressed_keys = []
 
                 if not paused:
-                    # Redraw dead minos and grid
-
-                    screen.set_clip(c.field_rect)
-
-                    screen.blit(bg, (0, 0)) # Grid
-                    dead_group.repaint_rect(screen.get_rect())
-                    dead_group.draw(screen)
-
-                    screen.set_clip()
+                    # Redraw locked minos and grid
+                    board_view.draw(screen)
                     pygame.display.update(c.field_rect)
 
                 else:
@@ -541,367 +826,480 @@ def start_game(start_level):
 
                     pygame.display.update(c.field_rect)
 
-            # --- Register DOWN release for soft drop control --- #
-            if (event.type == pygame.KEYUP and
-                event.key in c.DOWN_KEYS):
-                soft_drop = False
-
             if paused:
                 # Don't check for shifting and rotating inputs while paused
                 continue
 
-            if not (event.type == pygame.KEYDOWN and
-                    tetrimino.lock_timer > 0):
-                # If tetrimino has locked,
-                # don't check inputs related to tetrimino control
+            if (event.type == pygame.KEYDOWN and
+                event.key in c.REWIND_KEYS and rewinder is not None):
+                rewinds += 1
                 continue
 
-            # --- Register DOWN press for soft drop control --- #
-            if event.key in c.DOWN_KEYS:
-                soft_drop = True
-                spawn_freeze_timer = 0
-
-            # --- Shifting on LEFT/RIGHT keypress --- #
+            if event.type == pygame.KEYDOWN:
+                pressed_keys.append(event.key)
 
-            if event.key in c.LEFT_KEYS:
-                c.shift_sound.play()
-                tetrimino.clear(screen, bg)
-                tetrimino.shift("left", dead_group)
-                DAS_counter = 0
+        if not in_game:
+            # Quit to menu
+            if replay is not None:
+                save_replay(replay)
+            return
 
-                spawn_freeze_timer = min(c.frames_per_cell[level],
-                                         spawn_freeze_timer)
+        if paused:
+            clock.tick(FPS)
+            last_time = time.perf_counter() # Pausing stops the clock
+            continue # Don't proceed to gameplay section of game loop
 
-            if event.key in c.RIGHT_KEYS:
-                c.shift_sound.play()
-                tetrimino.clear(screen, bg)
-                tetrimino.shift("right", dead_group)
-                DAS_counter = 0
+        # --- Rewinding (practice mode) --- #
 
-                spawn_freeze_timer = min(c.frames_per_cell[level],
-                                         spawn_freeze_timer)
+        # Each press goes back to the start of the current piece, or of
+        # the one before if it's only just come into play. Waits for any
+        # line clear animation to finish, but not for the game over one
+        if rewinds and (animation is None or game_over):
+            if game_over:
+                # Back into play: the curtain wiped the whole field
+                game_over = 0
+                animation = None
+                pygame.mouse.set_visible(False)
+                dirty_rects += board_view.draw(screen)
+
+            for _ in range(rewinds):
+                rewinder.back_pieces(1, grace=SIM_RATE // 2)
+            replay.truncate(rewinder.frame)
+            if encoder is not None:
+                encoder.keyframe()
+
+            rewinds = 0
+            pressed_keys = []
+            c.rot_sound.play()
+            resync = True
+
+        # The whole game state changed (rewind, or keyframe in a stream)
+        if resync:
+            resync = False
+
+            # Redraw everything that shows the game state
+            dirty_rects += board_view.draw(
+                    screen,
+                    board_view.sync(game.board) + tetrimino.drawn_rects())
+            dirty_rects += next_piece.draw(screen)
+            next_piece.clear(screen, bg)
 
-            # --- Rotation on keypress --- #
+            tetrimino = Tetrimino(game.piece.type_ID, game.spawn_pos)
+            tetrimino.follow(game.piece)
+            next_piece = Tetrimino(game.next_type, (12.5, 10))
 
-            if event.key in c.CW_KEYS:
-                tetrimino.clear(screen, bg)
-                tetrimino.rotate("cw", dead_group)
-                c.rot_sound.play()
+            text_flash_counter = -1 # Stop any flashing, show the level
+            for text, value in ((points_num_text, game.points),
+                                (lines_num_text, game.lines),
+                                (level_num_text, game.level)):
+                dirty_rects.append(
+                        text.display(screen, bg, new_text=str(value)))
 
-                spawn_freeze_timer = min(c.frames_per_cell[level],
-                                         spawn_freeze_timer)
+        # --- How many ticks to step this frame --- #
 
-            if event.key in c.CCW_KEYS:
-                tetrimino.clear(screen, bg)
-                tetrimino.rotate("ccw", dead_group)
-                c.rot_sound.play()
+        now = time.perf_counter()
+        if speed:
+            lag = min(lag + (now - last_time) * SIM_RATE * speed,
+                      MAX_TICKS_PER_FRAME)
+            ticks = int(lag)
+            lag -= ticks
+        else:
+            ticks = 1
+        last_time = now
 
-                spawn_freeze_timer = min(c.frames_per_cell[level],
-                                         spawn_freeze_timer)
+        # Versus: take in the opponent's inputs (rolling back if need be)
+        if session is not None:
+            session.poll()
 
-        if not in_game:
-            # Quit to menu
-            menu(start_level)
-            break
+        if spectating is not None:
+            spectating.poll()
 
         # --- Game over screen w/ animation --- #
         if game_over:
-            if game_over == 2:
-                # If animation has already played, don't play it again.
-                # Also, don't proceed to gameplay section of game loop
-                continue
+            for _ in range(ticks):
+                if session is not None and session.ready():
+                    session.advance() # The opponent may still be playing
 
-            pygame.mouse.set_visible(True)
-            pygame.event.clear()
+                if animation is None:
+                    continue
 
-            c.game_over_sound.play()
+                dirty_rects += animation.step(screen)
+                if animation.done:
+                    animation = None
+                    game_over = 2 # Animation has played
 
-            # Small delay before animation
-            for _ in range(30): clock.tick(FPS)
+            if session is not None:
+                dirty_rects += opponent_view.draw(
+                        screen, session.opponent_game)
 
-            # Animation (screen wipe, reveal GAME OVER text)
-            step = c.field_rect.height / 75
-            h = int(step)
-            y = c.field_rect[1] + c.field_rect.height - h
-            while y > c.field_rect[1]:
-                pygame.event.pump()
-                animation_dirty_rects = []
+            pygame.display.update(dirty_rects)
+            dirty_rects = []
 
-                animation_dirty_rects.append(
-                        pygame.draw.rect(
-                                screen,
-                                c.BLUE_GREY,
-                                (c.field_pos[0], y, c.field_width, h)))
+            if game_over == 2 and (watch is not None or
+                                   spectating is not None):
+                return # Replay or stream is over
 
-                game_over_text.display(screen, c.BLUE_GREY)
+            clock.tick(FPS if speed else 0)
+            continue # Don't proceed to gameplay section of game loop
 
-                pygame.display.update(animation_dirty_rects)
-                y -= step
-                h += step
-                clock.tick(FPS)
+        if watch is None and spectating is None:
+            keys_held = pygame.key.get_pressed()
+            held = input_bits([k for k in c.LEFT_KEYS + c.RIGHT_KEYS
+                               + c.DOWN_KEYS if keys_held[k]])
 
-            for _ in range(30): clock.tick(FPS) # Small delay
-            pygame.event.clear()
+        profiler.lap("input")
 
-            game_over = 2 # Animation has played
-            continue # Don't proceed to gameplay section of game loop
+        # --- Step the engine --- #
 
-        # --- Make level number flash when you level up --- #
-        if text_flash_counter >= 0:
-            if text_flash_counter % 40 == 0: # Show text
-                dirty_rects.append(
-                        level_num_text.display(screen, bg))
+        piece = game.piece # Only changes on a spawn, which ends the batch
+        game_events = 0
+        for tick in range(ticks):
+            if session is not None and not session.ready():
+                lag += ticks - tick # Wait for the opponent to catch up
+                break
 
-            elif text_flash_counter % 40 == 20: # Hide text
-                dirty_rects.append(
-                        level_num_text.clear(screen, bg))
+            if animation is not None:
+                # The game waits while the cleared rows are wiped
+                if not animation.done:
+                    dirty_rects += animation.step(screen)
+
+                if session is not None:
+                    # The session holds our game for as long as the
+                    # animation lasts on the host's screen, and the
+                    # opponent's game goes on meanwhile
+                    session.advance()
+                    done = not session.held
+                else:
+                    done = animation.done
 
-            text_flash_counter -= 1
+                if done:
+                    animation = None
+                    game_events |= after_clear
+                    lag += ticks - tick - 1
+                    break
 
-        if paused:
-            clock.tick(FPS)
-            pygame.display.update(dirty_rects)
-            dirty_rects = []
-            continue # Don't proceed to gameplay section of game loop
+                continue
+
+            if spectating is not None:
+                tick_events = spectating.step()
+                if tick_events is None:
+                    lag = 0 # Caught up with the stream, so wait for more
+                    break
+
+                if tick_events & spectate.RESYNC:
+                    resync = True
+                    break # Redrawn from scratch next frame
 
-        # --- Manage auto-shift --- #
+            else:
+                if watch is None:
+                    pressed = input_bits(pressed_keys)
+                    if replay is not None:
+                        replay.record(pressed, held)
+                else:
+                    pressed, held = next(replay_frames, (None, None))
+                    if pressed is None:
+                        return # Replay is over
+
+                pressed_keys = []
+                tick_events = step(pressed, held)
+                if replay is not None:
+                    replay.checkpoint(game)
+                if encoder is not None:
+                    encoder.frame(tick_events)
+
+            # Make level number flash when you level up
+            if text_flash_counter >= 0:
+                if text_flash_counter % 40 == 0: # Show text
+                    dirty_rects.append(
+                            level_num_text.display(screen, bg))
 
-        keys_held = pygame.key.get_pressed()
+                elif text_flash_counter % 40 == 20: # Hide text
+                    dirty_rects.append(
+                            level_num_text.clear(screen, bg))
 
-        dir_held = None
+                text_flash_counter -= 1
 
-        # Check if LEFT or RIGHT is held
-        left_held = bool(
-                [k for k in c.LEFT_KEYS if keys_held[k]])
-        right_held = bool(
-                [k for k in c.RIGHT_KEYS if keys_held[k]])
+            if tick_events & engine.CLEAR:
+                # Hold back the rest until the rows have been wiped
+                after_clear = tick_events & (engine.CLEAR | engine.LEVEL_UP
+                                             | engine.SPAWN | engine.GAME_OVER)
+                tick_events ^= after_clear
+                animation = LineClearAnimation(game.cleared_rows, bg)
 
-        if not (left_held == right_held):
-            # If only one direction is held
-            dir_held = "left" if left_held else "right"
+                if len(game.cleared_rows) == 4:
+                    c.tetris_sound.play()
+                else:
+                    c.clear_sound.play()
 
-        if dir_held and tetrimino.lock_timer > 0:
-            DAS_counter += 1
-            spawn_freeze_timer = 0
-            if DAS_counter == c.DAS:
-                tetrimino.clear(screen, bg)
-                shifted = tetrimino.shift(dir_held, dead_group)
-                DAS_counter = c.DAS - c.ARR
-                # If tetrimino has actually moved, play shift sonud
-                if shifted: c.shift_sound.play()
+            game_events |= tick_events
 
-        # --- Falling and landing --- #
+            if (tick_events & (engine.SPAWN | engine.GAME_OVER)
+                or animation is not None):
+                # Draw it before going on. Keep the unused time
+                lag += ticks - tick - 1
+                break
 
-        # If soft dropping, make lock delay 2 frames
-        if soft_drop and tetrimino.lock_timer > 2:
-            tetrimino.lock_timer = 2
+        if encoder is not None:
+            encoder.flush()
 
-        # If tetrimino has landed, start locking timer
-        if tetrimino.landed(dead_group):
-            tetrimino.lock_timer -= 1
+        profiler.lap("step")
 
-        # Make tetrimino fall
-        if not (tetrimino.lock_timer > 0 and spawn_freeze_timer <= 0):
-            # Don't make tetrimino fall if it has locked or is in spawn freeze
-            pass
+        # Sounds
+        if game_events & engine.SHIFT:
+            c.shift_sound.play()
 
-        elif not soft_drop and frame_counter % c.frames_per_cell[level] == 0:
-            tetrimino.clear(screen, bg)
-            tetrimino.fall(dead_group, level)
+        if game_events & engine.ROTATE:
+            c.rot_sound.play()
 
-        elif soft_drop and frame_counter % soft_drop_fpc == 0:
+        if game_events & engine.MOVE:
             tetrimino.clear(screen, bg)
-            tetrimino.fall(dead_group, level)
+            tetrimino.follow(piece)
 
-            # Pushdown points (1 point for each frame during soft drop)
-            points += 1
+        if game_events & engine.DROP:
             # Update points text
             dirty_rects.append(
-                    points_num_text.display(screen, bg, new_text=str(points)))
+                    points_num_text.display(
+                            screen, bg, new_text=str(game.points)))
 
         # --- Drawing stuff and updating screen --- #
 
-        # Make tetrimino flash when it locks
-        if tetrimino.lock_timer == 0:
+        if game_events & engine.LOCK:
             c.lock_sound.play()
-            for spr in tetrimino:
-                spr.colour = c.WHITE
-                spr.update()
 
-        elif tetrimino.lock_timer <= -3:
-            for spr in tetrimino:
-                spr.colour = c.colours[tetrimino.type_ID]
-                spr.update()
+        # Make tetrimino flash white for the three ticks after it locks
+        if -3 < piece.lock_timer <= 0:
+            colour = c.WHITE
+        else:
+            colour = c.colours[tetrimino.type_ID]
 
-        update_display(dirty_rects)
-        dirty_rects = []
+        for spr in tetrimino:
+            if spr.colour != colour:
+                spr.colour = colour
+                spr.update()
 
         # --- After tetrimino has locked and flashed --- #
-        if tetrimino.lock_timer <= -4:
-            # If the tetrimino locks above the playing field; Game over :o
-            if max(tetrimino.minos[:,1]) < 0:
-                next_piece.clear(screen, bg)
-                game_over = 1
-                continue
-
-            dead_group.add(tetrimino)
-            soft_drop = False
-
-            # --- Line clearing w/ animation --- #
-
-            rows_to_clear = complete_rows(dead_group)
-
-            if rows_to_clear:
-
-                # Play sound
-                if len(rows_to_clear) == 4:
-                    c.tetris_sound.play()
-                else:
-                    c.clear_sound.play()
-
-                # Find which minos should move down after line clearing
-
-                dead_minos_above = []
-
-                for row_n in rows_to_clear:
-                    dead_minos_above += [
-                            d for d in dead_group
-                            if (d.grid_y < row_n and
-                                d.grid_y not in rows_to_clear and
-                                d not in dead_minos_above)
-                            ]
 
-                # Animation
+        if game_events & engine.CLEAR:
+            # Reset field border after the animation
+            dirty_rects += draw_field_border(screen, c.BLUE_GREY, w=2)
+            draw_field_border(screen, c.GREY)
 
-                x = c.field_pos[0] + c.field_width // 2 - 1
-                w = 2
-                step = c.field_width / 42
-                i = 0
-                while x >= c.field_pos[0]: # Animation loop
-                    pygame.event.pump()
-                    animation_dirty_rects = []
+            if game_events & engine.LEVEL_UP:
+                c.level_up_sound.play()
 
-                    for row_n in rows_to_clear:
-                        h = Mino.get_size(0, row_n)[1]
-                        y = int(c.cell_size * row_n + c.field_pos[1])
-                        rectangle = pygame.Rect(x, y, w, h)
-
-                        # Draw bg over part of the filled row
-                        screen.set_clip(rectangle)
-                        screen.blit(bg, (0, 0))
-
-                        animation_dirty_rects.append(rectangle)
-
-                    screen.set_clip()
-
-                    # Make field border flash if you get a tetris
-                    if len(rows_to_clear) != 4:
-                        pass
+                dirty_rects.append(
+                        level_num_text.display(
+                                screen, bg, new_text=str(game.level)))
 
-                    elif i % 4 == 0:
-                        animation_dirty_rects += draw_field_border(
-                                screen, c.CYAN, w=2)
+                # Start flashing of level text
+                level_num_text.clear(screen, bg)
+                text_flash_counter = 60
 
-                    elif i % 4 == 2:
-                        animation_dirty_rects += draw_field_border(
-                                screen, c.BLUE_GREY, w=2)
-                        draw_field_border(screen, c.GREY)
+            # Update points and lines text
+            dirty_rects.append(
+                    points_num_text.display(
+                            screen, bg, new_text=str(game.points)))
 
-                    pygame.display.update(animation_dirty_rects)
+            dirty_rects.append(
+                    lines_num_text.display(
+                            screen, bg, new_text=str(game.lines)))
 
-                    w += 2 * step
-                    x -= step
-                    i += 1
+            # (The clear itself, and its animation, count towards "step")
+            profiler.lap("score_text")
 
-                    clock.tick(FPS)
+        if game_events & engine.SPAWN:
+            # Redraw the rows that changed (locked piece and cleared rows),
+            # and wherever the old tetrimino was drawn. Rows the animation
+            # wiped too, even if what moved down into them looks the same
+            rects = board_view.sync(game.board) + tetrimino.drawn_rects()
+            if game_events & engine.CLEAR:
+                rects += [board_view.row_rect(y) for y in game.cleared_rows]
+            dirty_rects += board_view.draw(screen, rects)
 
-                # Reset field border
-                dirty_rects += draw_field_border(screen, c.BLUE_GREY, w=2)
-                draw_field_border(screen, c.GREY)
+            # --- Spawn new tetrimino and next piece --- #
 
-                # Erase all dead minos from the screen before moving any
-                dead_group.clear(screen, bg)
+            dirty_rects += next_piece.draw(screen)
+            next_piece.clear(screen, bg)
 
-                # Remove dead minos in cleared rows from dead_group
-                dead_minos_to_remove = [
-                        d for d in dead_group
-                        if d.grid_y in rows_to_clear
-                        ]
+            tetrimino = Tetrimino(game.piece.type_ID, game.spawn_pos)
+            next_piece = Tetrimino(game.next_type, (12.5, 10))
 
-                dead_group.remove(dead_minos_to_remove)
+            profiler.lap("spawn")
 
-                # Update display to reflect erasing of all dead minos
-                pygame.display.update(dead_group.draw(screen))
+        if game_events & engine.GAME_OVER:
+            if not game_events & engine.SPAWN:
+                # The tetrimino locked above the playing field
+                next_piece.clear(screen, bg)
+                next_piece.empty()
 
-                # Move dead minos above the cleared rows down
-                for d in dead_minos_above:
-                    displacement = 0
-                    for row_n in rows_to_clear:
-                        if d.grid_y < row_n:
-                            # If mino is above a cleared row
-                            displacement += 1
+            pygame.mouse.set_visible(True)
+            c.game_over_sound.play()
 
-                    d.grid_y += displacement
-                    d.update()
+            game_over = 1
+            animation = GameOverAnimation(game_over_text)
 
-                # Finally, redraw all dead minos (some in their new positions)
-                pygame.display.update(dead_group.draw(screen))
+        update_display(dirty_rects)
+        dirty_rects = []
 
-                # Update points, lines and level variables
-                lines += len(rows_to_clear)
-                points += c.clear_points[len(rows_to_clear)] * (level + 1)
-                if lines // 10 > level < c.max_level:
-                    level += 1
-                    c.level_up_sound.play()
-                    if c.frames_per_cell[level] <= 3:
-                        soft_drop_fpc = 1
+        profiler.end_frame()
+        clock.tick(FPS if speed else 0)
+        profiler.lap("wait")
 
-                    dirty_rects.append(
-                            level_num_text.display(
-                                    screen, bg, new_text=str(level)))
+# ------ Versus over the network ------ #
+def versus(args):
+    """
+    Plays one versus match, hosting it (args.host is the port) or
+    joining one (args.join is "HOST:PORT"). The host picks the level.
+    """
+    if args.host is not None:
+        transport = netplay.UdpTransport(("", args.host))
+        start_level = menu(0)
+    else:
+        host, port = args.join.rsplit(":", 1)
+        transport = netplay.UdpTransport(remote_addr=(host, int(port)))
+        start_level = 0 # Whatever the host picked is used
 
-                    # Start flashing of level text
-                    level_num_text.clear(screen, bg)
-                    text_flash_counter = 60
+    # Worse network conditions, for testing
+    if args.latency or args.jitter or args.loss:
+        transport = netplay.LatencySimulator(
+                transport, args.latency, args.jitter, args.loss)
 
-                # Update points and lines text
-                dirty_rects.append(
-                        points_num_text.display(
-                                screen, bg, new_text=str(points)))
+    screen.blit(bg, (0, 0))
+    Text("WAITING", info_font, c.WHITE, "centre", 4).display(screen, bg)
+    pygame.display.flip()
 
-                dirty_rects.append(
-                        lines_num_text.display(
-                                screen, bg, new_text=str(lines)))
+    def idle():
+        """Keeps the window going while waiting. ESC gives up."""
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
 
-            # --- Spawn new tetrimino and next piece --- #
+            if (event.type == pygame.KEYDOWN and
+                event.key == pygame.K_ESCAPE):
+                return False
 
-            dirty_rects += next_piece.draw(screen)
-            next_piece.clear(screen, bg)
+        clock.tick(FPS)
 
-            tetrimino = Tetrimino(next_piece.type_ID, c.spawn_pos)
-            next_piece = Tetrimino(randomiser(tetrimino.type_ID),
-                                   array((12.5, 10)))
+    session = netplay.connect(transport, args.host is not None, start_level,
+                              clear_delay=LineClearAnimation.length(),
+                              idle=idle)
+    if session is None:
+        transport.close()
+        return
 
-            spawn_freeze_timer = max_spawn_freeze
+    start_game(session.game.start_level, session=session)
+    session.close()
 
-            # If the new piece spawns overlapping any dead minos; Game over :o
-            if tetrimino.colliding(dead_group):
-                pygame.display.update(tetrimino.draw(screen))
-                game_over = 1
+    if session.desync_frame is not None:
+        print(f"Warning: the games went out of step at frame "
+              f"{session.desync_frame} (a bug, or different versions)")
 
-        # --- Time stuff --- #
+# ------ Spectating ------ #
+def split_address(text):
+    """
+    Returns (host, port) if text looks like "HOST:PORT" or ":PORT",
+    otherwise None (it's a file path).
+    """
+    host, sep, port = text.rpartition(":")
+    if sep and port.isdigit():
+        return host, int(port)
+    return None
+
+def open_broadcast(target):
+    """Returns a spectate sink for "PATH" or ":PORT"."""
+    address = split_address(target)
+    if address is None:
+        return spectate.FileSink(target)
+    return spectate.BroadcastSink(address[1], address[0])
+
+def watch_stream(source):
+    """
+    Shows the games in a spectator stream, from a file ("PATH", which
+    can still be being written) or a broadcast ("HOST:PORT"), until ESC.
+    """
+    address = split_address(source)
+    if address is None:
+        decoder = spectate.Decoder(spectate.FileSource(source))
+    else:
+        decoder = spectate.Decoder(spectate.SocketSource(*address))
 
-        if spawn_freeze_timer > 0:
-            spawn_freeze_timer -= 1
-            frame_counter = 0
-        else:
-            frame_counter += 1
+    waiting_text = Text("WAITING", info_font, c.WHITE, "centre", 4)
+    while True:
+        screen.blit(bg, (0, 0))
+        waiting_text.display(screen, bg)
+        pygame.display.flip()
 
-        clock.tick(FPS)
+        # Wait for the next game to start
+        decoder.poll()
+        while not decoder.next_game():
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    pygame.quit()
+                    sys.exit()
 
-        # Performance monitoring
-        actual_fps = round(clock.get_fps(), 2)
-        perf_info = ":/" if int(actual_fps) > FPS else "  "
-        sys.stdout.write(f"FPS: {actual_fps} {perf_info}   \r")
+                if (event.type == pygame.KEYDOWN and
+                    event.key == pygame.K_ESCAPE):
+                    decoder.source.close()
+                    return
 
-menu(0)
+            clock.tick(FPS)
+            decoder.poll()
+
+        start_game(decoder.game.start_level, spectating=decoder)
+        if not decoder.game.game_over:
+            break # Quit with ESC
+
+    decoder.source.close()
+
+def main():
+    selected_lvl = 0
+
+    # Usage: python main.py [--speed N] [REPLAY_FILE...] to watch replays
+    # first, N times faster than real time (0: as fast as possible)
+    #    or: python main.py --host PORT / --join HOST:PORT for versus
+    #    or: python main.py --spectate PATH / HOST:PORT to watch a stream
+    parser = argparse.ArgumentParser(description="Tetrix")
+    parser.add_argument("replays", nargs="*", metavar="REPLAY_FILE")
+    parser.add_argument("--speed", type=float, default=1)
+    parser.add_argument("--host", type=int, metavar="PORT",
+                        help="host a versus match on this UDP port")
+    parser.add_argument("--join", metavar="HOST:PORT",
+                        help="join a versus match")
+    parser.add_argument("--latency", type=float, default=0, metavar="MS",
+                        help="delay sent packets (for testing versus)")
+    parser.add_argument("--jitter", type=float, default=0, metavar="MS",
+                        help="vary the delay by up to this much")
+    parser.add_argument("--loss", type=float, default=0, metavar="FRACTION",
+                        help="drop this fraction of sent packets")
+    parser.add_argument("--broadcast", metavar="PATH|:PORT",
+                        help="stream games to a file or to spectators")
+    parser.add_argument("--spectate", metavar="PATH|HOST:PORT",
+                        help="watch a stream of games")
+    args = parser.parse_args()
+
+    assets.preload() # Sounds load while the window opens
+    init()
+
+    if args.host is not None or args.join:
+        versus(args)
+        return
+
+    if args.spectate:
+        watch_stream(args.spectate)
+        return
+
+    broadcast = None
+    if args.broadcast:
+        broadcast = open_broadcast(args.broadcast)
+
+    for path in args.replays:
+        start_game(0, watch=Replay.load(path), speed=args.speed,
+                   broadcast=broadcast)
+
+    while True:
+        selected_lvl = menu(selected_lvl)
+        start_game(selected_lvl, broadcast=broadcast)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+import heapq
+import random
+import socket
+import struct
+import time
+
+import engine
+import profiling
+from replay import PRESSED_SHIFT
+from state import Snapshot
+
+# Rollback netcode for two-player matches.
+#
+# Each side runs both games (its own and the opponent's) one frame at a
+# time, like a single game. Local inputs are used straight away and sent
+# to the other side. The opponent's inputs for a frame usually arrive a
+# few frames late, so until they do the session predicts them (the keys
+# held last time, nothing newly pressed) and carries on. When the real
+# inputs turn out to be different, it restores the state from before the
+# first wrong frame and simulates up to the present again. If the other
+# side falls more than MAX_ROLLBACK frames behind, this side waits.
+#
+# The two games don't affect each other (yet), but the whole match is
+# rolled back together, so something like garbage lines would just work.
+#
+# Packets (UDP, all little-endian). The first byte is the packet type:
+#
+#   JOIN     type                      joiner -> host, until it's answered
+#   HELLO    type, seed uint32, start level uint8, clear delay uint8
+#                                      host -> joiner, echoed back
+#   INPUTS   type, ack uint32, checked uint32, checksum uint64,
+#            start frame uint32, count uint8,
+#            then count inputs uint16 (held bits | pressed bits << 5)
+#   BYE      type                      leaving the match
+#
+# An INPUTS packet carries every input the other side hasn't acknowledged
+# yet (up to MAX_INPUTS_PER_PACKET), so a lost packet is made up for by
+# the next one. ack is how many of the other side's inputs this side has.
+#
+# checksum is the match's checksum after `checked` frames, the most this
+# side has both players' real inputs for (0: none yet). If the other side
+# got a different checksum after the same frame, the two have gone out of
+# step (a desync), and desync_frame says where.
+
+JOIN = 1
+HELLO = 2
+INPUTS = 3
+BYE = 4
+
+HELLO_PACKET = struct.Struct("<BIBB")
+INPUTS_HEADER = struct.Struct("<BIIQIB")
+INPUT = struct.Struct("<H")
+
+MAX_ROLLBACK = 8 # Frames this side can get ahead of the other's inputs
+MAX_INPUTS_PER_PACKET = 64
+DISCONNECT_TIMEOUT = 5 # Seconds without a packet before giving up
+CHECKSUMS_KEPT = 256 # Frames
+
+INPUT_MASK = (1 << PRESSED_SHIFT) - 1
+
+# ------ Transports ------ #
+class UdpTransport:
+    """
+    Non-blocking UDP socket that talks to one other player. If no
+    remote address is given (when hosting), it talks to whoever sends
+    it something first.
+    """
+    def __init__(self, local_addr=("", 0), remote_addr=None):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(local_addr)
+        self.sock.setblocking(False)
+
+        # Packets come back from an IP address, so look the name up now
+        if remote_addr is not None:
+            host, port = remote_addr
+            remote_addr = (socket.gethostbyname(host), port)
+        self.remote_addr = remote_addr
+
+    @property
+    def address(self):
+        return self.sock.getsockname()
+
+    def send(self, data):
+        if self.remote_addr is None:
+            return # Nobody to send to yet
+
+        try:
+            self.sock.sendto(data, self.remote_addr)
+        except OSError:
+            pass # Treated like a lost packet
+
+    def receive(self):
+        """Returns a list of the packets that have arrived."""
+        packets = []
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except BlockingIOError:
+                break
+            except ConnectionError:
+                continue # The other side's port closed (Windows)
+
+            if self.remote_addr is None:
+                self.remote_addr = addr
+            elif addr != self.remote_addr:
+                continue # Someone else
+
+            packets.append(data)
+
+        return packets
+
+    def close(self):
+        self.sock.close()
+
+class LatencySimulator:
+    """
+    Wraps a transport to make the network worse, for testing: every
+    packet sent is delayed by latency_ms +- jitter_ms (so packets can
+    arrive out of order), and a fraction `loss` of them are dropped.
+    """
+    def __init__(self, transport, latency_ms=0, jitter_ms=0, loss=0,
+                 seed=None, clock=time.perf_counter):
+        self.transport = transport
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.clock = clock
+
+        self.queue = [] # Heap of (time to send, number, packet)
+        self.sent = 0
+
+    def send(self, data):
+        self.flush()
+        if self.rng.random() < self.loss:
+            return
+
+        delay = self.latency + self.rng.uniform(-self.jitter, self.jitter)
+        heapq.heappush(self.queue,
+                       (self.clock() + max(delay, 0), self.sent, data))
+        self.sent += 1
+
+    def flush(self):
+        """Sends the packets whose delay is up."""
+        now = self.clock()
+        while self.queue and self.queue[0][0] <= now:
+            self.transport.send(heapq.heappop(self.queue)[2])
+
+    def receive(self):
+        self.flush()
+        return self.transport.receive()
+
+    def close(self):
+        # Whatever's still waiting goes now, so a BYE isn't lost
+        while self.queue:
+            self.transport.send(heapq.heappop(self.queue)[2])
+        self.transport.close()
+
+# ------ Class for keeping a match in step ------ #
+class RollbackSession:
+    """
+    One side of a two-player match. games[0] is the host's game and
+    games[1] the joiner's; `player` says which one is played here.
+
+    Each frame, call poll() to take in the other side's inputs (rolling
+    back if need be), then advance() with the local inputs as long as
+    ready() says so.
+
+    After a line clear a game is held for clear_delay frames, the same
+    on both sides, while the frontend plays its animation.
+    """
+    def __init__(self, games, player, transport, clear_delay=0,
+                 max_rollback=MAX_ROLLBACK, clock=time.perf_counter):
+        self.games = games
+        self.player = player
+        self.opponent = 1 - player
+        self.transport = transport
+        self.clear_delay = clear_delay
+        self.max_rollback = max_rollback
+        self.clock = clock
+
+        self.frame = 0 # Frames simulated
+        self.local_inputs = [] # Ours, one per frame
+        self.remote_inputs = [] # The other side's, as far as we have them
+        self.predicted = {} # Frame -> remote inputs guessed for it
+        self.snapshots = {} # Frame -> state of the match before it
+        self.holds = [0, 0] # Frames each game is held after a line clear
+        self.acked = 0 # How many of our inputs the other side has
+
+        self.checksums = {} # Frames simulated -> checksum after them
+        self.remote_checksums = {} # The other side's, not compared yet
+        self.desync_frame = None # First frame the sides were out of step
+
+        self.last_heard = clock()
+        self.disconnected = False
+
+        # Stats
+        self.rollbacks = 0
+        self.resimulated = 0 # Frames simulated again
+        self.rollback_times = profiling.Histogram() # ns per rollback
+
+    @property
+    def game(self):
+        return self.games[self.player]
+
+    @property
+    def opponent_game(self):
+        return self.games[self.opponent]
+
+    @property
+    def held(self):
+        """Whether the local game is being held after a line clear."""
+        return self.holds[self.player] > 0
+
+    def ready(self):
+        """Whether there's room to simulate another frame yet."""
+        return (self.disconnected or
+                self.frame - len(self.remote_inputs) < self.max_rollback)
+
+    def advance(self, pressed=0, held=0):
+        """
+        Simulates the next frame with the given local inputs.
+        Returns the local game's events.
+        """
+        frame = self.frame
+        self.local_inputs.append(held | pressed << PRESSED_SHIFT)
+        self.send_inputs()
+
+        self.snapshots[frame] = self.save()
+        self.snapshots.pop(frame - self.max_rollback - 1, None)
+
+        events = self.simulate(frame)
+        self.frame += 1
+        return events
+
+    def simulate(self, frame):
+        """Steps both games through a frame. Returns the local events."""
+        if frame < len(self.remote_inputs):
+            remote = self.remote_inputs[frame]
+        elif self.disconnected:
+            remote = None # The opponent's game stops where it got to
+        else:
+            # Same keys held as last time, nothing new pressed
+            if self.remote_inputs:
+                remote = self.remote_inputs[-1] & INPUT_MASK
+            else:
+                remote = 0
+            self.predicted[frame] = remote
+
+        inputs = [0, 0]
+        inputs[self.player] = self.local_inputs[frame]
+        inputs[self.opponent] = remote
+
+        local_events = 0
+        for player, game in enumerate(self.games):
+            if inputs[player] is None:
+                continue
+
+            if self.holds[player]:
+                self.holds[player] -= 1
+                continue
+
+            events = game.step(inputs[player] >> PRESSED_SHIFT,
+                               inputs[player] & INPUT_MASK)
+            if events & engine.CLEAR:
+                self.holds[player] = self.clear_delay
+
+            if player == self.player:
+                local_events = events
+
+        # Kept even if it's a guess: if the guess was right, it's final
+        self.checksums[frame + 1] = self.checksum()
+        self.checksums.pop(frame + 1 - CHECKSUMS_KEPT, None)
+
+        return local_events
+
+    def checksum(self):
+        """Returns a checksum of the whole match as it is now."""
+        return (self.games[0].checksum()
+                ^ engine.rotate_left(self.games[1].checksum(), 32)
+                ^ self.holds[0] << 8 ^ self.holds[1])
+
+    @property
+    def checked(self):
+        """Frames simulated with both players' real inputs."""
+        return min(self.frame, len(self.remote_inputs))
+
+    def save(self):
+        return (tuple(self.holds),
+                Snapshot.take(self.games[0]), Snapshot.take(self.games[1]))
+
+    def load(self, state):
+        holds, *snapshots = state
+        self.holds = list(holds)
+        for snapshot, game in zip(snapshots, self.games):
+            snapshot.restore(game)
+
+    def rollback(self, frame):
+        """Goes back to before frame and simulates up to now again."""
+        start = time.perf_counter_ns()
+
+        self.load(self.snapshots[frame])
+        for f in range(frame, self.frame):
+            if f > frame:
+                self.snapshots[f] = self.save()
+            self.simulate(f)
+
+        self.rollbacks += 1
+        self.resimulated += self.frame - frame
+        self.rollback_times.add(time.perf_counter_ns() - start)
+
+    # --- Network --- #
+
+    def poll(self):
+        """Takes in packets from the other side, rolling back if needed."""
+        rollback_to = None
+
+        for data in self.transport.receive():
+            self.last_heard = self.clock()
+            kind = data[0]
+
+            if kind == HELLO and self.player == 1:
+                self.transport.send(data) # Host didn't get our reply
+
+            elif kind == BYE:
+                self.disconnected = True
+
+            elif self.disconnected:
+                # The opponent's game stopped where it got to, and frames
+                # since were simulated without it, so it stays stopped
+                continue
+
+            elif kind == INPUTS and len(data) >= INPUTS_HEADER.size:
+                (_, ack, checked, checksum,
+                 start, count) = INPUTS_HEADER.unpack_from(data)
+                self.acked = max(self.acked, ack)
+                if checked:
+                    self.remote_checksums[checked] = checksum
+
+                for i in range(count):
+                    frame = start + i
+                    if frame != len(self.remote_inputs):
+                        continue # Already have it (or missed one before)
+
+                    inputs, = INPUT.unpack_from(
+                            data, INPUTS_HEADER.size + i * INPUT.size)
+                    self.remote_inputs.append(inputs)
+
+                    # Was it guessed right?
+                    if (frame in self.predicted and
+                        self.predicted.pop(frame) != inputs and
+                        rollback_to is None):
+                        rollback_to = frame
+
+        if rollback_to is not None:
+            self.rollback(rollback_to)
+
+        self.compare_checksums()
+
+        if self.clock() - self.last_heard > DISCONNECT_TIMEOUT:
+            self.disconnected = True
+
+        if not self.ready():
+            # Stuck waiting, so send ours again in case they were lost
+            self.send_inputs()
+
+    def compare_checksums(self):
+        """Compares the other side's checksums with ours, once final."""
+        checked = self.checked
+        for frame in list(self.remote_checksums):
+            if frame > checked:
+                continue # Ours might still change
+
+            checksum = self.remote_checksums.pop(frame)
+            ours = self.checksums.get(frame)
+            if (ours is not None and ours != checksum and
+                (self.desync_frame is None or frame < self.desync_frame)):
+                self.desync_frame = frame
+
+    def send_inputs(self):
+        start = self.acked
+        inputs = self.local_inputs[start:start + MAX_INPUTS_PER_PACKET]
+
+        checked = self.checked
+        checksum = self.checksums.get(checked, 0)
+        data = bytearray(INPUTS_HEADER.pack(
+                INPUTS, len(self.remote_inputs), checked, checksum,
+                start, len(inputs)))
+        for i in inputs:
+            data += INPUT.pack(i)
+
+        self.transport.send(bytes(data))
+
+    def close(self):
+        """Tells the other side we're leaving."""
+        for _ in range(3):
+            self.transport.send(bytes([BYE]))
+        self.transport.close()
+
+def connect(transport, hosting, start_level=0, seed=None, clear_delay=0,
+            idle=None, retry=0.1):
+    """
+    Sets up a match with the player at the other end of transport.
+    The host chooses the seed (random if None), start level and line
+    clear delay, and the joiner uses those.
+
+    idle() is called while waiting (e.g. to keep a window responsive).
+    If it returns False, this gives up and returns None. Otherwise it
+    returns a RollbackSession.
+    """
+    if hosting:
+        if seed is None:
+            seed = engine.Randomiser().seed
+        hello = HELLO_PACKET.pack(HELLO, seed, start_level, clear_delay)
+
+    last_sent = None
+    while True:
+        now = time.perf_counter()
+        packets = transport.receive()
+
+        if hosting:
+            if any(data[0] in (HELLO, INPUTS) for data in packets):
+                break # Joiner got the HELLO
+
+            if packets or (last_sent is not None and now - last_sent > retry):
+                transport.send(hello) # Answer JOIN, or try again
+                last_sent = now
+
+        else:
+            hellos = [data for data in packets if data[0] == HELLO]
+            if hellos:
+                _, seed, start_level, clear_delay = \
+                        HELLO_PACKET.unpack_from(hellos[0])
+                transport.send(hellos[0]) # Let the host know
+                break
+
+            if last_sent is None or now - last_sent > retry:
+                transport.send(bytes([JOIN]))
+                last_sent = now
+
+        if idle is not None and idle() is False:
+            return None
+
+        time.sleep(0.005)
+
+    games = [engine.Game(start_level, seed=seed) for _ in range(2)]
+    return RollbackSession(games, 0 if hosting else 1, transport, clear_delay)
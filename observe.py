@@ -0,0 +1,260 @@
+import os
+
+import numpy as np
+import pygame
+
+import constants as c
+import main
+from renderer import BoardRenderer
+from tetrimino import Tetrimino
+
+# Pixel observations of a game, for agents that learn from the screen.
+#
+# An Observer draws an engine.Game the way the game window does (same
+# background and grid, Mino tiles and Text), but onto a surface of its
+# own instead of the display, so no window is needed: SDL's dummy video
+# driver is enough. That surface is made over a NumPy array with
+# pygame.image.frombuffer, so drawing writes straight into the array.
+# Frames come out in the same preallocated array every time, with
+# nothing allocated per frame, and like the game loop, only what changed
+# since the last frame is redrawn.
+#
+# Modes:
+#
+#   "screen"  the whole window, c.height x c.width x 3
+#   "field"   just the playfield, with the rows above it where pieces
+#             spawn (c.field_rect)
+#   "cells"   one pixel per cell of the playfield, rows x cols x 3, in
+#             the piece colours. Made straight from the board with NumPy,
+#             so it doesn't touch pygame at all
+#
+# "screen" and "field" can be scaled down to a given size, either
+# nearest-neighbour (fast) or smoothed (several times slower, but thin lines
+# like the grid don't flicker in and out).
+#
+# Animations (line clears, game over) aren't drawn: a frame always shows
+# the game's state as it is.
+
+MODES = ("screen", "field", "cells")
+
+def init_display():
+    """
+    Sets up as much of SDL as drawing offscreen needs: a display mode
+    for surfaces to be converted to. If there's no display up already,
+    it uses the dummy video driver (unless SDL_VIDEODRIVER says
+    otherwise), so it works on machines without one.
+    """
+    if pygame.display.get_surface() is not None:
+        return # The game window, say
+
+    if not pygame.display.get_init():
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        pygame.display.init()
+
+    pygame.display.set_mode((1, 1), pygame.HIDDEN)
+
+def frame_buffer(out, shape):
+    """
+    Returns out, checked to be a uint8 array of the given shape that
+    surfaces can draw into, or a new one if out is None.
+    """
+    if out is None:
+        return np.zeros(shape, dtype=np.uint8)
+
+    if (out.shape != shape or out.dtype != np.uint8
+            or not out.flags.c_contiguous):
+        raise Exception(f"out must be a contiguous uint8 array of shape "
+                        f"{shape}")
+    return out
+
+def array_surface(array):
+    """Returns a surface that draws into an h x w x 3 uint8 array."""
+    h, w, _ = array.shape
+    return pygame.image.frombuffer(array, (w, h), "RGB")
+
+# ------ Class for rendering games offscreen ------ #
+class Observer:
+    """
+    Renders engine.Games into a uint8 array of shape (h, w, 3), RGB.
+    render(game) returns self.frame, which is overwritten by the next
+    call (copy it to keep it).
+
+    size (w, h) scales "screen" and "field" frames down, smoothly if
+    smooth is True. None keeps them at full size.
+
+    out is an array to use as self.frame (one's made if it's None).
+    "cells" frames are board.rows x board.cols, so out must be made for
+    the size of board that's going to be rendered.
+    """
+    def __init__(self, mode="screen", size=None, smooth=False, out=None):
+        if mode not in MODES:
+            raise Exception(f"mode must be one of {', '.join(MODES)}")
+
+        self.mode = mode
+        self.game = None # Game last rendered
+
+        if mode == "cells":
+            # Cells are -1 (empty) to 6, and -1 picks the last entry
+            self.palette = np.array([*c.colours, c.BLUE_GREY], dtype=np.uint8)
+            self.white = np.array(c.WHITE, dtype=np.uint8)
+            self.frame = out # Made for the first board rendered, if None
+            return
+
+        init_display()
+        main.load_fonts()
+
+        # What everything is drawn on, the size of the window
+        screen_rect = pygame.Rect(0, 0, c.width, c.height)
+        if mode == "screen":
+            region = screen_rect
+        else:
+            region = pygame.Rect(c.field_rect).clip(screen_rect)
+
+        if size is None:
+            size = region.size
+        shape = (size[1], size[0], 3)
+
+        if mode == "screen" and size == region.size:
+            # Drawn straight into the frame, with nothing to copy or scale
+            self.pixels = frame_buffer(out, shape)
+            self.frame = self.pixels
+            self.output = None
+        else:
+            self.pixels = np.zeros((c.height, c.width, 3), dtype=np.uint8)
+            self.frame = frame_buffer(out, shape)
+            self.output = array_surface(self.frame)
+
+        self.canvas = array_surface(self.pixels)
+        self.source = self.canvas.subsurface(region)
+        self.bg = main.make_bg((c.width, c.height))
+        self.scaled = size != region.size
+        self.smooth = smooth
+
+        self.board_view = BoardRenderer(self.bg)
+
+        # One of each piece, active and next, moved around as needed
+        self.pieces = [Tetrimino(type_ID, (0, 0))
+                       for type_ID in range(len(c.colours))]
+        self.next_pieces = [Tetrimino(type_ID, (12.5, 10))
+                            for type_ID in range(len(c.colours))]
+        self.piece = None # Tetriminos on the canvas now
+        self.next_piece = None
+
+        self.texts = [main.Text(text, main.info_font, c.WHITE, column, row)
+                      for text, column, row in (("LINES", "left", 0),
+                                                ("LEVEL", "left", 4),
+                                                ("SCORE", "right", 0),
+                                                ("NEXT", "right", 4))]
+        self.lines_text = main.Text("0", main.number_font, c.WHITE,
+                                    "left", 1)
+        self.level_text = main.Text("0", main.number_font, c.WHITE,
+                                    "left", 5)
+        self.points_text = main.Text("0", main.number_font, c.WHITE,
+                                     "right", 1)
+
+    def render(self, game):
+        """Draws the game as it is now. Returns self.frame."""
+        if self.mode == "cells":
+            return self.render_cells(game)
+
+        if game is not self.game:
+            self.reset(game)
+        self.draw(game)
+
+        if self.output is None:
+            pass # Drawn straight into the frame
+        elif not self.scaled:
+            self.output.blit(self.source, (0, 0))
+        elif self.smooth:
+            pygame.transform.smoothscale(
+                    self.source, self.output.get_size(), self.output)
+        else:
+            pygame.transform.scale(
+                    self.source, self.output.get_size(), self.output)
+
+        return self.frame
+
+    def reset(self, game):
+        """Draws everything again from scratch, for a new game."""
+        self.game = game
+        canvas = self.canvas
+        canvas.blit(self.bg, (0, 0))
+
+        self.board_view.cells = None # So the next sync draws every row
+        self.piece = None
+        self.next_piece = None
+
+        for text in self.texts:
+            text.display(canvas, self.bg)
+        for text in (self.lines_text, self.level_text, self.points_text):
+            text.display(canvas, self.bg)
+
+    def draw(self, game):
+        """Redraws whatever changed since the last frame."""
+        canvas = self.canvas
+        bg = self.bg
+        piece = game.piece
+
+        # The stack, and wherever the piece was
+        rects = self.board_view.sync(game.board)
+        if self.piece is not None:
+            rects += self.piece.drawn_rects()
+            self.piece.clear(canvas, bg) # In case it was above the field
+        self.board_view.draw(canvas, rects)
+
+        # The piece, flashing white for the three ticks after it locks. At
+        # game over it's left where it ended up, as the window does
+        tetrimino = self.pieces[piece.type_ID]
+        tetrimino.follow(piece)
+
+        if -3 < piece.lock_timer <= 0:
+            colour = c.WHITE
+        else:
+            colour = c.colours[piece.type_ID]
+        for spr in tetrimino:
+            if spr.colour != colour:
+                spr.colour = colour
+                spr.update()
+
+        tetrimino.draw(canvas)
+        self.piece = tetrimino
+
+        # The next piece, hidden once the game is over
+        if game.game_over:
+            next_piece = None
+        else:
+            next_piece = self.next_pieces[game.next_type]
+        if next_piece is not self.next_piece:
+            if self.next_piece is not None:
+                self.next_piece.clear(canvas, bg)
+            if next_piece is not None:
+                next_piece.draw(canvas)
+            self.next_piece = next_piece
+
+        # Text is only drawn again if it changed
+        self.lines_text.display(canvas, bg, new_text=str(game.lines))
+        self.level_text.display(canvas, bg, new_text=str(game.level))
+        self.points_text.display(canvas, bg, new_text=str(game.points))
+
+    def render_cells(self, game):
+        """Fills self.frame with one pixel per visible cell."""
+        board = game.board
+        shape = (board.rows, board.cols, 3)
+        if self.frame is None:
+            self.frame = np.zeros(shape, dtype=np.uint8)
+        elif self.frame.shape != shape:
+            self.frame = frame_buffer(self.frame, shape) # Raises
+
+        frame = self.frame
+        np.take(self.palette, board.cells[board.hidden:], axis=0, out=frame)
+
+        piece = game.piece
+        if -3 < piece.lock_timer <= 0:
+            colour = self.white
+        else:
+            colour = self.palette[piece.type_ID]
+        for x, y in piece.minos:
+            if 0 <= y < board.rows:
+                frame[y, x] = colour
+
+        return frame
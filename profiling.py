@@ -0,0 +1,188 @@
+import atexit
+import csv
+import json
+import sys
+from time import perf_counter_ns
+
+# Frame-time instrumentation for the game loop.
+#
+# The loop calls start_frame() at the top of each frame, lap(phase) after
+# each phase of it, and end_frame() once the frame's work is done (before
+# waiting for the next one). Each lap goes into a fixed-size histogram,
+# so a long session costs no more memory than a short one.
+#
+# Histogram buckets are log-linear: each power of two is split into
+# 2**SUB_BITS buckets, which keeps every bucket within about 6% of the
+# durations in it, from nanoseconds up to minutes.
+#
+# When profiling is off the loop gets a NullProfiler, whose methods do
+# nothing, so the only cost is a few empty method calls per frame.
+
+SUB_BITS = 4
+SUB_BUCKETS = 1 << SUB_BITS
+N_BUCKETS = 40 * SUB_BUCKETS # Up to 2**40 ns (18 min); longer goes in last
+
+FRAME_BUDGET_NS = 1_000_000_000 / 60 # 16.7 ms
+
+# ------ Latency histogram ------ #
+def bucket_index(ns):
+    """Returns the histogram bucket for a duration (in ns)."""
+    if ns < 2 * SUB_BUCKETS:
+        return ns
+
+    shift = ns.bit_length() - SUB_BITS - 1
+    return (shift + 1) * SUB_BUCKETS + (ns >> shift) - SUB_BUCKETS
+
+def bucket_limit(index):
+    """Returns the upper edge (exclusive, in ns) of a bucket."""
+    if index < 2 * SUB_BUCKETS:
+        return index + 1
+
+    shift = index // SUB_BUCKETS - 1
+    return (index % SUB_BUCKETS + SUB_BUCKETS + 1) << shift
+
+class Histogram:
+    """Counts of durations in log-linear buckets, plus exact max."""
+    def __init__(self):
+        self.counts = [0] * N_BUCKETS
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def add(self, ns):
+        self.counts[min(bucket_index(ns), N_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def percentile(self, p):
+        """
+        Returns the duration (ns) that p percent of samples are at or
+        below, to the resolution of the buckets.
+        """
+        if not self.count:
+            return 0
+
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                # Upper edge of the bucket, but never more than the max
+                return min(bucket_limit(i), self.max_ns)
+
+        return self.max_ns
+
+    def buckets(self):
+        """Returns [upper edge in ms, count] for each non-empty bucket."""
+        return [[round(bucket_limit(i) * 1e-6, 6), n]
+                for i, n in enumerate(self.counts) if n]
+
+    def summary(self):
+        """Returns count, mean, p50, p99 and max (in ms) as a dict."""
+        ms = 1e-6
+        return {"count": self.count,
+                "mean_ms": round(self.total_ns / max(self.count, 1) * ms, 3),
+                "p50_ms": round(self.percentile(50) * ms, 3),
+                "p99_ms": round(self.percentile(99) * ms, 3),
+                "max_ms": round(self.max_ns * ms, 3)}
+
+# ------ Profilers ------ #
+class FrameProfiler:
+    """
+    Times the phases of each frame of the game loop, and counts the
+    frames whose work took longer than FRAME_BUDGET_NS.
+    Results are written to path (.json or .csv) by dump().
+    """
+    def __init__(self, path):
+        self.path = path
+
+        self.phases = {} # Phase name -> Histogram, in order of first lap
+        self.frames = Histogram() # Time from start_frame() to end_frame()
+        self.over_budget = 0
+
+        self.frame_start = self.last = perf_counter_ns()
+
+    def start_frame(self):
+        self.frame_start = self.last = perf_counter_ns()
+
+    def lap(self, phase):
+        """Records the time since the last lap (or frame start) as phase."""
+        now = perf_counter_ns()
+
+        histogram = self.phases.get(phase)
+        if histogram is None:
+            histogram = self.phases[phase] = Histogram()
+        histogram.add(now - self.last)
+
+        self.last = now
+
+    def end_frame(self):
+        """Records the frame's total time. Anything timed after is idle."""
+        now = perf_counter_ns()
+
+        frame_ns = now - self.frame_start
+        self.frames.add(frame_ns)
+        if frame_ns > FRAME_BUDGET_NS:
+            self.over_budget += 1
+
+        self.last = now
+
+    def results(self):
+        return {"frames": self.frames.count,
+                "over_budget": self.over_budget,
+                "budget_ms": round(FRAME_BUDGET_NS * 1e-6, 3),
+                "phases": {name: {**histogram.summary(),
+                                  "histogram": histogram.buckets()}
+                           for name, histogram in self.all_phases()}}
+
+    def all_phases(self):
+        return [*self.phases.items(), ("frame", self.frames)]
+
+    def dump(self):
+        """Writes the results to self.path, as CSV if it ends in .csv."""
+        if not self.frames.count:
+            return # Never got to play
+
+        if self.path.endswith(".csv"):
+            with open(self.path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["phase", "count", "mean_ms", "p50_ms",
+                                 "p99_ms", "max_ms", "over_budget"])
+                for name, histogram in self.all_phases():
+                    writer.writerow([name, *histogram.summary().values(),
+                                     self.over_budget if name == "frame"
+                                     else ""])
+        else:
+            with open(self.path, "w") as f:
+                json.dump(self.results(), f, indent=2)
+
+        frame = self.frames.summary()
+        sys.stderr.write(
+                f"{self.frames.count} frames, {self.over_budget} over "
+                f"budget (p50 {frame['p50_ms']} ms, p99 {frame['p99_ms']} "
+                f"ms, max {frame['max_ms']} ms). Saved to {self.path}\n")
+
+class NullProfiler:
+    """Stands in for FrameProfiler when profiling is off."""
+    def start_frame(self):
+        pass
+
+    def lap(self, phase):
+        pass
+
+    def end_frame(self):
+        pass
+
+def create(path):
+    """
+    Returns a FrameProfiler that saves to path when the program exits,
+    or a NullProfiler if path is None.
+    """
+    if path is None:
+        return NullProfiler()
+
+    profiler = FrameProfiler(path)
+    atexit.register(profiler.dump)
+    return profiler
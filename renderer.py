@@ -0,0 +1,126 @@
+import pygame
+
+import constants as c
+from tetrimino import Mino
+
+# ------ Class for drawing the locked minos ------ #
+class BoardRenderer:
+    """
+    Keeps the locked minos of an engine.Board drawn on a single surface
+    the size of c.field_rect (grid included), so putting the stack on the
+    screen is one blit instead of a blit per mino.
+
+    sync() compares the board with what was last drawn and only redraws
+    the rows that changed.
+    """
+    def __init__(self, bg):
+        self.rect = pygame.Rect(c.field_rect)
+
+        # Field background (grid) to draw empty cells with
+        self.bg = pygame.Surface(self.rect.size)
+        self.bg.blit(bg, (0, 0), self.rect)
+
+        self.surface = self.bg.copy()
+        self.cells = None # Copy of board.cells as last drawn
+
+    def row_rect(self, y):
+        """Returns the screen rect for playfield row y."""
+        pixel_y = Mino.grid_to_pixel(0, y)[1]
+        h = Mino.get_size(0, y)[1]
+        return pygame.Rect(self.rect.x, pixel_y, self.rect.w, h)
+
+    def draw_row(self, board, y):
+        """Redraws one playfield row onto self.surface."""
+        row_rect = self.row_rect(y).move(-self.rect.x, -self.rect.y)
+        self.surface.blit(self.bg, row_rect, row_rect)
+
+        row = board.cells[y + board.hidden]
+        for x in (row >= 0).nonzero()[0].tolist():
+            colour = c.colours[row[x]]
+            pixel_x, pixel_y = Mino.grid_to_pixel(x, y)
+            tile = Mino.get_tile(colour, *Mino.get_size(x, y))
+            self.surface.blit(
+                    tile, (pixel_x - self.rect.x, pixel_y - self.rect.y))
+
+    def sync(self, board):
+        """
+        Redraws the rows of self.surface that changed since the last sync.
+        Returns the screen rects of those rows.
+        """
+        if self.cells is None or self.cells.shape != board.cells.shape:
+            changed = range(len(board.cells))
+        else:
+            changed = (board.cells != self.cells).any(axis=1).nonzero()[0]
+
+        dirty_rects = []
+        top = self.rect.y
+        for i in changed:
+            y = int(i) - board.hidden
+            if Mino.grid_to_pixel(0, y + 1)[1] <= top:
+                continue # Row is above the visible part of the field
+
+            self.draw_row(board, y)
+            dirty_rects.append(self.row_rect(y).clip(self.rect))
+
+        self.cells = board.cells.copy()
+        return dirty_rects
+
+    def draw(self, dest_surf, rects=None):
+        """
+        Blits the board to a surface, either all of it or just the given
+        screen rects. Returns dirty rects.
+        """
+        if rects is None:
+            return [dest_surf.blit(self.surface, self.rect)]
+
+        dirty_rects = []
+        for rect in rects:
+            rect = self.rect.clip(rect)
+            dirty_rects.append(dest_surf.blit(
+                    self.surface, rect, rect.move(-self.rect.x, -self.rect.y)))
+
+        return dirty_rects
+
+# ------ Class for drawing the opponent's field ------ #
+class MiniFieldRenderer:
+    """
+    Draws a whole engine.Game (locked minos and the falling piece) at a
+    small size, as plain squares, for showing the opponent's field in
+    versus. draw() only redraws when something has changed.
+    """
+    def __init__(self, pos, cell_size, cols=c.COLS, rows=c.ROWS):
+        self.cell_size = cell_size
+        self.rect = pygame.Rect(pos, (cols * cell_size, rows * cell_size))
+        self.surface = pygame.Surface(self.rect.size)
+        self.drawn = None # State of the game as last drawn
+
+    def draw(self, dest_surf, game):
+        """Draws the game (if it has changed). Returns dirty rects."""
+        board = game.board
+        piece = game.piece
+
+        state = (board.cells.tobytes(), piece.type_ID, piece.x, piece.y,
+                 piece.rot_index, game.game_over)
+        if state == self.drawn:
+            return []
+        self.drawn = state
+
+        size = self.cell_size
+        self.surface.fill(c.BLUE_GREY)
+
+        minos = []
+        cells = board.cells[board.hidden:]
+        ys, xs = (cells >= 0).nonzero()
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            minos.append((x, y, c.colours[cells[y, x]]))
+
+        if not game.game_over:
+            colour = c.colours[piece.type_ID]
+            minos += [(x, y, colour) for x, y in piece.minos if y >= 0]
+
+        for x, y, colour in minos:
+            if game.game_over:
+                colour = c.GREY
+            self.surface.fill(colour, (x * size, y * size, size - 1, size - 1))
+
+        return [dest_surf.blit(self.surface, self.rect)]
@@ -0,0 +1,236 @@
+import struct
+import sys
+
+import engine
+import rules
+
+# Replay file layout (all little-endian):
+#
+#   magic    4 bytes   b"TXR" + format version
+#   seed     uint32
+#   level    uint8     start level
+#   cols     uint16
+#   rows     uint16
+#   runs     uint32    number of input runs that follow
+#
+# followed by one entry per run of identical frames:
+#
+#   inputs   uint16    held bits | pressed bits << 5
+#   count    varint    number of frames (7 bits per byte, low bits first)
+#
+# and then the checksums (not in version 1 files):
+#
+#   interval uint16    frames between checksums
+#   count    uint32
+#   checksum uint64    Game.checksum() after every interval-th frame
+#
+# Playing a replay back and comparing checksums shows whether it still
+# plays out the same (e.g. after a change to the engine), and if not,
+# which stretch of frames it went wrong in.
+
+MAGIC = b"TXR\x02"
+OLD_MAGIC = b"TXR\x01" # Same, but without checksums
+HEADER = struct.Struct("<4sIBHHI")
+INPUTS = struct.Struct("<H")
+CHECKSUMS = struct.Struct("<HI")
+CHECKSUM = struct.Struct("<Q")
+
+PRESSED_SHIFT = 5 # Pressed bits are stored above the five held bits
+CHECKSUM_INTERVAL = 60 # Frames. 8 bytes a second of play
+
+# ------ Class for recording and storing replays ------ #
+class Replay:
+    """
+    The seed, start level and per-frame inputs of one game. That's all
+    that's needed to play the game again, since the engine is
+    deterministic. Inputs are run-length encoded as they're recorded, so
+    recording a frame is just a comparison and an addition.
+
+    Call checkpoint(game) after each step of the game being recorded to
+    keep a checksum of its state every checksum_interval frames.
+    """
+    def __init__(self, seed, start_level=0, cols=rules.COLS, rows=rules.ROWS,
+                 checksum_interval=CHECKSUM_INTERVAL):
+        self.seed = seed
+        self.start_level = start_level
+        self.cols = cols
+        self.rows = rows
+
+        self.runs = [] # [inputs, number of frames] pairs
+        self.length = 0 # Number of frames
+
+        self.checksum_interval = checksum_interval
+        self.checksums = [] # After frames interval, 2 * interval, ...
+
+    @classmethod
+    def for_game(cls, game):
+        """Returns an empty replay for recording an engine.Game."""
+        return cls(game.seed, game.start_level,
+                   game.board.cols, game.board.rows)
+
+    def record(self, pressed, held):
+        """Adds one frame of inputs (as given to Game.step)."""
+        inputs = held | pressed << PRESSED_SHIFT
+
+        if self.runs and self.runs[-1][0] == inputs:
+            self.runs[-1][1] += 1
+        else:
+            self.runs.append([inputs, 1])
+        self.length += 1
+
+    def checkpoint(self, game):
+        """
+        Call with the game after stepping it with the frame just
+        recorded. Every checksum_interval frames, stores its checksum.
+        """
+        if self.length % self.checksum_interval == 0:
+            self.checksums.append(game.checksum())
+
+    def truncate(self, frames):
+        """Forgets every frame after the first `frames` (after a rewind)."""
+        excess = len(self) - frames
+        while excess > 0:
+            run = self.runs[-1]
+            if run[1] > excess:
+                run[1] -= excess
+                break
+
+            self.runs.pop()
+            excess -= run[1]
+
+        self.length = min(self.length, frames)
+        del self.checksums[self.length // self.checksum_interval:]
+
+    def __len__(self):
+        """Number of frames recorded."""
+        return self.length
+
+    def frames(self):
+        """Yields (pressed, held) for every recorded frame."""
+        mask = (1 << PRESSED_SHIFT) - 1
+        for inputs, count in self.runs:
+            frame = (inputs >> PRESSED_SHIFT, inputs & mask)
+            for _ in range(count):
+                yield frame
+
+    def new_game(self):
+        """Returns a fresh engine.Game set up like the recorded one."""
+        return engine.Game(self.start_level, self.cols, self.rows, self.seed)
+
+    # --- Binary format --- #
+
+    def encode(self):
+        """Returns the replay as bytes."""
+        data = bytearray(HEADER.pack(MAGIC, self.seed, self.start_level,
+                                     self.cols, self.rows, len(self.runs)))
+
+        for inputs, count in self.runs:
+            data += INPUTS.pack(inputs)
+            while count >= 0x80:
+                data.append(count & 0x7F | 0x80)
+                count >>= 7
+            data.append(count)
+
+        data += CHECKSUMS.pack(self.checksum_interval, len(self.checksums))
+        for checksum in self.checksums:
+            data += CHECKSUM.pack(checksum)
+
+        return bytes(data)
+
+    @classmethod
+    def decode(cls, data):
+        """Reads a replay from bytes made by encode()."""
+        magic, seed, start_level, cols, rows, n_runs = HEADER.unpack_from(data)
+        if magic not in (MAGIC, OLD_MAGIC):
+            raise Exception("data is not a Tetrix replay (or is a newer version)")
+
+        replay = cls(seed, start_level, cols, rows)
+
+        pos = HEADER.size
+        for _ in range(n_runs):
+            inputs, = INPUTS.unpack_from(data, pos)
+            pos += INPUTS.size
+
+            count = 0
+            shift = 0
+            while True:
+                byte = data[pos]
+                pos += 1
+                count |= (byte & 0x7F) << shift
+                shift += 7
+                if byte < 0x80:
+                    break
+
+            replay.runs.append([inputs, count])
+            replay.length += count
+
+        if magic == MAGIC:
+            replay.checksum_interval, n_checksums = \
+                    CHECKSUMS.unpack_from(data, pos)
+            pos += CHECKSUMS.size
+            for _ in range(n_checksums):
+                checksum, = CHECKSUM.unpack_from(data, pos)
+                pos += CHECKSUM.size
+                replay.checksums.append(checksum)
+
+        return replay
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.encode())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.decode(f.read())
+
+def play(replay):
+    """
+    Plays a replay headlessly, as fast as possible.
+    Returns the engine.Game as it was after the last recorded frame.
+    """
+    game = replay.new_game()
+    step = game.step
+
+    mask = (1 << PRESSED_SHIFT) - 1
+    for inputs, count in replay.runs:
+        pressed = inputs >> PRESSED_SHIFT
+        held = inputs & mask
+        for _ in range(count):
+            step(pressed, held)
+
+    return game
+
+def verify(replay):
+    """
+    Plays a replay headlessly, comparing the game's checksums with the
+    recorded ones. Returns the engine.Game, and the frame after which
+    the first wrong checksum was found (None if they were all right).
+    The game went wrong within the checksum_interval frames before it.
+    """
+    game = replay.new_game()
+    step = game.step
+    interval = replay.checksum_interval
+    checksums = iter(replay.checksums)
+
+    frame = 0
+    for pressed, held in replay.frames():
+        step(pressed, held)
+        frame += 1
+        if frame % interval == 0:
+            expected = next(checksums, None)
+            if expected is not None and game.checksum() != expected:
+                return game, frame
+
+    return game, None
+
+if __name__ == "__main__":
+    # Usage: python replay.py REPLAY_FILE...
+    for path in sys.argv[1:]:
+        replay = Replay.load(path)
+        game, diverged = verify(replay)
+        print(f"{path}: seed {replay.seed}, {len(replay)} frames, "
+              f"score {game.points}, lines {game.lines}, level {game.level}")
+        if diverged is not None:
+            print(f"  ! plays out differently: wrong checksum after frame "
+                  f"{diverged}")
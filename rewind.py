@@ -0,0 +1,130 @@
+from collections import deque
+from math import ceil
+
+from numpy import uint16, zeros
+
+import engine
+from replay import PRESSED_SHIFT
+from state import Snapshot
+
+# History for rewinding a game, as used by practice mode.
+#
+# Since the engine is deterministic, the smallest possible delta from
+# one frame to the next is the frame's inputs: two bytes, whatever the
+# piece did. So the history is a ring buffer of per-frame inputs, plus
+# a keyframe (a state.Snapshot) every KEYFRAME_INTERVAL frames. Going
+# back to a frame restores the keyframe before it and plays the inputs
+# from there, which is at most KEYFRAME_INTERVAL - 1 steps (well under a
+# millisecond).
+#
+# Both rings have a fixed size, so memory doesn't grow however long the
+# game goes on. A minute of history takes about 60 kB.
+
+KEYFRAME_INTERVAL = 60 # Frames
+
+# ------ Class for rewinding games ------ #
+class Rewinder:
+    """
+    Steps an engine.Game, keeping enough history to take it back to any
+    frame in the last `seconds` of play.
+
+    Use step() instead of game.step(), then back(), back_ms() or
+    back_pieces() to rewind. Frames after the one gone back to are
+    forgotten, and play carries on from there.
+    """
+    def __init__(self, game, seconds=60, rate=60,
+                 keyframe_interval=KEYFRAME_INTERVAL):
+        self.game = game
+        self.rate = rate # Frames per second, for back_ms()
+        self.interval = keyframe_interval
+
+        # Room for at least `seconds` of inputs, in whole intervals. One
+        # extra keyframe, since the newest is always partway through one
+        n_keyframes = ceil(seconds * rate / keyframe_interval) + 1
+        self.capacity = n_keyframes * keyframe_interval
+        self.inputs = zeros(self.capacity, dtype=uint16)
+        self.keyframes = [None] * n_keyframes
+
+        self.frame = 0 # Frames stepped so far
+        self.oldest = 0 # Oldest frame that can still be gone back to
+        self.spawns = deque([0]) # Frames where a piece came into play
+
+    def step(self, pressed=0, held=0):
+        """Records the inputs and steps the game. Returns its events."""
+        frame = self.frame
+        interval = self.interval
+
+        if frame % interval == 0:
+            n_keyframes = len(self.keyframes)
+            self.keyframes[frame // interval % n_keyframes] = \
+                    Snapshot.take(self.game)
+
+            # That overwrote the oldest keyframe, so the history before
+            # the next one is gone (it never comes back after a rewind)
+            self.oldest = max(self.oldest,
+                              frame - (n_keyframes - 1) * interval)
+            while self.spawns and self.spawns[0] < self.oldest:
+                self.spawns.popleft()
+
+        self.inputs[frame % self.capacity] = held | pressed << PRESSED_SHIFT
+        self.frame += 1
+
+        events = self.game.step(pressed, held)
+        if events & engine.SPAWN:
+            self.spawns.append(self.frame)
+
+        return events
+
+    def seek(self, frame):
+        """Takes the game back to how it was after the given frame."""
+        if not self.oldest <= frame <= self.frame:
+            raise Exception(f"can't rewind to frame {frame}: only frames "
+                            f"{self.oldest} to {self.frame} are kept")
+
+        # Already there. (And if it's a keyframe boundary, that keyframe
+        # isn't taken until the next step)
+        if frame == self.frame:
+            return
+
+        keyframe = frame - frame % self.interval
+        self.keyframes[keyframe // self.interval
+                       % len(self.keyframes)].restore(self.game)
+
+        mask = (1 << PRESSED_SHIFT) - 1
+        step = self.game.step
+        for i in range(keyframe, frame):
+            inputs = int(self.inputs[i % self.capacity])
+            step(inputs >> PRESSED_SHIFT, inputs & mask)
+
+        self.frame = frame
+        while self.spawns and self.spawns[-1] > frame:
+            self.spawns.pop()
+
+    def back(self, frames):
+        """
+        Rewinds the game by a number of frames, or as far as it can go.
+        Returns the frame it went back to.
+        """
+        self.seek(max(self.oldest, self.frame - frames))
+        return self.frame
+
+    def back_ms(self, ms):
+        """Rewinds the game by a number of milliseconds of play."""
+        return self.back(round(ms * self.rate / 1000))
+
+    def back_pieces(self, n=1, grace=0):
+        """
+        Rewinds the game to when the nth most recent piece came into
+        play, so n=1 restarts the current piece. If the current piece has
+        been in play for no more than `grace` frames, it doesn't count.
+        Returns the frame it went back to.
+        """
+        spawns = self.spawns
+        if spawns and self.frame - spawns[-1] <= grace:
+            n += 1
+
+        if n > len(spawns):
+            return self.back(self.frame) # As far as it goes
+
+        self.seek(spawns[-n])
+        return self.frame
@@ -0,0 +1,69 @@
+from numpy import array, linspace
+
+# Game rules and playfield dimensions.
+# Nothing in here depends on pygame, so the engine can import it headlessly.
+
+COLS = 10
+ROWS = 20
+
+# ------ Level progression and scoring ------ #
+
+# Falling speeds for different levels. Index represents level.
+frames_per_cell = [52, 48, 44, 40, 36, 32, 27, 21, 16, 10,
+                   9, 8, 7, 6, 5, 5, 4, 4, 3, 3,
+                   2, 2, 2, 2, 2, 2, 2, 2, 2, 2,
+                   1]
+
+max_level = 30
+
+# List of lock delays for different levels. Index represents level.
+lock_delay = [int(t) for t in linspace(31, 15, 31)]
+
+clear_points = [0, 40, 100, 300, 1200]
+    # 1 line: 40 points, 2 lines: 300 points etc.
+
+# ------ Spawning, shifting and SRS stuff ------ #
+
+spawn_pos = (4, -1)
+
+max_spawn_freeze = 31 # Max freeze frames after piece has spawned.
+                      # Freeze frames are cancelled by any keypress
+
+# Define the seven tetriminos. (0, 0) is anchor point for (true) rotation
+tetriminos = (
+        ((-1, 0), (0, -1), (0, 0), (1, 0)), # 	ID 0: T
+        ((-1, -1), (-1, 0), (0, 0), (1, 0)), # 	ID 1: J
+        ((-1, -1), (0, -1), (0, 0), (1, 0)), # 	ID 2: Z
+        ((-1, 0), (0, 0), (0, -1), (1, -1)), # 	ID 3: S
+        ((-1, 0), (0, 0), (1, 0), (1, -1)), # 	ID 4: L
+        ((0, -1), (1, -1), (0, 0), (1, 0)), # 	ID 5: O
+        ((-1, 0), (0, 0), (1, 0), (2, 0)) # 	ID 6: I
+        )
+
+DAS = 8 # Delayed Auto-Shift (frames)
+ARR = 3 # Auto Repeat Rate (in frames/cell)
+
+# --- SRS offset data --- #
+
+# https://harddrop.com/wiki/SRS
+
+offsets_TJZSL = array((
+        (( 0, 0), ( 0, 0), ( 0, 0), ( 0, 0), ( 0, 0)), # 	Rot 0 (spawn)
+        (( 0, 0), (+1, 0), (+1,+1), ( 0,-2), (+1,-2)), # 	Rot R
+        (( 0, 0), ( 0, 0), ( 0, 0), ( 0, 0), ( 0, 0)), # 	Rot 2
+        (( 0, 0), (-1, 0), (-1,+1), ( 0,-2), (-1,-2)) # 	Rot L
+))
+
+offsets_I = array((
+        (( 0, 0), (-1, 0), (+2, 0), (-1, 0), (+2, 0)), # 	Rot 0 (spawn)
+        ((-1, 0), ( 0, 0), ( 0, 0), ( 0,-1), ( 0,+2)), # 	Rot R
+        ((-1,-1), (+1,-1), (-2,-1), (+1, 0), (-2, 0)), # 	Rot 2
+        (( 0,-1), ( 0,-1), ( 0,-1), ( 0,+1), ( 0,-2)) #		Rot L
+))
+
+offsets_O = array((
+        (( 0, 0),), # 	Rot 0 (spawn)
+        (( 0,+1),), # 	Rot R
+        ((-1,+1),), # 	Rot 2
+        ((-1, 0),) #	Rot L
+))
@@ -0,0 +1,186 @@
+from engine import KICKS, LEFT, RIGHT, DOWN, CW, CCW
+
+# Move generator for bots: finds every place a piece can end up, including
+# tucks and spins that are only reachable through SRS kicks.
+#
+# The search works on the board's bitboard (see engine.Board). A piece
+# position is the shift of its mask in the bitboard, and a set of
+# positions is an int with a bit set for each, one int per rotation.
+# That way the whole frontier of the search moves left, right or down
+# with a single shift, and a wall kick test is a shift and an AND.
+
+def free_positions(board, type_ID):
+    """
+    Returns, for each rotation state, the set of positions where a piece
+    of the given type doesn't collide with anything.
+    """
+    bits = board.bits
+    in_bounds = (1 << board.index(0, board.rows)) - 1
+
+    free = []
+    for mask in board.shape_masks[type_ID]:
+        # A position is blocked if any of the piece's minos hits something
+        blocked = 0
+        while mask:
+            low = mask & -mask
+            blocked |= bits >> (low.bit_length() - 1)
+            mask ^= low
+
+        free.append(in_bounds & ~blocked)
+
+    return free
+
+def placements(board, piece):
+    """
+    Finds every distinct final placement of a piece, by breadth-first
+    search over (x, y, rotation) using shifts, rotations (with wall kicks)
+    and soft drop one row at a time.
+
+    Returns a list of (x, y, rot, moves), one for each distinct set of
+    cells the piece can lock in. moves is the shortest list of engine
+    input bits (LEFT, RIGHT, CW, CCW, DOWN) that gets the piece there from
+    where it is now. Gravity and lock delay aren't taken into account, so
+    on fast levels a bot may not have time for every path.
+    """
+    stride = board.stride
+    masks = board.shape_masks[piece.type_ID]
+    kicks = KICKS[piece.type_ID]
+    free = free_positions(board, piece.type_ID)
+
+    # rotations[rot] = ((move, to_rot, kick offsets), ...)
+    rotations = []
+    for rot in range(4):
+        rotations.append(tuple(
+                (move, to_rot,
+                 tuple(kick_y * stride + kick_x
+                       for kick_x, kick_y in kicks[rot][to_rot]))
+                for move, to_rot in ((CW, (rot + 1) % 4),
+                                     (CCW, (rot - 1) % 4))))
+
+    start = piece.y * stride + piece.x + board.origin
+    if start < 0 or not free[piece.rot_index] >> start & 1:
+        return [] # Piece is already colliding
+
+    # --- Breadth-first search, one layer of positions per move --- #
+
+    frontier = [0, 0, 0, 0]
+    frontier[piece.rot_index] = 1 << start
+    visited = list(frontier)
+    layers = [tuple(frontier)] # layers[d][rot]: positions d moves away
+
+    while any(frontier):
+        new = [0, 0, 0, 0]
+
+        for rot in range(4):
+            positions = frontier[rot]
+            if not positions:
+                continue
+
+            # Left, right and down
+            new[rot] |= free[rot] & ((positions >> 1) |
+                                     (positions << 1) |
+                                     (positions << stride))
+
+            # Rotations. Each position takes the first kick that fits
+            for move, to_rot, kick_offsets in rotations[rot]:
+                untried = positions
+                to_free = free[to_rot]
+                for offset in kick_offsets:
+                    if offset >= 0:
+                        moved = (untried << offset) & to_free
+                        untried ^= moved >> offset
+                    else:
+                        moved = (untried >> -offset) & to_free
+                        untried ^= moved << -offset
+
+                    new[to_rot] |= moved
+                    if not untried:
+                        break
+
+        for rot in range(4):
+            new[rot] &= ~visited[rot]
+            visited[rot] |= new[rot]
+
+        frontier = new
+        layers.append(tuple(new))
+
+    # --- Landed positions, closest first --- #
+
+    landed = [visited[rot] & ~(free[rot] >> stride) for rot in range(4)]
+
+    found = {} # Cells covered -> (position, rot, number of moves)
+    for distance, layer in enumerate(layers):
+        for rot in range(4):
+            positions = layer[rot] & landed[rot]
+            while positions:
+                low = positions & -positions
+                position = low.bit_length() - 1
+                positions ^= low
+
+                cells = masks[rot] << position
+                if cells not in found:
+                    found[cells] = (position, rot, distance)
+
+    # --- Walk back through the layers to find the moves --- #
+
+    # rotations_into[rot] = ((move, from_rot, kick offsets), ...)
+    rotations_into = [[], [], [], []]
+    for rot in range(4):
+        for move, to_rot, kick_offsets in rotations[rot]:
+            rotations_into[to_rot].append((move, rot, kick_offsets))
+
+    results = []
+    for position, rot, distance in found.values():
+        y, x = divmod(position - board.origin, stride)
+        results.append((x, y, rot, backtrack(
+                layers, free, rotations_into, stride,
+                position, rot, distance)))
+
+    return results
+
+def backtrack(layers, free, rotations_into, stride, position, rot, distance):
+    """
+    Returns the moves of a shortest path to a position, by stepping back
+    to any position in the previous layer that it can be reached from.
+    """
+    moves = [0] * distance
+
+    for d in range(distance - 1, -1, -1):
+        prev = layers[d]
+
+        if position >= stride and prev[rot] >> (position - stride) & 1:
+            position -= stride
+            moves[d] = DOWN
+            continue
+
+        if prev[rot] >> (position + 1) & 1:
+            position += 1
+            moves[d] = LEFT
+            continue
+
+        if position >= 1 and prev[rot] >> (position - 1) & 1:
+            position -= 1
+            moves[d] = RIGHT
+            continue
+
+        for move, from_rot, kick_offsets in rotations_into[rot]:
+            for i, offset in enumerate(kick_offsets):
+                source = position - offset
+                if source < 0 or not prev[from_rot] >> source & 1:
+                    continue
+
+                # Only counts if no earlier kick test would have fit
+                if any(free[rot] >> (source + earlier) & 1
+                       for earlier in kick_offsets[:i]
+                       if source + earlier >= 0):
+                    continue
+
+                position = source
+                rot = from_rot
+                moves[d] = move
+                break
+            else:
+                continue
+            break
+
+    return moves
@@ -0,0 +1,491 @@
+import argparse
+import asyncio
+import random
+import socket
+import struct
+import sys
+import time
+
+import engine
+import profiling
+import rules
+from replay import PRESSED_SHIFT
+from state import Snapshot
+
+# Server that runs games for remote players, many to a process.
+#
+# The server owns the games: clients only send their inputs, and get the
+# state of their game back. Every game is stepped by one shared
+# scheduler, SIM_RATE ticks a second, rather than each having a loop of
+# its own. A tick steps every game once with the inputs that arrived
+# since the last one, and then sends each client everything that tick
+# produced for it in one write, so there's one send per client per tick
+# however many messages it was.
+#
+# The time each tick takes, and the CPU time it used, go into histograms
+# that are reported every REPORT_INTERVAL seconds. The budget for a tick
+# is 1 / SIM_RATE seconds; ticks past it make the game run slow for
+# everyone.
+#
+# Messages (TCP, all little-endian). The first byte is the message type:
+#
+#   START    type, start level uint8, seed uint32 (0: any)
+#                                      client -> server, starts a new game
+#   INPUT    type, inputs uint16 (held bits | pressed bits << 5)
+#                                      client -> server, when keys change
+#   STATE    type, frame uint32, events uint16, piece type uint8,
+#            x int16, y int16, rotation uint8, next type uint8,
+#            points uint32, lines uint16, level uint8
+#                                      server -> client, after a tick
+#                                      with any events
+#   BOARD    type, frame uint32, events uint16, length uint16,
+#            then a state.Snapshot of the game
+#                                      server -> client, when a game
+#                                      starts and whenever a piece spawns
+#
+# Presses that arrive between two ticks all count in the next one, and
+# the keys held are whatever the latest INPUT said. Nothing is sent for a
+# tick where nothing happened, and the board is only sent when it
+# changes (pieces only change it when they lock, which ends in a spawn).
+
+START = 1
+INPUT = 2
+STATE = 3
+BOARD = 4
+
+START_MESSAGE = struct.Struct("<BBI")
+INPUT_MESSAGE = struct.Struct("<BH")
+STATE_MESSAGE = struct.Struct("<BIHBhhBBIHB")
+BOARD_HEADER = struct.Struct("<BIHH")
+
+SIM_RATE = 60 # Ticks per second
+MAX_TICKS_PER_WAKE = 4 # If ticks fall further behind, the games slow
+MAX_BUFFERED = 64 * 1024 # Bytes a client can fall behind before it's cut
+REPORT_INTERVAL = 5 # Seconds
+
+INPUT_MASK = (1 << PRESSED_SHIFT) - 1
+
+# ------ Server side ------ #
+class Connection(asyncio.Protocol):
+    """One client's connection to the server, and the game it's playing."""
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.received = bytearray()
+        self.out = bytearray() # Messages to send at the end of the tick
+
+        self.game = None
+        self.frame = 0 # Frames the game has been stepped
+        self.pressed = 0 # Since the last tick
+        self.held = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        sock = transport.get_extra_info("socket")
+        if sock is not None:
+            # Messages are small and sent once a tick; don't hold them back
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.connections[self] = None
+
+    def connection_lost(self, exc):
+        self.server.connections.pop(self, None)
+
+    def data_received(self, data):
+        received = self.received
+        received += data
+
+        pos = 0
+        while pos < len(received):
+            kind = received[pos]
+            if kind == INPUT:
+                size = INPUT_MESSAGE.size
+            elif kind == START:
+                size = START_MESSAGE.size
+            else:
+                self.transport.abort() # Not talking our protocol
+                return
+
+            if len(received) - pos < size:
+                break # Rest of it hasn't arrived yet
+
+            if kind == INPUT:
+                _, inputs = INPUT_MESSAGE.unpack_from(received, pos)
+                self.pressed |= inputs >> PRESSED_SHIFT
+                self.held = inputs & INPUT_MASK
+            else:
+                _, start_level, seed = \
+                        START_MESSAGE.unpack_from(received, pos)
+                if start_level >= len(rules.frames_per_cell):
+                    self.transport.abort()
+                    return
+                self.start(start_level, seed or None)
+
+            pos += size
+
+        del received[:pos]
+
+    def start(self, start_level, seed=None):
+        """Starts a new game (whatever happened to the last one)."""
+        self.game = engine.Game(start_level, seed=seed)
+        self.frame = 0
+        self.pressed = 0
+        self.send_board(0)
+
+    def send_board(self, events):
+        data = Snapshot.take(self.game).encode()
+        self.out += BOARD_HEADER.pack(BOARD, self.frame, events, len(data))
+        self.out += data
+
+class GameServer:
+    """
+    Runs the games of every client connected to it. Call listen() to
+    start taking connections, then run() to start the ticks.
+
+    report(line) is called with a summary of the ticks every
+    REPORT_INTERVAL seconds (None: don't report).
+    """
+    def __init__(self, rate=SIM_RATE, report=None):
+        self.rate = rate
+        self.report = report
+        self.connections = {} # Connection -> None, in the order they came
+        self.listener = None
+
+        # Stats, since the last report
+        self.tick_times = profiling.Histogram() # Wall time, ns per tick
+        self.tick_cpu = profiling.Histogram() # CPU time, ns per tick
+        self.over_budget = 0
+        self.skipped = 0 # Ticks dropped for being too far behind
+        self.bytes_sent = 0
+
+        self.ticks = 0 # All time
+
+    async def listen(self, host="", port=0):
+        """Starts taking connections. Returns the (host, port) bound."""
+        loop = asyncio.get_running_loop()
+        self.listener = await loop.create_server(
+                lambda: Connection(self), host or None, port)
+        return self.listener.sockets[0].getsockname()[:2]
+
+    def tick(self):
+        """Steps every game by a frame and sends out what happened."""
+        for connection in list(self.connections):
+            game = connection.game
+            out = connection.out
+
+            if game is not None and not game.game_over:
+                events = game.step(connection.pressed, connection.held)
+                connection.frame += 1
+
+                if events & engine.SPAWN:
+                    connection.send_board(events)
+                elif events:
+                    piece = game.piece
+                    out += STATE_MESSAGE.pack(
+                            STATE, connection.frame, events, piece.type_ID,
+                            piece.x, piece.y, piece.rot_index,
+                            game.next_type, game.points, game.lines,
+                            game.level)
+            connection.pressed = 0
+
+            if out:
+                transport = connection.transport
+                if transport.get_write_buffer_size() > MAX_BUFFERED:
+                    transport.abort() # Can't keep up, so stop trying
+                    continue
+
+                # The transport may keep hold of what it couldn't send
+                # yet, so the next tick's messages go in a new buffer
+                transport.write(out)
+                connection.out = bytearray()
+                self.bytes_sent += len(out)
+
+        self.ticks += 1
+
+    async def run(self, seconds=None):
+        """
+        Ticks the games SIM_RATE times a second, for `seconds` seconds or
+        until cancelled. If the ticks get behind (say the machine was
+        busy), up to MAX_TICKS_PER_WAKE run back to back to catch up.
+        """
+        loop = asyncio.get_running_loop()
+        period = 1 / self.rate
+        budget_ns = period * 1e9
+
+        start = last_time = loop.time()
+        last_report = start
+        last_cpu = time.process_time()
+        lag = 0 # Ticks' worth of time that hasn't been ticked yet
+
+        while seconds is None or last_time - start < seconds:
+            now = loop.time()
+            lag += (now - last_time) * self.rate
+            last_time = now
+            if lag > MAX_TICKS_PER_WAKE:
+                self.skipped += int(lag) - MAX_TICKS_PER_WAKE
+                lag = MAX_TICKS_PER_WAKE
+
+            for _ in range(int(lag)):
+                wall = time.perf_counter_ns()
+                cpu = time.thread_time_ns()
+                self.tick()
+                cpu = time.thread_time_ns() - cpu
+                wall = time.perf_counter_ns() - wall
+
+                self.tick_times.add(wall)
+                self.tick_cpu.add(cpu)
+                if wall > budget_ns:
+                    self.over_budget += 1
+                lag -= 1
+
+            if (self.report is not None and
+                now - last_report >= REPORT_INTERVAL):
+                cpu = time.process_time()
+                self.report(self.summary(now - last_report, cpu - last_cpu))
+                last_report = now
+                last_cpu = cpu
+
+            # Sleep until the next tick is due
+            await asyncio.sleep((1 - lag) * period)
+
+    def summary(self, seconds, cpu_seconds):
+        """
+        Returns a line about the ticks since the last one, and starts
+        counting afresh. cpu_seconds is the CPU time the whole process
+        used meanwhile (ticks, network and all).
+        """
+        wall = self.tick_times.summary()
+        cpu = self.tick_cpu.summary()
+        games = sum(1 for connection in self.connections
+                    if connection.game is not None
+                    and not connection.game.game_over)
+
+        line = (f"{self.ticks} ticks: {len(self.connections)} clients, "
+                f"{games} playing. Tick CPU p50 {cpu['p50_ms']} ms, "
+                f"p99 {cpu['p99_ms']} ms, max {cpu['max_ms']} ms "
+                f"(wall p99 {wall['p99_ms']} ms, {self.over_budget} over "
+                f"{1000 / self.rate:.1f} ms, {self.skipped} skipped). "
+                f"Process CPU {cpu_seconds / seconds:.0%}, "
+                f"{self.bytes_sent / seconds / 1000:.1f} kB/s out")
+
+        self.tick_times = profiling.Histogram()
+        self.tick_cpu = profiling.Histogram()
+        self.over_budget = 0
+        self.skipped = 0
+        self.bytes_sent = 0
+
+        return line
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.close()
+        for connection in list(self.connections):
+            connection.transport.close()
+
+# ------ Client side ------ #
+class Client(asyncio.Protocol):
+    """
+    A client's connection to the server. Keeps the latest state the
+    server has sent: `snapshot` is the board (and everything else) as of
+    the last BOARD, and the latest STATE's fields are kept as attributes
+    of the same names as engine.Game's.
+
+    Call start() to start a game and send_inputs() when keys change.
+    """
+    def __init__(self, start_level=0, seed=0):
+        self.start_level = start_level
+        self.seed = seed
+        self.transport = None
+        self.received = bytearray()
+        self.closed = None # Future that's done when the connection is
+
+        self.snapshot = None
+        self.frame = 0
+        self.events = 0
+        self.type_ID = self.x = self.y = self.rot_index = 0
+        self.next_type = 0
+        self.points = self.lines = self.level = 0
+        self.game_over = False
+
+        # Stats
+        self.games = 0 # Started
+        self.messages = 0
+        self.out_of_order = 0 # Frames that went backwards within a game
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.closed = asyncio.get_running_loop().create_future()
+        sock = transport.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.start()
+
+    def connection_lost(self, exc):
+        if not self.closed.done():
+            self.closed.set_result(exc)
+
+    def start(self):
+        self.transport.write(START_MESSAGE.pack(START, self.start_level,
+                                                self.seed))
+
+    def send_inputs(self, pressed=0, held=0):
+        self.transport.write(INPUT_MESSAGE.pack(
+                INPUT, held | pressed << PRESSED_SHIFT))
+
+    def data_received(self, data):
+        received = self.received
+        received += data
+
+        pos = 0
+        while pos < len(received):
+            kind = received[pos]
+            if kind == STATE:
+                if len(received) - pos < STATE_MESSAGE.size:
+                    break
+                (_, frame, self.events, self.type_ID, self.x, self.y,
+                 self.rot_index, self.next_type, self.points, self.lines,
+                 self.level) = STATE_MESSAGE.unpack_from(received, pos)
+                pos += STATE_MESSAGE.size
+
+            elif kind == BOARD:
+                if len(received) - pos < BOARD_HEADER.size:
+                    break
+                _, frame, self.events, length = \
+                        BOARD_HEADER.unpack_from(received, pos)
+                end = pos + BOARD_HEADER.size + length
+                if len(received) < end:
+                    break
+
+                snapshot = Snapshot.decode(
+                        bytes(received[pos + BOARD_HEADER.size:end]))
+                pos = end
+                self.snapshot = snapshot
+                for name in ("type_ID", "x", "y", "rot_index", "next_type",
+                             "points", "lines", "level"):
+                    setattr(self, name, getattr(snapshot, name))
+                if frame == 0:
+                    self.games += 1
+                    self.frame = 0
+
+            else:
+                self.transport.abort() # Not talking our protocol
+                return
+
+            if frame < self.frame:
+                self.out_of_order += 1
+            self.frame = frame
+            self.game_over = bool(self.events & engine.GAME_OVER)
+            self.messages += 1
+
+        del received[:pos]
+
+class RandomBot:
+    """
+    Plays through a Client by mashing keys at random, like a cat on a
+    keyboard. Good for load testing, and tops out fast enough to test
+    starting over too.
+    """
+    def __init__(self, client, seed=None):
+        self.client = client
+        self.rng = random.Random(seed)
+        self.held = 0
+        self.game_over_seen = 0
+
+    def act(self):
+        """Called once a frame. Sometimes changes the keys pressed."""
+        client = self.client
+        if client.game_over:
+            if client.games > self.game_over_seen:
+                self.game_over_seen = client.games
+                client.start() # Again
+            return
+
+        if self.rng.random() < 0.1:
+            pressed = 1 << self.rng.randrange(5)
+            self.held = pressed & (engine.LEFT | engine.RIGHT | engine.DOWN)
+            client.send_inputs(pressed, self.held)
+        elif self.held and self.rng.random() < 0.2:
+            self.held = 0
+            client.send_inputs(0, 0)
+
+async def run_bots(host, port, n, seconds, start_level=0, rate=SIM_RATE):
+    """
+    Connects n RandomBots to a server and has them play for `seconds`.
+    Returns their Clients.
+    """
+    loop = asyncio.get_running_loop()
+    clients = []
+    for i in range(n):
+        _, client = await loop.create_connection(
+                lambda: Client(start_level), host, port)
+        clients.append(client)
+
+    bots = [RandomBot(client, seed=i) for i, client in enumerate(clients)]
+    end = loop.time() + seconds
+    while loop.time() < end:
+        for bot in bots:
+            if not bot.client.closed.done():
+                bot.act()
+        await asyncio.sleep(1 / rate)
+
+    for client in clients:
+        client.transport.close()
+    return clients
+
+def bot_summary(clients):
+    dropped = sum(1 for client in clients if client.closed.done()
+                  and client.closed.result() is not None)
+    return (f"{len(clients)} bots: {sum(c.games for c in clients)} games, "
+            f"{sum(c.messages for c in clients)} messages, "
+            f"{sum(c.out_of_order for c in clients)} out of order, "
+            f"{dropped} dropped")
+
+async def serve(args):
+    server = GameServer(report=lambda line: print(line, file=sys.stderr))
+    # Bots on their own only need the loopback interface
+    address = args.address or ("127.0.0.1" if args.bots else "")
+    host, port = await server.listen(address, args.port)
+    print(f"Listening on {host}:{port}", file=sys.stderr)
+
+    if not args.bots:
+        await server.run()
+        return
+
+    # Loopback test: bots on this machine play against the server
+    ticks = asyncio.ensure_future(server.run())
+    clients = await run_bots(host, port, args.bots, args.seconds,
+                             args.level)
+    ticks.cancel()
+    server.close()
+    print(bot_summary(clients), file=sys.stderr)
+
+async def connect_bots(args):
+    host, port = args.connect.rsplit(":", 1)
+    clients = await run_bots(host, int(port), args.bots or 1, args.seconds,
+                             args.level)
+    print(bot_summary(clients), file=sys.stderr)
+
+if __name__ == "__main__":
+    # Usage: python server.py [--port PORT] to run a server
+    #    or: python server.py --bots N [--seconds S] to load test it with
+    #        N bots over loopback in the same process
+    #    or: python server.py --connect HOST:PORT --bots N to send N bots
+    #        to a server somewhere else
+    parser = argparse.ArgumentParser(description="Tetrix game server")
+    parser.add_argument("--address", default="",
+                        help="address to listen on (default: all, or "
+                             "loopback only with --bots)")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--bots", type=int, default=0, metavar="N",
+                        help="connect N bots that press random keys")
+    parser.add_argument("--seconds", type=float, default=10,
+                        help="how long the bots play for")
+    parser.add_argument("--level", type=int, default=0,
+                        help="start level of the bots' games")
+    parser.add_argument("--connect", metavar="HOST:PORT",
+                        help="only run bots, against this server")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(connect_bots(args) if args.connect else serve(args))
+    except KeyboardInterrupt:
+        pass
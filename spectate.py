@@ -0,0 +1,473 @@
+import socket
+import struct
+
+import engine
+from state import Snapshot
+
+# Spectator stream: a game, as it's played, in a few bytes per event.
+#
+# The stream starts with a keyframe (a state.Snapshot of the whole
+# game), and after that only says what changed: where the piece moved
+# to, when it locked, which rows were cleared, and the score. A spectator
+# keeps its own copy of the game and changes it to match, so it can draw
+# the game with the same code the player's screen uses.
+#
+# Every op starts with one byte: the op in the top 3 bits and a small
+# argument in the low 5. All multi-byte values are little-endian.
+#
+#   WAIT    arg = n - 1      The current frame ends, and n - 1 frames
+#                            with nothing in them follow (n <= 32)
+#   MOVE    arg = rotation   The piece moved (shifted, rotated or fell)
+#           dx + 8 | dy + 8 << 4    uint8
+#   PIECE   arg = rotation   Same, for moves too far for MOVE
+#           type uint8, x int8, y int8
+#   LOCK                     The piece locked (and starts flashing)
+#   SPAWN   arg = next type  The piece was added to the board, and the
+#                            next piece came into play
+#   CLEAR   arg = n          n rows were cleared
+#           n rows uint8
+#   SCORE   arg = points     Points went up by arg (1-31), or if arg is 0
+#           points uint32    are now `points`
+#   OTHER   arg = KEYFRAME   The whole state of the game, from scratch
+#                 length uint16, then a state.Snapshot
+#           arg = GAME_OVER
+#           arg = LEVEL      level uint8
+#
+# A frame where only timers changed costs nothing more than its share of
+# a WAIT, so a second of play is typically 50-150 bytes (the most when
+# soft dropping, which moves the piece and scores a point every frame).
+# A keyframe is about 190. Encoding is a check of the frame's event
+# bits, plus a few byte appends when something happened.
+#
+# The stream can go to a file (FileSink, which can be watched as it's
+# written) and to spectators over TCP (BroadcastSink). Spectators who
+# connect partway through are sent a keyframe first.
+
+WAIT = 0
+MOVE = 1
+PIECE = 2
+LOCK = 3
+SPAWN = 4
+CLEAR = 5
+SCORE = 6
+OTHER = 7
+
+KEYFRAME = 0 # OTHER arguments
+GAME_OVER = 1
+LEVEL = 2
+
+MAX_WAIT = 32
+KEYFRAME_BYTE = OTHER << 5 | KEYFRAME
+
+PIECE_OP = struct.Struct("<Bbb")
+LENGTH = struct.Struct("<H")
+POINTS = struct.Struct("<I")
+
+RESYNC = 512 # Event bit (after engine's): the whole game state changed
+FRAME_END = 1024 # Returned by Decoder.read() for a WAIT
+
+# Events that change what a spectator sees
+ENCODED = (engine.MOVE | engine.LOCK | engine.SPAWN | engine.DROP
+           | engine.CLEAR | engine.LEVEL_UP | engine.GAME_OVER)
+
+# ------ Host side ------ #
+class Encoder:
+    """
+    Writes the stream of an engine.Game to a sink. Call frame(events)
+    after every step of the game, with what step() returned, and flush()
+    every so often (e.g. once per frame drawn) to send what there is.
+    """
+    def __init__(self, game, sink):
+        self.game = game
+        self.sink = sink
+        self.out = bytearray()
+        self.pending = 0 # Frames that have been stepped but not ended
+        self.keyframe()
+
+    def keyframe(self):
+        """Writes the whole state of the game (e.g. after a rewind)."""
+        if self.pending:
+            self.end_frames()
+
+        data = Snapshot.take(self.game).encode()
+        self.out.append(KEYFRAME_BYTE)
+        self.out += LENGTH.pack(len(data))
+        self.out += data
+
+        piece = self.game.piece
+        self.x = piece.x
+        self.y = piece.y
+        self.points = self.game.points
+
+    def frame(self, events):
+        """Call after each step of the game, with the events it returned."""
+        if events & ENCODED:
+            self.encode(events)
+        self.pending += 1
+
+    def encode(self, events):
+        out = self.out
+        game = self.game
+        piece = game.piece
+        if self.pending:
+            self.end_frames()
+
+        if events & engine.MOVE:
+            dx = piece.x - self.x
+            dy = piece.y - self.y
+            if -8 <= dx < 8 and -8 <= dy < 8:
+                out.append(MOVE << 5 | piece.rot_index)
+                out.append(dx + 8 | dy + 8 << 4)
+            else:
+                out.append(PIECE << 5 | piece.rot_index)
+                out += PIECE_OP.pack(piece.type_ID, piece.x, piece.y)
+            self.x = piece.x
+            self.y = piece.y
+
+        if events & engine.LOCK:
+            out.append(LOCK << 5)
+
+        if events & engine.SPAWN:
+            # The piece that locked isn't there any more, so game.piece
+            # is the new one, already at the spawn position
+            out.append(SPAWN << 5 | game.next_type)
+            self.x = piece.x
+            self.y = piece.y
+
+        if events & engine.CLEAR:
+            out.append(CLEAR << 5 | len(game.cleared_rows))
+            out += bytes(game.cleared_rows)
+
+        if events & (engine.DROP | engine.CLEAR):
+            gained = game.points - self.points
+            if 0 < gained < 32:
+                out.append(SCORE << 5 | gained)
+            else:
+                out.append(SCORE << 5)
+                out += POINTS.pack(game.points)
+            self.points = game.points
+
+        if events & engine.LEVEL_UP:
+            out.append(OTHER << 5 | LEVEL)
+            out.append(game.level)
+
+        if events & engine.GAME_OVER:
+            out.append(OTHER << 5 | GAME_OVER)
+
+    def end_frames(self):
+        """Writes WAITs for the frames stepped since the last op."""
+        out = self.out
+        pending = self.pending
+        while pending > 0:
+            n = min(pending, MAX_WAIT)
+            out.append(WAIT << 5 | n - 1)
+            pending -= n
+        self.pending = 0
+
+    def flush(self):
+        """Sends everything written so far to the sink."""
+        if self.pending:
+            self.end_frames()
+
+        sink = self.sink
+        if sink.wants_keyframe:
+            # Someone new is watching. The keyframe goes in a write of
+            # its own, so they can be sent the stream from there
+            if self.out:
+                sink.write(self.out)
+                self.out = bytearray()
+            self.keyframe()
+
+        if self.out:
+            sink.write(self.out)
+            self.out = bytearray() # The sink may keep hold of the last
+
+class FileSink:
+    """
+    Saves the stream to a file. Every write is flushed, so a spectator
+    can follow the file as it grows.
+    """
+    wants_keyframe = False
+
+    def __init__(self, path):
+        self.file = open(path, "wb")
+
+    def write(self, data):
+        self.file.write(data)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class BroadcastSink:
+    """
+    Sends the stream to every spectator connected to a TCP port.
+    Spectators who connect partway through wait for the next keyframe,
+    which the encoder writes as soon as anyone is waiting.
+    Spectators who can't keep up are disconnected.
+    """
+    def __init__(self, port, address=""):
+        self.listener = socket.create_server((address, port))
+        self.listener.setblocking(False)
+        self.waiting = [] # Connected, but not sent a keyframe yet
+        self.spectators = []
+
+    @property
+    def wants_keyframe(self):
+        self.accept()
+        return bool(self.waiting)
+
+    def accept(self):
+        while True:
+            try:
+                sock, addr = self.listener.accept()
+            except BlockingIOError:
+                break
+
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.waiting.append(sock)
+
+    def write(self, data):
+        if data[0] == KEYFRAME_BYTE:
+            self.spectators += self.waiting
+            self.waiting = []
+
+        for sock in list(self.spectators):
+            try:
+                sock.sendall(data)
+            except OSError: # Gone, or too far behind
+                self.spectators.remove(sock)
+                sock.close()
+
+    def close(self):
+        for sock in self.waiting + self.spectators:
+            sock.close()
+        self.listener.close()
+
+# ------ Spectator side ------ #
+class FileSource:
+    """Reads a stream from a file, including any more that's written."""
+    def __init__(self, path):
+        self.file = open(path, "rb")
+
+    def read(self):
+        return self.file.read()
+
+    def close(self):
+        self.file.close()
+
+class SocketSource:
+    """Reads a stream from a BroadcastSink."""
+    def __init__(self, host, port):
+        self.sock = socket.create_connection((host, port))
+        self.sock.setblocking(False)
+        self.closed = False
+
+    def read(self):
+        chunks = []
+        while not self.closed:
+            try:
+                data = self.sock.recv(65536)
+            except BlockingIOError:
+                break
+            except OSError:
+                data = b""
+
+            if not data:
+                self.closed = True
+            chunks.append(data)
+
+        return b"".join(chunks)
+
+    def close(self):
+        self.sock.close()
+
+class Decoder:
+    """
+    Plays a stream back into an engine.Game (self.game), a frame at a
+    time. The game is only as complete as a spectator needs it: the
+    board, piece, next piece, score, lines and level are right, but
+    timers aren't (except the lock flash).
+
+    Call poll() to take in what's arrived from the source, next_game() to
+    skip to the start of a game, then step() for each frame.
+    """
+    def __init__(self, source=None):
+        self.source = source
+        self.data = bytearray()
+        self.pos = 0 # Of the next op in data
+
+        self.game = None
+        self.wait = 0 # Empty frames to go before the next op
+        self.in_frame = False # Some of the current frame has been read
+        self.events = 0 # Of the current frame so far
+
+    def poll(self):
+        """Takes in whatever has arrived from the source."""
+        data = self.source.read()
+        if data:
+            if self.pos > 4096:
+                del self.data[:self.pos]
+                self.pos = 0
+            self.data += data
+
+    def next_game(self):
+        """
+        Skips to just after the next keyframe. Returns False if it
+        hasn't arrived yet (call again once there's more).
+        """
+        while True:
+            events = self.read()
+            if events is None:
+                return False
+
+            if events & RESYNC:
+                self.wait = 0
+                self.in_frame = True
+                self.events = 0
+                return True
+
+    def step(self):
+        """
+        Plays the next frame. Returns its event bits, like
+        engine.Game.step (plus RESYNC if there was a keyframe), or None if
+        the rest of the frame hasn't arrived yet (call again once there's
+        more).
+        """
+        if self.wait:
+            self.wait -= 1
+            self.flash()
+            return 0
+
+        if not self.in_frame:
+            self.in_frame = True
+            self.flash()
+
+        while True:
+            events = self.read()
+            if events is None:
+                return None
+
+            if events & FRAME_END:
+                events = self.events
+                self.events = 0
+                self.in_frame = False
+                return events
+
+            self.events |= events
+
+    def flash(self):
+        """Counts down the lock timer once the piece has locked."""
+        piece = self.game.piece
+        if piece.lock_timer <= 0:
+            piece.lock_timer -= 1
+
+    def read(self):
+        """
+        Applies the next op to the game. Returns its event bits (FRAME_END
+        for a WAIT), or None if all of it hasn't arrived yet.
+        """
+        data = self.data
+        pos = self.pos
+        if pos >= len(data):
+            return None
+
+        op = data[pos] >> 5
+        arg = data[pos] & 31
+        size = op_size(op, arg, data, pos)
+        if size is None:
+            return None
+        self.pos += size
+
+        game = self.game
+        if op == WAIT:
+            self.wait = arg
+            return FRAME_END
+
+        if op == OTHER and arg == KEYFRAME:
+            snapshot = Snapshot.decode(
+                    bytes(data[pos + 1 + LENGTH.size:pos + size]))
+            if (game is None or (game.board.cols, game.board.rows)
+                != (snapshot.cols, snapshot.rows)):
+                self.game = snapshot.new_game()
+            else:
+                snapshot.restore(game)
+            return RESYNC
+
+        if game is None:
+            return 0 # Joined partway, and no keyframe yet
+
+        piece = game.piece
+        if op == MOVE:
+            piece.rot_index = arg
+            piece.x += (data[pos + 1] & 15) - 8
+            piece.y += (data[pos + 1] >> 4) - 8
+            return engine.MOVE
+
+        if op == PIECE:
+            piece.rot_index = arg
+            piece.type_ID, piece.x, piece.y = PIECE_OP.unpack_from(data,
+                                                                   pos + 1)
+            return engine.MOVE
+
+        if op == LOCK:
+            piece.lock_timer = 0
+            return engine.LOCK
+
+        if op == SPAWN:
+            game.board.lock(piece.minos, piece.type_ID)
+            game.cleared_rows = []
+            game.piece = engine.Piece(game.next_type, game.spawn_pos)
+            game.next_type = arg
+            return engine.SPAWN
+
+        if op == CLEAR:
+            game.cleared_rows = list(data[pos + 1:pos + size])
+            game.board.clear_rows(game.cleared_rows)
+            game.lines += arg
+            return engine.CLEAR
+
+        if op == SCORE:
+            if arg:
+                game.points += arg
+            else:
+                game.points, = POINTS.unpack_from(data, pos + 1)
+            return engine.DROP
+
+        if arg == LEVEL:
+            game.level = data[pos + 1]
+            return engine.LEVEL_UP
+
+        game.game_over = True # GAME_OVER, the only other op
+        return engine.GAME_OVER
+
+def op_size(op, arg, data, pos):
+    """
+    Returns the size in bytes of the op at data[pos], or None if not
+    enough of it has arrived to tell (or to read it all).
+    """
+    if op in (WAIT, LOCK, SPAWN):
+        size = 1
+    elif op == MOVE:
+        size = 2
+    elif op == PIECE:
+        size = 1 + PIECE_OP.size
+    elif op == CLEAR:
+        size = 1 + arg
+    elif op == SCORE:
+        size = 1 if arg else 1 + POINTS.size
+    elif arg == LEVEL:
+        size = 2
+    elif arg == GAME_OVER:
+        size = 1
+    elif arg == KEYFRAME:
+        if len(data) - pos < 1 + LENGTH.size:
+            return None
+        size = 1 + LENGTH.size + LENGTH.unpack_from(data, pos + 1)[0]
+    else:
+        raise Exception(f"unknown op {op}:{arg} in spectator stream")
+
+    if len(data) - pos < size:
+        return None
+    return size
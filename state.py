@@ -0,0 +1,224 @@
+import struct
+
+from numpy import concatenate, frombuffer, int8, int32, uint8, zeros
+
+import engine
+
+# Snapshots of an engine.Game, for search bots, rewind and netcode.
+#
+# A Snapshot is a flat record of plain ints and bytes: the bitboard (an
+# int, so it can be shared rather than copied), the cells and row fill
+# counts as bytes, and the piece, timers, RNG state and score as ints.
+# Taking one or restoring one is a handful of attribute copies plus
+# one small buffer copy; nothing needs deep-copying.
+#
+# Encoded layout (all little-endian):
+#
+#   magic    4 bytes   b"TXS" + format version
+#   seed     uint32
+#   level    uint8     start level
+#   cols     uint16
+#   rows     uint16
+#   game     see GAME below
+#   cleared  uint16    per row cleared by the last lock
+#   cells    cells + 1 (0 = empty), two per byte, low nibble first
+#
+# The bitboard, row fill counts and hashes aren't stored. They're worked
+# out again from the cells when decoding.
+
+MAGIC = b"TXS\x01"
+HEADER = struct.Struct("<4sIBHH")
+
+# type_ID, x, y, rot_index, lock_timer, next_type, RNG state,
+# spawn_freeze_timer, frame_counter, DAS_counter, level, lines, points,
+# soft_drop_fpc, flags (soft drop, game over), number of cleared rows
+GAME = struct.Struct("<BhhBhBIhIhBIIBBB")
+ROW = struct.Struct("<H")
+
+SOFT_DROP = 1 # Flag bits
+GAME_OVER = 2
+
+boards = {} # (cols, rows) -> Board that decode() works things out with
+
+def scratch_board(cols, rows):
+    if (cols, rows) not in boards:
+        boards[(cols, rows)] = engine.Board(cols, rows)
+
+    return boards[(cols, rows)]
+
+# ------ Class for saving and restoring game state ------ #
+class Snapshot:
+    """
+    Everything needed to put an engine.Game back the way it was at some
+    frame. Take one with Snapshot.take(game), and put it back with
+    snapshot.restore(game) (into any game with the same board size).
+    """
+    __slots__ = ("seed", "start_level", "cols", "rows",
+                 "bits", "cells", "row_fill", "row_hashes", "board_hash",
+                 "cleared_rows",
+                 "type_ID", "x", "y", "rot_index", "lock_timer",
+                 "next_type", "rng_state",
+                 "spawn_freeze_timer", "frame_counter", "DAS_counter",
+                 "level", "lines", "points",
+                 "soft_drop", "soft_drop_fpc", "game_over")
+
+    @classmethod
+    def take(cls, game):
+        """Returns a snapshot of the game as it is now."""
+        snapshot = cls.__new__(cls)
+
+        snapshot.seed = game.seed
+        snapshot.start_level = game.start_level
+        snapshot.cols = game.board.cols
+        snapshot.rows = game.board.rows
+
+        board = game.board
+        snapshot.bits = board.bits
+        snapshot.cells = board.cells.tobytes()
+        snapshot.row_fill = board.row_fill.tobytes()
+        snapshot.row_hashes = tuple(board.row_hashes)
+        snapshot.board_hash = board.hash
+        snapshot.cleared_rows = tuple(game.cleared_rows)
+
+        piece = game.piece
+        snapshot.type_ID = piece.type_ID
+        snapshot.x = piece.x
+        snapshot.y = piece.y
+        snapshot.rot_index = piece.rot_index
+        snapshot.lock_timer = piece.lock_timer
+
+        snapshot.next_type = game.next_type
+        snapshot.rng_state = game.rng.state
+
+        snapshot.spawn_freeze_timer = game.spawn_freeze_timer
+        snapshot.frame_counter = game.frame_counter
+        snapshot.DAS_counter = game.DAS_counter
+
+        snapshot.level = game.level
+        snapshot.lines = game.lines
+        snapshot.points = game.points
+
+        snapshot.soft_drop = game.soft_drop
+        snapshot.soft_drop_fpc = game.soft_drop_fpc
+        snapshot.game_over = game.game_over
+
+        return snapshot
+
+    def restore(self, game):
+        """Puts the game back the way it was when the snapshot was taken."""
+        board = game.board
+        if (board.cols, board.rows) != (self.cols, self.rows):
+            raise Exception("snapshot is of a game with a different board size")
+
+        game.seed = game.rng.seed = self.seed
+        game.start_level = self.start_level
+
+        # The board is changed in place as pieces lock, so it needs a copy
+        board.bits = self.bits
+        board.cells = frombuffer(self.cells, dtype=int8).reshape(
+                board.cells.shape).copy()
+        board.row_fill = frombuffer(self.row_fill, dtype=int32).copy()
+        board.row_hashes = list(self.row_hashes)
+        board.hash = self.board_hash
+        game.cleared_rows = list(self.cleared_rows)
+
+        piece = engine.Piece(self.type_ID, (self.x, self.y))
+        piece.rot_index = self.rot_index
+        piece.lock_timer = self.lock_timer
+        game.piece = piece
+
+        game.next_type = self.next_type
+        game.rng.state = self.rng_state
+
+        game.spawn_freeze_timer = self.spawn_freeze_timer
+        game.frame_counter = self.frame_counter
+        game.DAS_counter = self.DAS_counter
+
+        game.level = self.level
+        game.lines = self.lines
+        game.points = self.points
+
+        game.soft_drop = self.soft_drop
+        game.soft_drop_fpc = self.soft_drop_fpc
+        game.game_over = self.game_over
+
+    def new_game(self):
+        """Returns a new engine.Game in the state of the snapshot."""
+        game = engine.Game(self.start_level, self.cols, self.rows, self.seed)
+        self.restore(game)
+        return game
+
+    # --- Binary format --- #
+
+    def encode(self):
+        """Returns the snapshot as bytes."""
+        data = bytearray(HEADER.pack(MAGIC, self.seed, self.start_level,
+                                     self.cols, self.rows))
+
+        flags = (SOFT_DROP if self.soft_drop else 0) | \
+                (GAME_OVER if self.game_over else 0)
+        data += GAME.pack(self.type_ID, self.x, self.y, self.rot_index,
+                          self.lock_timer, self.next_type, self.rng_state,
+                          self.spawn_freeze_timer, self.frame_counter,
+                          self.DAS_counter, self.level, self.lines,
+                          self.points, self.soft_drop_fpc, flags,
+                          len(self.cleared_rows))
+        for row_n in self.cleared_rows:
+            data += ROW.pack(row_n)
+
+        # Cells are -1 to 6, so they fit in a nibble once 1 is added
+        nibbles = (frombuffer(self.cells, dtype=int8) + 1).astype(uint8)
+        if len(nibbles) % 2:
+            nibbles = concatenate((nibbles, zeros(1, dtype=uint8)))
+        data += (nibbles[0::2] | nibbles[1::2] << 4).tobytes()
+
+        return bytes(data)
+
+    @classmethod
+    def decode(cls, data):
+        """Reads a snapshot from bytes made by encode()."""
+        magic, seed, start_level, cols, rows = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise Exception("data is not a Tetrix snapshot (or is a newer version)")
+
+        snapshot = cls.__new__(cls)
+        snapshot.seed = seed
+        snapshot.start_level = start_level
+        snapshot.cols = cols
+        snapshot.rows = rows
+
+        pos = HEADER.size
+        (snapshot.type_ID, snapshot.x, snapshot.y, snapshot.rot_index,
+         snapshot.lock_timer, snapshot.next_type, snapshot.rng_state,
+         snapshot.spawn_freeze_timer, snapshot.frame_counter,
+         snapshot.DAS_counter, snapshot.level, snapshot.lines,
+         snapshot.points, snapshot.soft_drop_fpc, flags,
+         n_cleared) = GAME.unpack_from(data, pos)
+        pos += GAME.size
+
+        snapshot.soft_drop = bool(flags & SOFT_DROP)
+        snapshot.game_over = bool(flags & GAME_OVER)
+
+        cleared_rows = []
+        for _ in range(n_cleared):
+            row_n, = ROW.unpack_from(data, pos)
+            pos += ROW.size
+            cleared_rows.append(row_n)
+        snapshot.cleared_rows = tuple(cleared_rows)
+
+        # Unpack the cells and work out the rest of the board from them
+        board = scratch_board(cols, rows)
+        n_cells = board.cells.size
+        packed = frombuffer(data, dtype=uint8, count=(n_cells + 1) // 2,
+                            offset=pos)
+        nibbles = (packed.reshape(-1, 1) >> [0, 4] & 0xF).ravel()[:n_cells]
+        board.load_cells(
+                (nibbles.astype(int8) - 1).reshape(board.cells.shape))
+
+        snapshot.bits = board.bits
+        snapshot.cells = board.cells.tobytes()
+        snapshot.row_fill = board.row_fill.tobytes()
+        snapshot.row_hashes = tuple(board.row_hashes)
+        snapshot.board_hash = board.hash
+
+        return snapshot
@@ -0,0 +1,57 @@
+import random
+import threading
+import time
+
+import netplay
+
+FRAMES = 300
+TIMEOUT = 30 # Seconds
+
+def test_rollback_stays_in_step():
+    # Both sides over loopback, through a bad network
+    host_udp = netplay.UdpTransport(("127.0.0.1", 0))
+    join_udp = netplay.UdpTransport(remote_addr=host_udp.address)
+    transports = [netplay.LatencySimulator(udp, 60, 30, 0.1, seed=seed)
+                  for seed, udp in enumerate((host_udp, join_udp))]
+
+    deadline = time.perf_counter() + TIMEOUT
+    idle = lambda: time.perf_counter() < deadline
+
+    # The host waits for the joiner, so it connects on a thread
+    hosted = []
+    thread = threading.Thread(target=lambda: hosted.append(netplay.connect(
+            transports[0], True, 18, seed=7, clear_delay=20, idle=idle)))
+    thread.start()
+    joiner = netplay.connect(transports[1], False, idle=idle)
+    assert joiner is not None
+
+    # The joiner can start playing before the host has heard back from it
+    players = [(joiner, random.Random(2))]
+    try:
+        while True:
+            assert idle(), "match didn't finish in time"
+            if len(players) == 1 and not thread.is_alive():
+                assert hosted[0] is not None
+                players.append((hosted[0], random.Random(1)))
+
+            for session, rng in players:
+                session.poll()
+                if session.frame < FRAMES and session.ready():
+                    session.advance(1 << rng.randrange(5), rng.randrange(32))
+                elif session.frame == FRAMES:
+                    session.send_inputs() # The last ones may be lost
+
+            if (len(players) == 2 and
+                all(session.checked == FRAMES for session, _ in players)):
+                break
+            time.sleep(0.001)
+    finally:
+        thread.join()
+        for session, _ in players:
+            session.close()
+
+    host = hosted[0]
+    assert host.desync_frame is None and joiner.desync_frame is None
+    assert host.rollbacks > 0 and joiner.rollbacks > 0
+    assert host.game.checksum() == joiner.opponent_game.checksum()
+    assert host.opponent_game.checksum() == joiner.game.checksum()
@@ -0,0 +1,46 @@
+import random
+
+import engine
+from rewind import Rewinder
+
+def play(rewinder, frames, seed=1):
+    """Steps the rewinder's game with random inputs."""
+    rng = random.Random(seed)
+    for _ in range(frames):
+        rewinder.step(1 << rng.randrange(5), rng.randrange(32))
+
+def test_seek_to_current_keyframe_boundary():
+    # Before the first lap of the ring, and after several
+    for frames, seconds in ((60, 60), (600, 2)):
+        game = engine.Game(18, seed=5)
+        rewinder = Rewinder(game, seconds)
+        play(rewinder, frames)
+        checksum = game.checksum()
+
+        assert rewinder.back(0) == frames
+        assert game.checksum() == checksum
+
+def test_seek_matches_replaying():
+    game = engine.Game(18, seed=5)
+    rewinder = Rewinder(game, 2)
+    play(rewinder, 600)
+
+    reference = engine.Game(18, seed=5)
+    play(Rewinder(reference, 2), 540)
+
+    rewinder.seek(540) # A keyframe boundary in the past
+    assert game.checksum() == reference.checksum()
+
+def test_rewind_after_topping_out():
+    game = engine.Game(29, seed=3)
+    rewinder = Rewinder(game, 60)
+    while not game.game_over:
+        rewinder.step(0, engine.DOWN)
+
+    rewinder.back_pieces(1, grace=30)
+    assert not game.game_over
+
+    reference = engine.Game(29, seed=3)
+    for _ in range(rewinder.frame):
+        reference.step(0, engine.DOWN)
+    assert game.checksum() == reference.checksum()
@@ -1,11 +1,13 @@
 import pygame
-from numpy import array
 from math import ceil
 
 import constants as c
+from engine import Piece
 
 # ------ Class for individual minos (blocks) ------ #
 class Mino(pygame.sprite.DirtySprite):
+    tiles = {} # Mino images, keyed by (colour, w, h). See get_tile()
+    tiles_geometry = None # (cell_size, scale) the tiles were drawn for
 
     @classmethod
     def get_size(cls, grid_x, grid_y):
@@ -52,26 +54,34 @@ class Mino(pygame.sprite.DirtySprite):
         pixel_y = int(c.cell_size * grid_y + c.field_pos[1])
         return pixel_x, pixel_y
 
-    def __init__(self, colour, x, y):
-        super().__init__()
-        self.grid_x = x
-        self.grid_y = y
-        self.pixel_x, self.pixel_y = self.grid_to_pixel(self.grid_x,
-                                                        self.grid_y)
+    @classmethod
+    def get_tile(cls, colour, w, h):
+        """
+        Returns the pre-rendered mino image for a colour and size. Tiles
+        are shared by all minos, and are only drawn again if the field
+        geometry changes.
+        """
+        geometry = (c.cell_size, c.scale)
+        if cls.tiles_geometry != geometry:
+            cls.tiles = {}
+            cls.tiles_geometry = geometry
 
-        self.colour = colour
+        key = (colour, w, h)
+        if key not in cls.tiles:
+            cls.tiles[key] = cls.draw_tile(colour, w, h)
 
-        self.w, self.h = self.get_size(self.grid_x, self.grid_y)
-        self.image = pygame.Surface((self.w, self.h))
-        self.draw_mino()
+        return cls.tiles[key]
 
-        self.rect = pygame.Rect(self.pixel_x, self.pixel_y, self.w, self.h)
+    @staticmethod
+    def draw_tile(colour, w, h):
+        """Draws a mino image of the given colour and size."""
+
+        image = pygame.Surface((w, h))
 
-    def draw_mino(self):
         border_col = c.LIGHT_BLUE_GREY
-        hl_col = c.lighten(self.colour)
+        hl_col = c.lighten(colour)
 
-        self.image.fill(self.colour)
+        image.fill(colour)
 
         # Point pairs for top, left, bottom and right sides
         point_pairs = lambda x0, y0, x1, y1: (
@@ -84,25 +94,41 @@ class Mino(pygame.sprite.DirtySprite):
         border_w = round(c.scale) # 1
         x0 = 0
         y0 = 0
-        x1 = round(self.w - c.scale)
-        y1 = round(self.h - c.scale)
+        x1 = round(w - c.scale)
+        y1 = round(h - c.scale)
 
         for line in point_pairs(x0, y0, x1, y1)[2:]:
-            pygame.draw.line(self.image, border_col, *line, border_w)
+            pygame.draw.line(image, border_col, *line, border_w)
 
 
         # Light border on top and left sides
         border_w = ceil(4 * c.scale) # 3
         x0 = border_w//2 - 1
         y0 = border_w//2 - 1
-        x1 = int(self.w - 2 * c.scale)
-        y1 = int(self.h - 2 * c.scale)
+        x1 = int(w - 2 * c.scale)
+        y1 = int(h - 2 * c.scale)
 
         for line in point_pairs(x0, y0, x1, y1)[:2]:
-            pygame.draw.line(self.image, hl_col, *line, border_w)
+            pygame.draw.line(image, hl_col, *line, border_w)
 
         pygame.draw.rect(
-                self.image, border_col, (0, 0, round(c.scale), round(c.scale)))
+                image, border_col, (0, 0, round(c.scale), round(c.scale)))
+
+        return image
+
+    def __init__(self, colour, x, y):
+        super().__init__()
+        self.grid_x = x
+        self.grid_y = y
+        self.pixel_x, self.pixel_y = self.grid_to_pixel(self.grid_x,
+                                                        self.grid_y)
+
+        self.colour = colour
+
+        self.w, self.h = self.get_size(self.grid_x, self.grid_y)
+        self.image = self.get_tile(self.colour, self.w, self.h)
+
+        self.rect = pygame.Rect(self.pixel_x, self.pixel_y, self.w, self.h)
 
     def update(self):
 
@@ -113,47 +139,26 @@ class Mino(pygame.sprite.DirtySprite):
 
         self.w, self.h = self.get_size(self.grid_x, self.grid_y)
 
-        self.image = pygame.Surface((self.w, self.h))
-        self.draw_mino()
+        self.image = self.get_tile(self.colour, self.w, self.h)
 
         self.rect = pygame.Rect(
                 self.pixel_x, self.pixel_y, self.w, self.h)
 
-        curr = self.image, self.rect
-
-        if prev == curr:
+        if self.image is prev[0] and self.rect == prev[1]:
             self.dirty = 0
             return
 
         self.dirty = 1
 
-# ------ Class for tetrimino logic ------ #
-class Tetrimino(pygame.sprite.RenderUpdates):
+# ------ Class for drawing tetriminos ------ #
+class Tetrimino(Piece, pygame.sprite.RenderUpdates):
+    """
+    A Piece with a Mino sprite for each of its minos. The sprites follow
+    the piece around whenever it moves.
+    """
     def __init__(self, type_ID, centre_pos):
-        super().__init__()
-        self.type_ID = type_ID
-        self.centre_pos = centre_pos.copy()
-
-        self.lock_timer = 32
-
-        if type_ID == 5:
-            self.offsets = c.offsets_O.copy()
-        elif type_ID == 6:
-            self.offsets = c.offsets_I.copy()
-        else:
-            self.offsets = c.offsets_TJZSL.copy()
-
-        self.rot_index = 0 # Rotation state (0-3 for the four rotation states)
-
-        self.minos = [] # Array with grid coordinate pairs for each mino
-                        # E.g. [[3 -1] [4 -2] [4 -1] [5 -1]] (T-piece at spawn)
-
-        for mino_XY in c.tetriminos[self.type_ID]:
-            self.minos.append(mino_XY)
-
-        self.minos = array(self.minos)
-        self.minos = self.minos + self.centre_pos
-        self.minos += self.offsets[self.rot_index][0]
+        pygame.sprite.RenderUpdates.__init__(self)
+        Piece.__init__(self, type_ID, centre_pos)
 
         # --- Sprite/group stuff --- #
 
@@ -172,127 +177,39 @@ class Tetrimino(pygame.sprite.RenderUpdates):
         Update position of sprites according to self.minos.
         """
         # Update position of sprites according to self.minos
-        for i in range(len(self.minos)):
-            spr = self.sprite_list[i]
-            spr.grid_x, spr.grid_y = self.minos[i]
+        for spr, mino_XY in zip(self.sprite_list, self.minos):
+            spr.grid_x, spr.grid_y = mino_XY
 
         # Call update method of sprites
         self.update()
 
-    def rotate(self, dir, dead_minos):
-        """
-        Method to rotate tetrimino clockwise ("cw") or anti-clockwise ("ccw").
-        Does SRS wall-kicks.
-        """
-        prev_rot = self.rot_index
-        prev_minos = self.minos.copy()
-
-        # --- Pure rotation --- #
-
-        # Translate minos to origin
-        self.minos -= self.centre_pos
-
-        # Rotate minos about origin
-        if dir == "cw": # Clockwise
-            self.minos = array([(-m[1], m[0]) for m in self.minos])
-            self.rot_index = (self.rot_index + 1) % 4
+    def drawn_rects(self):
+        """Returns the screen rects the sprites were last drawn at."""
+        return [rect for rect in self.spritedict.values() if rect]
 
-        elif dir == "ccw": # Counterclockwise
-            self.minos = array([(m[1], -m[0]) for m in self.minos])
-            self.rot_index = (self.rot_index - 1) % 4
-
-        # Translate minos back
-        self.minos += self.centre_pos
-
-        # --- Wall kicks  --- #
-
-        kick_tests = self.offsets[prev_rot] - self.offsets[self.rot_index]
-
-        for kick in kick_tests:
-            self.minos += kick
-            self.centre_pos += kick
-            if not self.colliding(dead_minos):
-                # Wall kick was successful :)
-                self.update_sprites()
-                return
-
-            # Kick failed. Undo failed kick before testing next one
-            self.minos -= kick
-            self.centre_pos -= kick
-
-        # No wall kick was succesful. Reset to previous state
-        self.minos = prev_minos
-        self.rot_index = prev_rot
-
-    def shift(self, dir, dead_minos):
+    def follow(self, piece):
         """
-        Method to shift tetrimino left or right. Handles collision.
+        Copy the position and rotation of a piece (e.g. the active piece
+        of an engine.Game) and move the sprites to match.
         """
-        prev_minos = self.minos.copy()
-        prev_centre = self.centre_pos.copy()
-
-        if dir == "left":
-            self.centre_pos[0] -= 1
-            self.minos[:,0] -= 1
-
-        elif dir == "right":
-            self.centre_pos[0] += 1
-            self.minos[:,0] += 1
-
-        else:
-            raise Exception("dir argument must be string 'left' or 'right'")
+        self.x, self.y = piece.centre_pos
+        self.rot_index = piece.rot_index
+        self.lock_timer = piece.lock_timer
+        self.update_sprites()
 
-        if self.colliding(dead_minos):
-            self.minos = prev_minos
-            self.centre_pos = prev_centre
+    def rotate(self, dir, board):
+        rotated = super().rotate(dir, board)
+        if rotated:
             self.update_sprites()
-            return False
+        return rotated
 
+    def shift(self, dir, board):
+        shifted = super().shift(dir, board)
         self.update_sprites()
-        return True
+        return shifted
 
-    def fall(self, dead_minos, level):
-        """
-        Method to make tetrimino fall down one row. Handles landing.
-        """
-        if not self.landed(dead_minos):
-            self.minos[:,1] += 1
-            self.centre_pos[1] += 1
-            self.lock_timer = c.lock_delay[level]
+    def fall(self, board, level):
+        fell = super().fall(board, level)
+        if fell:
             self.update_sprites()
-
-    def colliding(self, dead_minos):
-        """
-        Checks if any minos are overlapping dead minos or are out of bounds.
-        """
-        for m in self.minos:
-            # Collision with floor
-            if m[1] >= c.ROWS:
-                return True
-
-            # Collision with walls
-            if not (0 <= m[0] < c.COLS):
-                return True
-
-            # Collision with dead minos
-            for dead in dead_minos:
-                if list(m) == [dead.grid_x, dead.grid_y]:
-                    return True
-
-        return False
-
-    def landed(self, dead_minos):
-        """
-        Checks if tetrimino has landed (on floor or on dead minos).
-        """
-        for m in self.minos:
-            # Check if landed on floor
-            if m[1] + 1 >= c.ROWS:
-                return True
-
-            # Check if landed on any dead minos
-            for dead in dead_minos:
-                if (m[0], m[1] + 1) == (dead.grid_x, dead.grid_y):
-                    return True
-
-        return False
+        return fell
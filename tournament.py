@@ -0,0 +1,370 @@
+import argparse
+import importlib
+import json
+import os
+import random
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+import engine
+import rules
+
+# Plays bots against many seeds and start levels, to compare them.
+#
+# Every (bot, seed, level) game is played headlessly in a pool of worker
+# processes, and its result is written out as a line of JSON as soon as
+# it finishes, so a long run can be watched (or stopped) partway:
+#
+#   {"bot": "greedy", "seed": 7, "level": 18, "score": 41220,
+#    "lines": 52, "level_reached": 23, "pieces": 151, "frames": 5213,
+#    "topped_out": true, "seconds": 0.31}
+#
+# Games that run to max_frames without topping out are stopped there
+# ("topped_out": false). A game whose bot raises an exception gets an
+# "error" instead of a score.
+#
+# If a worker process dies (a crash in a bot's extension module, or the
+# OOM killer, say) the pool is started again, and the games that were in
+# it are played again one at a time, so that another crash shows which
+# game caused it. A game that kills its worker MAX_CRASHES times on its
+# own is written out with "error": "worker crashed", and the run goes on.
+#
+# A bot is a function bot(game, rng) that's called whenever a piece
+# spawns, with the engine.Game and a random.Random seeded with the game's
+# seed. It returns the input bits to press for that piece, one a frame;
+# once they run out, DOWN is held until the piece locks. Bots are named
+# either by a key of BOTS or as "module:function".
+
+MAX_FRAMES = 5 * 60 * 60 # Five minutes of play
+MAX_CRASHES = 2 # Times a game can kill its worker before it's given up on
+GAMES_PER_WORKER = 4 # Games queued in the pool at a time, per worker
+REPORT_INTERVAL = 5 # Seconds between progress reports
+
+# ------ Bots ------ #
+def drop_placements(game):
+    """
+    Yields (x, y, rot, moves) for every distinct placement of a piece
+    that has just spawned, that it can reach by rotating, then shifting,
+    then dropping. moves leaves out the drop, which holding DOWN does.
+    (Tucks and spins are left out, since getting to them depends on
+    when gravity moves the piece.)
+    """
+    board = game.board
+    type_ID = game.piece.type_ID
+    seen = set()
+
+    for turns in ((), (engine.CW,), (engine.CW, engine.CW), (engine.CCW,)):
+        for shift, dir in ((engine.LEFT, "left"), (engine.RIGHT, "right")):
+            piece = engine.Piece(type_ID, game.piece.centre_pos)
+            if not all(piece.rotate("cw" if turn == engine.CW else "ccw",
+                                    board) for turn in turns):
+                break
+
+            moves = list(turns)
+            while True:
+                y = piece.y
+                while piece.fits(board, piece.x, y + 1, piece.rot_index):
+                    y += 1
+
+                placement = (piece.x, y, piece.rot_index)
+                if placement not in seen:
+                    seen.add(placement)
+                    yield (*placement, list(moves))
+
+                if not piece.shift(dir, board):
+                    break
+                moves.append(shift)
+
+def evaluate(filled):
+    """
+    Scores a playfield (bool array, True where filled) with the usual
+    weights for line clears, height, holes and bumpiness.
+    """
+    full = filled.all(axis=1)
+    lines = full.sum()
+    filled = filled[~full]
+
+    rows = len(filled)
+    tops = np.where(filled.any(axis=0), filled.argmax(axis=0), rows)
+    heights = rows - tops
+    holes = heights.sum() - filled.sum()
+    bumpiness = np.abs(np.diff(heights)).sum()
+
+    return (0.76 * lines - 0.51 * heights.sum()
+            - 0.36 * holes - 0.18 * bumpiness)
+
+def greedy(game, rng):
+    """Picks the best placement for the current piece by evaluate()."""
+    board = game.board
+    shape = engine.SHAPES[game.piece.type_ID]
+    filled = board.cells[board.hidden:] >= 0
+
+    best = None
+    options = []
+    for x, y, rot, moves in drop_placements(game):
+        after = filled.copy()
+        for dx, dy in shape[rot]:
+            if y + dy >= 0:
+                after[y + dy, x + dx] = True
+
+        score = evaluate(after)
+        if best is None or score > best:
+            best = score
+            options = [moves]
+        elif score == best:
+            options.append(moves)
+
+    return rng.choice(options) if options else []
+
+def random_bot(game, rng):
+    """Drops each piece anywhere it can go. A baseline to beat."""
+    options = [moves for _, _, _, moves in drop_placements(game)]
+    return rng.choice(options) if options else []
+
+BOTS = {
+    "greedy": greedy,
+    "random": random_bot,
+    }
+
+def load_bot(name):
+    """Returns the bot function called name (see BOTS)."""
+    if name in BOTS:
+        return BOTS[name]
+
+    if ":" not in name:
+        raise Exception(f"no bot called {name!r} (try one of "
+                        f"{', '.join(BOTS)}, or module:function)")
+    module, function = name.split(":", 1)
+    return getattr(importlib.import_module(module), function)
+
+# ------ Playing games (in worker processes) ------ #
+def play_game(bot_name, seed, level, max_frames=MAX_FRAMES):
+    """
+    Plays one game with a bot, headlessly. Returns its result (a dict).
+    pieces counts the pieces that spawned, including the first.
+    """
+    result = {"bot": bot_name, "seed": seed, "level": level}
+    start = time.perf_counter()
+
+    try:
+        bot = load_bot(bot_name)
+        rng = random.Random(seed)
+        game = engine.Game(level, seed=seed)
+        step = game.step
+
+        pieces = 1
+        frames = 0
+        moves = iter(bot(game, rng))
+        while frames < max_frames and not game.game_over:
+            pressed = next(moves, None)
+            if pressed is None:
+                pressed = held = engine.DOWN
+            else:
+                held = 0
+
+            frames += 1
+            if step(pressed, held) & engine.SPAWN:
+                pieces += 1
+                moves = iter(bot(game, rng))
+
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+
+    result.update(score=game.points, lines=game.lines,
+                  level_reached=game.level, pieces=pieces, frames=frames,
+                  topped_out=game.game_over,
+                  seconds=round(time.perf_counter() - start, 3))
+    return result
+
+# ------ Class for running tournaments ------ #
+class Tournament:
+    """
+    Plays games in a process pool and passes each result to write() as
+    it comes in. A dead worker doesn't stop the run (see MAX_CRASHES).
+    """
+    def __init__(self, write, workers=None, max_frames=MAX_FRAMES,
+                 report=None):
+        self.write = write
+        self.workers = workers or os.cpu_count() or 1
+        self.max_frames = max_frames
+        self.report = report # Called with progress lines, if not None
+
+        self.total = 0 # Games to play
+        self.done = 0 # Games with a result written
+        self.errors = 0 # ...which were errors, including crashes
+        self.crashes = 0 # Times the pool had to be started again
+        self.seconds = 0 # Since the run started
+
+        self.scores = {} # Bot -> [total score, total lines, games]
+
+    def run(self, games):
+        """Plays every (bot, seed, level) in games."""
+        games = list(games)
+        self.total = len(games)
+        queued = deque(games)
+        suspects = deque() # (game, crashes) that were in a pool that died
+        running = {} # Future -> (game, crashes, whether it ran alone)
+
+        start = time.perf_counter()
+        last_report = start
+        pool = ProcessPoolExecutor(self.workers)
+        try:
+            while queued or suspects or running:
+                if suspects:
+                    # One at a time, so a crash shows which game it was
+                    if not running:
+                        game, crashes = suspects.popleft()
+                        future = pool.submit(play_game, *game,
+                                             self.max_frames)
+                        running[future] = (game, crashes, True)
+                else:
+                    while queued and len(running) < self.workers * \
+                            GAMES_PER_WORKER:
+                        game = queued.popleft()
+                        future = pool.submit(play_game, *game,
+                                             self.max_frames)
+                        running[future] = (game, 0, False)
+
+                finished, _ = wait(running, timeout=REPORT_INTERVAL,
+                                   return_when=FIRST_COMPLETED)
+
+                broken = False
+                for future in finished:
+                    game, crashes, alone = running.pop(future)
+                    try:
+                        self.record(future.result())
+                    except BrokenProcessPool:
+                        broken = True
+                        if alone:
+                            self.crashed(suspects, game, crashes + 1)
+                        else:
+                            suspects.append((game, crashes))
+
+                if broken:
+                    # Every game left in the pool went down with it
+                    for game, crashes, _ in running.values():
+                        suspects.append((game, crashes))
+                    running.clear()
+                    pool.shutdown()
+                    pool = ProcessPoolExecutor(self.workers)
+                    self.crashes += 1
+
+                now = time.perf_counter()
+                self.seconds = now - start
+                if self.report and now - last_report >= REPORT_INTERVAL:
+                    last_report = now
+                    self.report(self.progress())
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+        self.seconds = time.perf_counter() - start
+
+    def crashed(self, suspects, game, crashes):
+        """
+        Called when a game killed its worker, playing on its own. Tries
+        it again, unless it's done that MAX_CRASHES times.
+        """
+        if crashes < MAX_CRASHES:
+            suspects.appendleft((game, crashes))
+            return
+
+        bot, seed, level = game
+        self.record({"bot": bot, "seed": seed, "level": level,
+                     "error": "worker crashed"})
+
+    def record(self, result):
+        self.write(result)
+        self.done += 1
+
+        if "error" in result:
+            self.errors += 1
+            return
+
+        totals = self.scores.setdefault(result["bot"], [0, 0, 0])
+        totals[0] += result["score"]
+        totals[1] += result["lines"]
+        totals[2] += 1
+
+    def games_per_second(self):
+        return self.done / self.seconds if self.seconds else 0
+
+    def progress(self):
+        return (f"{self.done}/{self.total} games, "
+                f"{self.games_per_second():.1f} games/s")
+
+    def summary(self):
+        """Returns a few lines on the whole run."""
+        lines = [f"{self.done} games in {self.seconds:.1f} s: "
+                 f"{self.games_per_second():.1f} games/s on {self.workers} "
+                 f"workers, {self.errors} errors, {self.crashes} crashes"]
+        for bot, (score, cleared, games) in self.scores.items():
+            lines.append(f"  {bot}: mean score {score / games:.0f}, "
+                         f"mean lines {cleared / games:.1f} "
+                         f"({games} games)")
+        return "\n".join(lines)
+
+def parse_levels(text):
+    """Reads start levels like "0-19,29,30" as a list."""
+    levels = []
+    for part in text.split(","):
+        first, _, last = part.partition("-")
+        levels += range(int(first), int(last or first) + 1)
+
+    if not all(0 <= level <= rules.max_level for level in levels):
+        raise ValueError(f"levels go from 0 to {rules.max_level}")
+    return levels
+
+if __name__ == "__main__":
+    # Usage: python tournament.py --bot greedy --bot mybot:plan
+    #            --seeds 10000 [--levels 0-19,29,30] [-o results.jsonl]
+    parser = argparse.ArgumentParser(description="Tetrix bot tournament")
+    parser.add_argument("--bot", action="append", dest="bots",
+                        metavar="NAME",
+                        help=f"bot to play ({', '.join(BOTS)} or "
+                             f"module:function); can be given more than "
+                             f"once (default: greedy)")
+    parser.add_argument("--seeds", type=int, default=100, metavar="N",
+                        help="games per bot and level, seeded 1 to N")
+    parser.add_argument("--first-seed", type=int, default=1)
+    # The menu's levels, plus 29 and 30 which it has shortcuts for
+    parser.add_argument("--levels", type=parse_levels,
+                        default=list(range(20)) + [29, 30],
+                        help="start levels (default: 0-19,29,30)")
+    parser.add_argument("--max-frames", type=int, default=MAX_FRAMES,
+                        help="stop games that last longer than this")
+    parser.add_argument("--workers", type=int,
+                        help="worker processes (default: one per core)")
+    parser.add_argument("-o", "--output", default="-",
+                        help="file for the results, a JSON line per game "
+                             "(default: stdout)")
+    args = parser.parse_args()
+
+    bots = args.bots or ["greedy"]
+    for bot in bots:
+        load_bot(bot) # Fails here rather than in every game
+    seeds = range(args.first_seed, args.first_seed + args.seeds)
+    games = [(bot, seed, level) for seed in seeds for level in args.levels
+             for bot in bots]
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+
+    def write(result):
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+
+    tournament = Tournament(write, args.workers, args.max_frames,
+                            report=lambda line: print(line, file=sys.stderr))
+    try:
+        tournament.run(games)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        print(tournament.summary(), file=sys.stderr)